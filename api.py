@@ -0,0 +1,229 @@
+#!/usr/bin/python3
+
+import asyncio
+import random
+import socket
+import threading
+from lic import Client_Session, Round_Options, Session_Error, rate_Search, synchronize_Session
+from lis import Server_Capacity, TCP_Connection_Handler
+from impairment import check_Impairment
+from packet import HEADER_SIZE
+from protocol import Message_Stream
+from udp_io import MAX_DATAGRAM, Batch_Sender
+
+# Importable API for running tests from a long-lived process, e.g. a monitoring job that probes a link every
+# few seconds. A Session keeps its control connection, session id and UDP socket open across any number of
+# probes, so each probe costs one round rather than a new interpreter, discovery, connection and handshake.
+# A Server runs lis.py's session handling on a background thread of the calling process.
+#
+#     with Server(echo=True).start() as server, Session('127.0.0.1', server.port, rt=True) as session:
+#         while True:
+#             result, client_result = session.probe(100)
+#             ...
+#
+# Probes are single rounds at 1472 byte packets (a full 1500 byte MTU frame) and a quarter of a second by
+# default, which is enough to spot loss and latency at modest rates without loading the link for long.
+
+# A persistent test session with a lis.py server. Raises Session_Error if the server cannot be reached or
+# refuses the session. Only one probe runs at a time; concurrent callers wait their turn
+# Param: address: The address of the server
+# Param: port: The TCP port of the server
+# Param: rt: Whether to run in round trip mode, measuring RTT and jitter. The server must echo
+# Param: duration: The length of each probe in seconds
+# Param: integrity: Whether packets carry a CRC and corrupted packets are analyzed bit by bit
+# Param: tcp: Whether probes stream over TCP instead of UDP, measuring goodput and retransmits (see tcpbulk)
+# Param: impairment: Artificial impairment settings for the server to apply (see impairment_Plan). Default is none
+# Param: timeout: The number of seconds to wait for the server before giving up, or None to wait indefinitely
+# Param: log: The function progress messages are passed to. Default discards them
+class Session:
+
+    def __init__(self, address='localhost', port=62994, rt=False, duration=0.25, integrity=False, tcp=False, impairment=None, timeout=None, log=None):
+        if impairment is None:
+            impairment = {'seed': random.getrandbits(32), 'loss': 0}
+        error = check_Impairment(impairment)
+        if error is not None:
+            raise ValueError(error)
+        if duration <= 0 or duration > 60:
+            raise ValueError("Duration must be in the range 0 < x <= 60")
+
+        try:
+            tcp_socket = socket.create_connection((address, port), timeout)
+        except OSError as error:
+            raise Session_Error(f"Cannot connect to {address}:{port}: {error}") from error
+        tcp_socket.settimeout(timeout)
+        stream = Message_Stream(tcp_socket)
+        try:
+            udp_port, session_id = synchronize_Session(stream)
+        except (Session_Error, OSError) as error:
+            tcp_socket.close()
+            raise Session_Error(f"Cannot open a session with {address}:{port}: {error}") from error
+
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sender = Batch_Sender(udp_socket, (address, udp_port))
+        self.address = address
+        self.port = port
+        self.stream = stream
+        self.udp_socket = udp_socket
+        options = Round_Options(impairment, rt, duration, integrity, tcp=tcp)
+        # The server would otherwise keep every round's result until the session ends, so a session left open
+        # for days would grow without bound. The caller gets each result as its probe finishes instead
+        options.soak = True
+        self.session = Client_Session(stream, sender, udp_socket, session_id, options, log=log or discard)
+        self.round = 1
+        self.closed = False
+        self.lock = threading.Lock()
+
+    # Runs a single round at rate mbps. Returns the server's result for it and, in round trip mode, the client's
+    # (else None), as the results tables of lic.py show them
+    # Param: rate: The rate in mbps
+    # Param: packet_size: The size in bytes of every packet sent
+    def probe(self, rate, packet_size=1472):
+        self._check_Probe(rate, packet_size)
+        with self.lock:
+            current_round = self._next_Rounds(1)
+            return self._run(self.session.run_Round, current_round, rate * 1000000, packet_size)
+
+    # Searches for the highest rate up to max_rate mbps that the link sustains with a 'pass' rating, as lic.py
+    # -search does. Returns the per-probe results and the best rate in mbps
+    # Param: max_rate: The upper bound of the search in mbps
+    # Param: probes: The maximum number of rounds to run
+    # Param: resolution: The bracket width in mbps at which the search stops
+    # Param: packet_size: The size in bytes of every packet sent
+    def search(self, max_rate, probes=8, resolution=5, packet_size=1472):
+        self._check_Probe(max_rate, packet_size)
+        if probes < 1:
+            raise ValueError("A search needs at least 1 probe")
+        with self.lock:
+            first_round = self._next_Rounds(probes)
+            trajectory, best_rate = self._run(rate_Search, self.session, first_round, probes, max_rate * 1000000, resolution * 1000000, packet_size)
+            return trajectory, best_rate / 1000000
+
+    # Returns which of the given packet sizes reach the server without IP fragmentation
+    def probe_MTU(self, sizes):
+        with self.lock:
+            return self._run(self.session.probe_MTU, list(sizes))
+
+    # Ends the session and closes its sockets. Safe to call more than once
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            try:
+                self.stream.send({'status': 'test_complete'})
+                self.stream.read()
+            except OSError:
+                pass
+            self.stream.close()
+            self.udp_socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _check_Probe(self, rate, packet_size):
+        if packet_size < HEADER_SIZE or packet_size > MAX_DATAGRAM:
+            raise ValueError(f"Packet sizes must be in the range {HEADER_SIZE} <= x <= {MAX_DATAGRAM}")
+        if rate * 1000000 * self.session.options.duration < packet_size * 8:
+            raise ValueError("The rate is too low to send a single packet in a probe. Increase the rate or duration")
+
+    # Reserves count round numbers. Every round of a session has its own number, so late packets of an earlier
+    # probe are never counted towards a later one
+    def _next_Rounds(self, count):
+        if self.closed:
+            raise Session_Error("The session is closed")
+        first_round = self.round
+        self.round = self.round + count
+        return first_round
+
+    # Runs a round function, closing the session if it fails. The server ends the session whenever it rejects a
+    # round, and after a lost connection or an unexpected error the session's state is unknown
+    def _run(self, function, *args):
+        try:
+            return function(*args)
+        except Session_Error:
+            self._abandon()
+            raise
+        except OSError as error:
+            self._abandon()
+            raise Session_Error(f"Lost connection to {self.address}:{self.port}: {error}") from error
+        except Exception as error:
+            self._abandon()
+            raise Session_Error(f"Session with {self.address}:{self.port} failed: {error}") from error
+
+    # Marks the session closed and closes its sockets without telling the server, which has already gone
+    def _abandon(self):
+        self.closed = True
+        self.stream.close()
+        self.udp_socket.close()
+
+# A lis.py server running on a background thread of the calling process
+# Param: port: The TCP port to listen on. 0 picks a free port, which is available as port once started
+# Param: echo: Whether to run in round trip mode, echoing every packet
+# Param: host: The address to listen on. Default is every IPv4 interface, like the rest of the tester
+# Param: max_sessions: The maximum number of concurrent test sessions
+# Param: max_rate: The maximum aggregate rate in mbps of all concurrent sessions, or None for no limit
+# Param: workers: The number of receive processes per session (see shards.Receiver_Shards)
+# Param: hot_path: An optional open file the hot path profile of every round is appended to
+# Param: log: The function progress messages are passed to. Default discards them
+class Server:
+
+    def __init__(self, port=0, echo=False, host='0.0.0.0', max_sessions=16, max_rate=None, workers=1, hot_path=None, log=None):
+        self.port = port
+        self.echo = echo
+        self.host = host
+        self.max_sessions = max_sessions
+        self.max_rate = max_rate
+        self.workers = workers
+        self.hot_path = hot_path
+        self.log = log or discard
+        self.thread = None
+        self.loop = None
+        self.stopped = None
+        self.error = None
+
+    # Starts serving and returns once the server accepts connections. Raises OSError if it cannot listen
+    def start(self):
+        started = threading.Event()
+        self.thread = threading.Thread(target=asyncio.run, args=(self._serve(started),), daemon=True)
+        self.thread.start()
+        started.wait()
+        if self.error is not None:
+            self.thread.join()
+            raise self.error
+        return self
+
+    # Stops accepting connections, ends every session in progress and waits for the server thread to exit
+    def close(self):
+        if self.thread is None:
+            return
+        self.loop.call_soon_threadsafe(self.stopped.set)
+        self.thread.join()
+        self.thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    async def _serve(self, started):
+        self.loop = asyncio.get_running_loop()
+        self.stopped = asyncio.Event()
+        capacity = Server_Capacity(self.max_sessions, self.max_rate)
+        try:
+            server = await asyncio.start_server(lambda reader, writer: TCP_Connection_Handler(reader, writer, self.echo, capacity, self.workers, self.hot_path, self.log), self.host, self.port)
+        except OSError as error:
+            self.error = error
+            started.set()
+            return
+        self.port = server.sockets[0].getsockname()[1]
+        started.set()
+        # Leaving the loop cancels the session coroutines still running, which close their sockets as they go
+        async with server:
+            await self.stopped.wait()
+
+def discard(*args):
+    pass
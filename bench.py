@@ -0,0 +1,393 @@
+#!/usr/bin/python3
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import platform
+import socket
+import statistics
+import threading
+import time
+from tabulate import tabulate
+from histogram import Log_Histogram
+from pacer import Pacer
+from packet import HEADER_SIZE, Packet_Writer, Sequence_Tracker
+from protocol import PROTOCOL_VERSION, Message_Stream, read_Message, send_Message
+from shards import Pipe_Signal
+from udp_io import MAX_DATAGRAM, Batch_Sender, Recv_Ring, Stop_Signal, size_Receive_Buffer, size_Send_Buffer
+from lis import UDP_Listener, UDP_Reply
+
+# Benchmark traffic is stamped with this session and round, and filled with this byte
+SESSION_ID = 0xBE7C
+ROUND = 1
+PAYLOAD_BYTE = 0x5A
+# The most packets per second a single blaster process is expected to reach, which sizes its sequence space
+MAX_PPS = 2000000
+# Seconds between starting the helper processes and their first packet, so they all start together
+START_DELAY = 0.2
+# Packets sent per call by the unpaced blasters
+BLAST_BURST = 64
+# The benchmarks, in the order they run
+BENCHMARKS = ['sender', 'sender_crc', 'receiver', 'echo', 'relay', 'control']
+# Metrics compared against the baseline: whether a higher value is better, and how many times the tolerance a
+# worse value may move before it is flagged. The control channel's round trips take tens of microseconds, so
+# its rate and above all its latency percentiles swing far more run to run than the packet rates do.
+# Everything else is informational
+COMPARED = {'pps': (True, 1), 'round_trips': (True, 2.5), 'p50_ms': (False, 5), 'p99_ms': (False, 5)}
+
+def main():
+
+    # Parse required arguments
+    parser = argparse.ArgumentParser(description='LAN Integrity Tester loopback benchmarks')
+    parser.add_argument('-d', dest='duration', type=float, nargs='?', help='The length of each benchmark run in seconds. Default is 1')
+    parser.add_argument('-r', dest='repeats', type=int, nargs='?', help='The number of runs of each benchmark, whose median is kept. Default is 5')
+    parser.add_argument('-sz', dest='packet_size', type=int, nargs='?', help='The packet size in bytes. Default is 1472')
+    parser.add_argument('-st', dest='senders', type=int, nargs='?', help='The number of blaster processes driving the receive benchmarks. Default is 2')
+    parser.add_argument('-only', dest='only', type=str, nargs='?', help=f"A comma separated list of benchmarks to run. Default is all of {','.join(BENCHMARKS)}")
+    parser.add_argument('-o', dest='output', type=str, nargs='?', help='The JSON file the results are written to, which can serve as a later baseline')
+    parser.add_argument('-b', dest='baseline', type=str, nargs='?', help='A JSON file of earlier results to compare against. Regressions make the exit status 1')
+    parser.add_argument('-t', dest='tolerance', type=float, nargs='?', help='The change in percent beyond which a worse packet rate is flagged as a regression. The control round trip rate is allowed 2.5 times as much and its latency percentiles 5 times. Default is 10')
+    args = parser.parse_args()
+
+    duration = 1
+    if args.duration is not None:
+        if args.duration <= 0 or args.duration > 60:
+            print("Error: Argument 'duration' must be in the range 0 < x <= 60")
+            exit(1)
+        duration = args.duration
+
+    repeats = 5
+    if args.repeats is not None:
+        if args.repeats < 1 or args.repeats > 100:
+            print("Error: Argument 'repeats' must be in the range 1 <= x <= 100")
+            exit(1)
+        repeats = args.repeats
+
+    packet_size = 1472
+    if args.packet_size is not None:
+        if args.packet_size < HEADER_SIZE or args.packet_size > MAX_DATAGRAM:
+            print(f"Error: Argument 'packet_size' must be in the range {HEADER_SIZE} <= x <= {MAX_DATAGRAM}")
+            exit(1)
+        packet_size = args.packet_size
+
+    senders = 2
+    if args.senders is not None:
+        if args.senders < 1 or args.senders > 64:
+            print("Error: Argument 'senders' must be in the range 1 <= x <= 64")
+            exit(1)
+        senders = args.senders
+
+    names = BENCHMARKS
+    if args.only:
+        names = args.only.split(',')
+        for name in names:
+            if name not in BENCHMARKS:
+                print(f"Error: Unknown benchmark '{name}'. Benchmarks are {', '.join(BENCHMARKS)}")
+                exit(1)
+
+    tolerance = 10
+    if args.tolerance is not None:
+        if args.tolerance < 0:
+            print("Error: Argument 'tolerance' must be at least 0")
+            exit(1)
+        tolerance = args.tolerance
+
+    baseline = None
+    if args.baseline:
+        try:
+            with open(args.baseline) as baseline_file:
+                baseline = json.load(baseline_file)
+        except (OSError, json.JSONDecodeError) as error:
+            print(f"Error: Cannot read the baseline: {error}")
+            exit(1)
+
+    settings = {'duration': duration, 'repeats': repeats, 'packet_size': packet_size, 'senders': senders}
+    results = run_Benchmarks(names, settings)
+
+    print("\n")
+    print("Benchmark results:")
+    rows = [dict(benchmark=name, **metrics) for name, metrics in results.items()]
+    print(tabulate(rows, headers={'benchmark': "Benchmark", 'pps': "Packets/s", 'mbps': "Mbps", 'offered_pps': "Offered packets/s", 'loss': "Loss (%)",
+                                  'round_trips': "Round trips/s", 'p50_ms': "p50 (ms)", 'p99_ms': "p99 (ms)"}, tablefmt="grid"))
+
+    report = {
+        'version': PROTOCOL_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.time(),
+        'settings': settings,
+        'benchmarks': results
+    }
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+        print(f"Results saved to {args.output}")
+
+    # Compare against the baseline and flag anything that got worse by more than the tolerance
+    if baseline is not None:
+        if baseline.get('settings') != settings:
+            print(f"Warning: The baseline was run with different settings ({baseline.get('settings')}), so results may not be comparable")
+        comparison = compare_Results(results, baseline.get('benchmarks', {}), tolerance)
+        print(f"Comparison with {args.baseline}:")
+        print(tabulate(comparison, headers={'benchmark': "Benchmark", 'metric': "Metric", 'baseline': "Baseline", 'current': "Current", 'change': "Change (%)", 'limit': "Tolerance (%)", 'flag': "Flag"}, tablefmt="grid"))
+        regressions = [row for row in comparison if row['flag'] == 'REGRESSION']
+        if regressions:
+            print(f"{len(regressions)} regression(s) beyond the tolerance")
+            exit(1)
+        print("No regressions beyond the tolerance")
+
+
+# Runs each named benchmark settings['repeats'] times and returns the median of each metric over its runs. A
+# single lucky run cannot set the result the way keeping the best one did, so reruns of the same code agree
+# Param: names: The benchmarks to run (see BENCHMARKS)
+# Param: settings: The duration, repeats, packet_size and senders of the runs
+def run_Benchmarks(names, settings):
+    duration = settings['duration']
+    packet_size = settings['packet_size']
+    senders = settings['senders']
+    runs = {
+        'sender': lambda: bench_Sender(duration, packet_size, False),
+        'sender_crc': lambda: bench_Sender(duration, packet_size, True),
+        'receiver': lambda: bench_Receiver(UDP_Listener, duration, packet_size, senders),
+        'echo': lambda: bench_Receiver(UDP_Reply, duration, packet_size, senders),
+        'relay': lambda: bench_Receiver(UDP_Listener, duration, packet_size, senders, relay=True),
+        'control': lambda: bench_Control(duration)
+    }
+    results = {}
+    for name in names:
+        repeats = []
+        for repeat in range(settings['repeats']):
+            print(f"Running {name} benchmark ({repeat + 1} of {settings['repeats']})...")
+            repeats.append(runs[name]())
+        results[name] = {metric: statistics.median(run[metric] for run in repeats) for metric in repeats[0]}
+    return results
+
+# Returns a row for every compared metric present in both the results and the baseline, flagging the ones
+# that got worse by more than their share of tolerance percent (see COMPARED)
+def compare_Results(results, baseline, tolerance):
+    rows = []
+    for name, metrics in results.items():
+        for metric, (higher, scale) in COMPARED.items():
+            if metric not in metrics or metric not in baseline.get(name, {}):
+                continue
+            previous = baseline[name][metric]
+            current = metrics[metric]
+            change = (current - previous) / previous * 100 if previous else 0
+            worse = -change if higher else change
+            limit = tolerance * scale
+            rows.append({
+                'benchmark': name,
+                'metric': metric,
+                'baseline': previous,
+                'current': current,
+                'change': change,
+                'limit': limit,
+                'flag': 'REGRESSION' if worse > limit else ('improved' if -worse > limit else '')
+            })
+    return rows
+
+
+# Measures the client's send loop: a Packet_Writer and Batch_Sender released by a Pacer whose target is out of
+# reach, so every wait() releases a full burst and the rate is bound by the loop itself. The packets go to a
+# loopback socket that is never read, so the kernel discards them once its buffer fills
+# Param: duration: The length of the run in seconds
+# Param: packet_size: The size in bytes of every packet sent
+# Param: checksum: Whether every packet's CRC is stamped, as in integrity mode
+def bench_Sender(duration, packet_size, checksum):
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    size_Send_Buffer(udp_socket, MAX_PPS * packet_size * 8)
+    sender = Batch_Sender(udp_socket, sink.getsockname())
+    writer = Packet_Writer(SESSION_ID, ROUND, PAYLOAD_BYTE, packet_size, checksum=checksum)
+
+    pacer = Pacer(int(MAX_PPS * 10 * duration), duration)
+    pacer.begin()
+    stop = pacer.start + duration
+    burst = pacer.wait()
+    while burst > 0 and time.perf_counter() < stop:
+        sender.send_Sequenced(writer, burst)
+        burst = pacer.wait()
+    pacer.end()
+
+    udp_socket.close()
+    sink.close()
+    # The pacer has always released one more burst than the loop sent, so count what the writer produced
+    pps = writer.sequence / (pacer.finish - pacer.start)
+    return {'pps': pps, 'mbps': pps * packet_size * 8 / 1000000}
+
+# Measures one of the server's receive loops (UDP_Listener, or UDP_Reply for the echo path) against blaster
+# processes sending as fast as they can, optionally through a user-space relay standing in for a middlebox.
+# The loop's rate is the unique packets it accounted for over the run; the blasters' combined rate is what
+# was offered to it
+# Param: listener: The receive loop under test
+# Param: duration: The length of the run in seconds
+# Param: packet_size: The size in bytes of every packet sent
+# Param: senders: The number of blaster processes
+# Param: relay: Whether the blasters send through a relay process instead of straight to the loop
+def bench_Receiver(listener, duration, packet_size, senders, relay=False):
+    span = int(MAX_PPS * duration)
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.bind(('127.0.0.1', 0))
+    size_Receive_Buffer(udp_socket, MAX_PPS * packet_size * 8)
+    size_Send_Buffer(udp_socket, MAX_PPS * packet_size * 8)
+    tracker = Sequence_Tracker(SESSION_ID, ROUND, span * senders)
+    statistics = [0, 0, tracker]
+    stop_signal = Stop_Signal()
+    listener_thread = threading.Thread(target=listener, args=(udp_socket, PAYLOAD_BYTE, packet_size, tracker, statistics, None, stop_signal,))
+    listener_thread.start()
+
+    address = udp_socket.getsockname()
+    relay_pipe = None
+    if relay:
+        relay_pipe, child = multiprocessing.Pipe()
+        relay_process = multiprocessing.Process(target=relay_Worker, args=(child, address,), daemon=True)
+        relay_process.start()
+        address = relay_pipe.recv()
+
+    start = time.perf_counter() + START_DELAY
+    pipes = []
+    processes = []
+    for index in range(senders):
+        parent, child = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=blast_Worker, args=(child, address, index * span, span, packet_size, start, duration,), daemon=True)
+        process.start()
+        pipes.append(parent)
+        processes.append(process)
+    offered = sum(conn.recv() for conn in pipes)
+    for process in processes:
+        process.join()
+
+    if relay:
+        relay_pipe.send(None)
+        relay_process.join()
+    stop_signal.set()
+    listener_thread.join()
+    stop_signal.close()
+    udp_socket.close()
+
+    received = statistics[0]
+    return {
+        'pps': received / duration,
+        'mbps': received / duration * packet_size * 8 / 1000000,
+        'offered_pps': offered / duration,
+        'loss': (offered - received) / offered * 100 if offered > 0 else 0
+    }
+
+# Runs in each blaster process. Sends unpaced bursts of sequenced packets to address from start for duration
+# seconds (or until its share of the sequence space runs out) and reports the number sent
+# Param: conn: The blaster's end of the pipe
+# Param: address: The (host, port) to send to
+# Param: first_sequence: The first sequence number of this blaster's share
+# Param: span: The size of this blaster's share of the sequence space
+# Param: packet_size: The size in bytes of every packet sent
+# Param: start: The perf_counter() time of the first packet
+# Param: duration: The length of the run in seconds
+def blast_Worker(conn, address, first_sequence, span, packet_size, start, duration):
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    size_Send_Buffer(udp_socket, MAX_PPS * packet_size * 8)
+    sender = Batch_Sender(udp_socket, address)
+    writer = Packet_Writer(SESSION_ID, ROUND, PAYLOAD_BYTE, packet_size, first_sequence)
+
+    time.sleep(max(0, start - time.perf_counter()))
+    stop = start + duration
+    sent = 0
+    while sent + BLAST_BURST <= span and time.perf_counter() < stop:
+        try:
+            sender.send_Sequenced(writer, BLAST_BURST)
+        except OSError:
+            # ENOBUFS: the send queue is full, which is the loop under test falling behind
+            pass
+        sent = writer.sequence - first_sequence
+
+    conn.send(sent)
+    udp_socket.close()
+    conn.close()
+
+# Runs in the relay process. Forwards every datagram arriving on its own loopback socket to address until
+# told to stop, like a user-space middlebox between client and server
+# Param: conn: The relay's end of the pipe. The relay's address is sent back on it, and any message stops it
+# Param: address: The (host, port) datagrams are forwarded to
+def relay_Worker(conn, address):
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.bind(('127.0.0.1', 0))
+    size_Receive_Buffer(udp_socket, MAX_PPS * MAX_DATAGRAM * 8)
+    forward = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    size_Send_Buffer(forward, MAX_PPS * MAX_DATAGRAM * 8)
+    sender = Batch_Sender(forward, address)
+    signal = Pipe_Signal(conn)
+    ring = Recv_Ring(udp_socket, signal)
+    conn.send(udp_socket.getsockname())
+
+    while True:
+        try:
+            count = ring.recv_Batch(1)
+            for i in range(count):
+                try:
+                    sender.send(ring.packet(i), 1)
+                except OSError:
+                    pass
+        except socket.timeout:
+            if signal():
+                break
+
+    ring.close()
+    forward.close()
+    udp_socket.close()
+    conn.close()
+
+# Measures the control channel: back-to-back round configuration messages over loopback TCP, sent through
+# the client's Message_Stream and echoed by an asyncio handler using the server's read_Message/send_Message
+# Param: duration: The length of the run in seconds
+def bench_Control(duration):
+    ready = threading.Event()
+    bound = []
+    stopped = []
+    loop = asyncio.new_event_loop()
+
+    async def handler(reader, writer):
+        while True:
+            message = await read_Message(reader)
+            if message is None:
+                break
+            await send_Message(writer, message)
+        writer.close()
+
+    async def serve():
+        server = await asyncio.start_server(handler, '127.0.0.1', 0)
+        bound.append(server.sockets[0].getsockname())
+        stopped.append(asyncio.Event())
+        ready.set()
+        async with server:
+            await stopped[0].wait()
+
+    server_thread = threading.Thread(target=loop.run_until_complete, args=(serve(),), daemon=True)
+    server_thread.start()
+    ready.wait()
+
+    tcp_socket = socket.create_connection(bound[0])
+    stream = Message_Stream(tcp_socket)
+    message = {'status': 'test_in_progress', 'round': ROUND, 'rate': 100.0, 'packet_count': 8928, 'packet_size': 1400, 'expected_payload': PAYLOAD_BYTE,
+               'impairment': {'seed': 0, 'loss': 0}, 'streams': 1, 'integrity': False, 'telemetry': 0, 'soak': False, 'duration': 1, 'profile': None}
+    histogram = Log_Histogram()
+    count = 0
+    start = time.perf_counter()
+    stop = start + duration
+    while time.perf_counter() < stop:
+        sent = time.perf_counter_ns()
+        stream.send(message)
+        stream.read()
+        histogram.record(time.perf_counter_ns() - sent)
+        count = count + 1
+    elapsed = time.perf_counter() - start
+    stream.close()
+
+    loop.call_soon_threadsafe(stopped[0].set)
+    server_thread.join()
+    loop.close()
+    return {'round_trips': count / elapsed, 'p50_ms': histogram.percentile(50) / 1000000, 'p99_ms': histogram.percentile(99) / 1000000}
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python3
+
+import json
+import os
+import selectors
+import socket
+import time
+from protocol import PROTOCOL_VERSION
+
+# Replies to broadcasts are collected for this many seconds...
+DISCOVERY_WINDOW = 0.5
+# ...while the broadcast is repeated this many times, evenly spread over the window, in case one is lost
+DISCOVERY_ATTEMPTS = 3
+# Discovered servers are cached for this many seconds
+CACHE_TTL = 300
+# The default server cache file
+CACHE_PATH = os.path.join(os.path.expanduser('~'), '.lic_servers.json')
+
+# Broadcasts for servers once and returns every distinct server that replied within the window, in reply
+# order. Each server is a dict of its address, its TCP port, and whatever it advertised: protocol version,
+# capabilities and current load (servers predating adverts only send a port)
+# Param: broad_port: The port servers listen for broadcasts on
+# Param: window: The number of seconds replies are collected for
+# Param: attempts: The number of broadcasts sent over the window
+def discover_Servers(broad_port, window=DISCOVERY_WINDOW, attempts=DISCOVERY_ATTEMPTS):
+    broadcast = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    broadcast.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    broadcast.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(broadcast, selectors.EVENT_READ)
+
+    servers = {}
+    start = time.monotonic()
+    sent = 0
+    while True:
+        now = time.monotonic()
+        if now - start >= window:
+            break
+        # Repeat the broadcast on schedule, then wait for replies until the next one is due
+        if sent < attempts and now - start >= sent * window / attempts:
+            try:
+                broadcast.sendto(b'Hello', ('<broadcast>', broad_port))
+            except OSError:
+                pass
+            sent = sent + 1
+        due = start + (sent * window / attempts if sent < attempts else window)
+        if not selector.select(max(0, due - time.monotonic())):
+            continue
+        while True:
+            try:
+                udp_msg, udp_addr = broadcast.recvfrom(4096)
+            except (BlockingIOError, InterruptedError):
+                break
+            try:
+                advert = json.loads(udp_msg.decode('utf-8'))
+                port = int(advert['port'])
+            except (ValueError, KeyError, TypeError):
+                continue
+            servers[(udp_addr[0], port)] = dict(advert, address=udp_addr[0], port=port, seen=time.time())
+
+    selector.close()
+    broadcast.close()
+    return list(servers.values())
+
+# Returns the servers that can run the requested test, least loaded first: they must speak this protocol
+# version, and echo in round trip mode. Load is the larger of the fractions of the server's session and
+# bandwidth limits in use when it advertised
+# Param: servers: Discovered or cached servers (see discover_Servers)
+# Param: rt: Whether round trip mode is required
+def rank_Servers(servers, rt=False):
+    candidates = []
+    for server in servers:
+        if server.get('version') != PROTOCOL_VERSION:
+            continue
+        if rt and not server.get('capabilities', {}).get('echo', False):
+            continue
+        candidates.append(server)
+    return sorted(candidates, key=server_Load)
+
+# Returns the fraction of a server's capacity in use when it advertised, from 0 (idle) to 1 (full)
+def server_Load(server):
+    load = server.get('load', {})
+    sessions = load.get('sessions', 0) / load['max_sessions'] if load.get('max_sessions') else 0
+    rate = load.get('reserved_rate', 0) / load['max_rate'] if load.get('max_rate') else 0
+    return max(sessions, rate)
+
+# A registry of discovered servers kept on disk, so later runs within the TTL can skip broadcasting.
+# An unreadable or missing file is treated as an empty cache
+# Param: path: The cache file
+# Param: ttl: The number of seconds a discovered server is trusted for
+class Server_Cache:
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.servers = []
+        try:
+            with open(path) as cache_file:
+                self.servers = json.load(cache_file).get('servers', [])
+        except (OSError, ValueError, AttributeError):
+            self.servers = []
+
+    # Returns the cached servers discovered within the TTL
+    def fresh(self):
+        now = time.time()
+        return [server for server in self.servers if now - server.get('seen', 0) < self.ttl]
+
+    # Replaces the cache with newly discovered servers and saves it
+    def update(self, servers):
+        self.servers = servers
+        self.save()
+
+    # Drops a server, e.g. one that refused a connection, and saves the cache
+    def evict(self, address, port):
+        self.servers = [server for server in self.servers if (server.get('address'), server.get('port')) != (address, port)]
+        self.save()
+
+    # Writes the cache atomically, so an interrupted run cannot leave a half-written file behind
+    def save(self):
+        temporary = self.path + '.tmp'
+        try:
+            with open(temporary, 'w') as cache_file:
+                json.dump({'servers': self.servers}, cache_file, indent=2)
+            os.replace(temporary, self.path)
+        except OSError as error:
+            print(f"Warning: Cannot save the server cache: {error}")
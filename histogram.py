@@ -0,0 +1,78 @@
+#!/usr/bin/python3
+
+import math
+
+# A constant-memory log-bucketed (HDR-style) histogram of non-negative integer samples.
+# Values below 2**precision_bits are counted exactly. Above that, each power of two is split into
+# 2**(precision_bits - 1) linear sub-buckets, bounding the relative error of any reported value to
+# roughly 2**(1 - precision_bits) regardless of how many samples are recorded.
+# Param: precision_bits: The number of significant bits kept per sample (7 gives under 1.6% error)
+# Param: max_bits: Samples are clamped to below 2**max_bits (40 bits of nanoseconds is about 18 minutes)
+class Log_Histogram:
+
+    def __init__(self, precision_bits=7, max_bits=40):
+        self.precision_bits = precision_bits
+        self.sub_buckets = 1 << precision_bits
+        self.half = self.sub_buckets >> 1
+        self.max_value = (1 << max_bits) - 1
+        self.counts = [0] * (self.sub_buckets + (max_bits - precision_bits) * self.half)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value):
+        if value < 0:
+            value = 0
+        elif value > self.max_value:
+            value = self.max_value
+        self.counts[self._index(value)] += 1
+        self.count = self.count + 1
+        self.total = self.total + value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    # Returns the value at the given percentile (0 < percentile <= 100), or 0 if nothing was recorded
+    def percentile(self, percentile):
+        if self.count == 0:
+            return 0
+        target = max(1, math.ceil(percentile / 100 * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen = seen + count
+            if seen >= target:
+                return min(max(self._value(index), self.min), self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count > 0 else 0
+
+    def _index(self, value):
+        if value < self.sub_buckets:
+            return value
+        shift = value.bit_length() - self.precision_bits
+        return self.sub_buckets + (shift - 1) * self.half + (value >> shift) - self.half
+
+    # Returns the midpoint of the range of values counted by the bucket at index
+    def _value(self, index):
+        if index < self.sub_buckets:
+            return index
+        shift = (index - self.sub_buckets) // self.half + 1
+        mantissa = (index - self.sub_buckets) % self.half + self.half
+        return (mantissa << shift) + (1 << (shift - 1))
+
+# Interarrival jitter as defined by RFC 3550 section 6.4.1: a running estimate of the mean deviation of
+# the difference in transit time between consecutive packets, smoothed with a gain of 1/16.
+class Jitter_Estimator:
+
+    def __init__(self):
+        self.jitter = 0.0
+        self.previous = None
+
+    # Param: transit: The transit time (or round trip time) of the packet that just arrived
+    def record(self, transit):
+        if self.previous is not None:
+            self.jitter = self.jitter + (abs(transit - self.previous) - self.jitter) / 16
+        self.previous = transit
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+# Self-instrumentation of the send and receive loops. Loops read the clock around each burst or batch rather
+# than each packet, and add the nanoseconds spent to named phases here, so profiling a round costs a few clock
+# reads per batch, and nothing at all when it is off. Phase names are ';' separated stacks such as
+# 'sender;pacer;sleep', which map straight onto the collapsed stack format flame graph tools read.
+# Two kinds of counter are kept: time spent in a phase, which adds up to the loop's wall time, and delays,
+# such as how late a burst started, which are measured but not spent anywhere and so are left out of stacks.
+class Hot_Path_Profile:
+
+    def __init__(self):
+        self.spent = {}
+        self.delays = {}
+
+    # Adds ns nanoseconds spent in the phase named by path
+    def add(self, path, ns):
+        self._count(self.spent, path, ns)
+
+    # Records a delay of ns nanoseconds, such as how late the sender loop reached a packet's deadline
+    def delay(self, path, ns):
+        self._count(self.delays, path, ns)
+
+    def _count(self, counters, path, ns):
+        counter = counters.get(path)
+        if counter is None:
+            counters[path] = [ns, 1, ns]
+        else:
+            counter[0] = counter[0] + ns
+            counter[1] = counter[1] + 1
+            if ns > counter[2]:
+                counter[2] = ns
+
+    # Returns the counters as plain lists (total ns, count, max ns) that can be sent over a pipe or as JSON
+    def counters(self):
+        return {'spent': self.spent, 'delays': self.delays}
+
+    # Adds the counters of another profile of the same round, e.g. from a parallel sender process
+    def merge(self, counters):
+        for kind, mine in (('spent', self.spent), ('delays', self.delays)):
+            for path, (total, count, maximum) in counters.get(kind, {}).items():
+                counter = mine.get(path)
+                if counter is None:
+                    mine[path] = [total, count, maximum]
+                else:
+                    counter[0] = counter[0] + total
+                    counter[1] = counter[1] + count
+                    counter[2] = max(counter[2], maximum)
+
+# Returns a results table row for a round's counters: the milliseconds spent in every phase, and the mean and
+# maximum of every delay in microseconds
+# Param: round_number: The round the counters were recorded in
+# Param: counters: The counters, as returned by Hot_Path_Profile.counters()
+def profile_Row(round_number, counters):
+    row = {'Round': round_number}
+    for path, (total, count, maximum) in sorted(counters.get('spent', {}).items()):
+        row[f"{path} (ms)"] = total / 1000000
+    for path, (total, count, maximum) in sorted(counters.get('delays', {}).items()):
+        row[f"{path} mean (us)"] = total / count / 1000 if count > 0 else 0
+        row[f"{path} max (us)"] = maximum / 1000
+    return row
+
+# Writes a round's time spent as collapsed stack lines, 'frame;frame;frame value', one per phase, with values in
+# microseconds. Files of these lines can be fed to flamegraph.pl, speedscope and similar tools as they are
+# Param: output: A writable text stream
+# Param: prefix: The frames every line starts with, e.g. 'lic;round_3'
+# Param: counters: The counters, as returned by Hot_Path_Profile.counters()
+def write_Collapsed(output, prefix, counters):
+    for path, (total, count, maximum) in sorted(counters.get('spent', {}).items()):
+        output.write(f"{prefix};{path} {total // 1000}\n")
+    output.flush()
@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+import math
+import random
+import struct
+from packet import HEADER_SIZE
+
+# A round's impairment plan holds one byte of these flags per sequence number
+DROP = 1
+CORRUPT = 2
+REORDER = 4
+# Reordered packets are held back until this many later packets have arrived
+REORDER_DEPTH = 3
+# Reads the session id, round and sequence number out of a test packet header
+IDENTITY = struct.Struct('!III')
+
+# Returns the number of packets before the next event of the given per-packet probability (a geometric draw),
+# so building a plan costs one random number per impaired packet rather than one per packet
+def skip_Count(rng, probability):
+    if probability >= 1:
+        return 0
+    return int(math.log(1.0 - rng.random()) / math.log(1.0 - probability))
+
+# Marks each packet in [start, end) with flag independently with the given probability (the Bernoulli model)
+def mark_Bernoulli(flags, start, end, probability, flag, rng):
+    if probability <= 0:
+        return
+    position = start + skip_Count(rng, probability)
+    while position < end:
+        flags[position] |= flag
+        position = position + 1 + skip_Count(rng, probability)
+
+# Marks drops following the Gilbert-Elliott burst loss model: a two state chain that moves from the good
+# state to the bad state with probability p and back with probability r after every packet, losing packets
+# with probability loss_good in the good state and loss_bad in the bad state. The time spent in each state is
+# geometric, so the chain is walked a whole sojourn at a time
+def mark_Gilbert(flags, count, p, r, loss_bad, loss_good, rng):
+    position = 0
+    bad = False
+    while position < count:
+        leave = r if bad else p
+        end = min(position + 1 + skip_Count(rng, leave), count) if leave > 0 else count
+        mark_Bernoulli(flags, position, end, loss_bad if bad else loss_good, DROP, rng)
+        position = end
+        bad = not bad
+
+# Returns an error string if the impairment settings of a round configuration are out of range, else None
+def check_Impairment(settings):
+    for name in ('loss', 'corrupt', 'reorder'):
+        if not 0 <= settings.get(name, 0) <= 1:
+            return f"Impairment '{name}' must be in the range 0 <= x <= 1"
+    gilbert = settings.get('gilbert')
+    if gilbert is not None and (len(gilbert) != 4 or not all(0 <= value <= 1 for value in gilbert)):
+        return "Gilbert-Elliott parameters must be four probabilities: p, r, loss_bad, loss_good"
+    if settings.get('depth', REORDER_DEPTH) < 1:
+        return "Reorder depth must be at least 1"
+    return None
+
+# Builds the impairment plan for a round from its configuration, or returns None if the round is unimpaired.
+# Each kind of impairment draws from its own generator seeded with the session seed and the round, so a seed
+# reproduces the same pattern run to run whatever else is enabled, while every round gets a different one
+# Param: round_config: The round configuration, whose 'impairment' entry holds the seed and the settings
+# Param: session_id: The session the round belongs to. Only its packets are impaired
+def impairment_Plan(round_config, session_id=0):
+    settings = round_config.get('impairment') or {}
+    loss = settings.get('loss', 0)
+    gilbert = settings.get('gilbert')
+    corrupt = settings.get('corrupt', 0)
+    reorder = settings.get('reorder', 0)
+    if loss <= 0 and gilbert is None and corrupt <= 0 and reorder <= 0:
+        return None
+
+    count = round_config['packet_count']
+    seed = f"{settings.get('seed', 0)}:{round_config['round']}"
+    flags = bytearray(count)
+    if gilbert is not None:
+        mark_Gilbert(flags, count, *gilbert, random.Random(seed + ':gilbert'))
+    mark_Bernoulli(flags, 0, count, loss, DROP, random.Random(seed + ':loss'))
+    mark_Bernoulli(flags, 0, count, corrupt, CORRUPT, random.Random(seed + ':corrupt'))
+    mark_Bernoulli(flags, 0, count, reorder, REORDER, random.Random(seed + ':reorder'))
+    return Impairment(flags, session_id, round_config['round'], settings.get('depth', REORDER_DEPTH))
+
+# Applies a precomputed impairment plan in the receive path. Decisions are looked up by sequence number, so
+# every run with the same plan impairs the same packets no matter how they arrive, and an unimpaired packet
+# costs one header read and one byte lookup. Packets of other sessions or rounds pass through untouched, so
+# strays are counted as strays rather than impaired by a plan that is not theirs
+# Param: flags: One byte of DROP, CORRUPT and REORDER flags per sequence number
+# Param: session_id: The session whose packets the plan applies to
+# Param: round_number: The round whose packets the plan applies to
+# Param: depth: The number of later arrivals a reordered packet is held back for
+class Impairment:
+
+    def __init__(self, flags, session_id, round_number, depth=REORDER_DEPTH):
+        self.flags = flags
+        self.session_id = session_id
+        self.round_number = round_number
+        self.depth = depth
+        self.held = []
+        self.arrivals = 0
+        self.dropped = 0
+        self.corrupted = 0
+        self.reordered = 0
+
+    # Applies the plan to a batch of arriving packets and returns the packets to deliver, in delivery order.
+    # Corruption flips one payload bit in place, so packets must be writable
+    def apply(self, packets):
+        flags = self.flags
+        session_id = self.session_id
+        round_number = self.round_number
+        delivered = []
+        for packet in packets:
+            self.arrivals = self.arrivals + 1
+            flag = 0
+            if len(packet) >= HEADER_SIZE:
+                packet_session, packet_round, sequence = IDENTITY.unpack_from(packet)
+                if packet_session == session_id and packet_round == round_number and sequence < len(flags):
+                    flag = flags[sequence]
+            if flag:
+                if flag & DROP:
+                    self.dropped = self.dropped + 1
+                    continue
+                if flag & CORRUPT and len(packet) > HEADER_SIZE:
+                    position = HEADER_SIZE + sequence % (len(packet) - HEADER_SIZE)
+                    packet[position] = packet[position] ^ (1 << sequence % 8)
+                    self.corrupted = self.corrupted + 1
+                if flag & REORDER:
+                    # The receive buffer is about to be reused, so a held packet is copied
+                    self.held.append((self.arrivals + self.depth, bytes(packet)))
+                    self.reordered = self.reordered + 1
+                    continue
+            delivered.append(packet)
+            while self.held and self.held[0][0] <= self.arrivals:
+                delivered.append(self.held.pop(0)[1])
+        return delivered
+
+    # Returns every packet still held back, once the round has ended
+    def flush(self):
+        held = [packet for due, packet in self.held]
+        self.held = []
+        return held
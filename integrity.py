@@ -0,0 +1,115 @@
+#!/usr/bin/python3
+
+# NumPy is only needed by integrity analysis mode, so the rest of the tester runs without it
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from packet import HEADER_SIZE
+
+# Whether integrity analysis is available on this host
+SUPPORTED = numpy is not None
+# Mangled payloads are queued and analyzed together in batches of this many packets
+BATCH = 256
+# At most this many mangled packets are analyzed per round. The rest are counted and extrapolated from
+MAX_ANALYZED = 65536
+# The payload is divided into this many equal regions for the corruption position histogram
+POSITION_BINS = 16
+
+# The number of set bits in every byte value
+POPCOUNT = numpy.array([bin(value).count('1') for value in range(256)], dtype=numpy.uint8) if SUPPORTED else None
+
+# Measures how badly mangled packets were corrupted. The receive loop's fast path only verifies each packet's
+# CRC; the payloads that fail it are copied here and compared with the expected fill a batch at a time, as
+# one XOR and one popcount table lookup over a 2D NumPy view of the whole batch, so no per-byte Python runs.
+# Param: expected_byte: The byte value repeated through the payload after the header
+# Param: packet_size: The size in bytes of every datagram sent this round
+# Param: bins: The number of regions in the corruption position histogram
+class Corruption_Analyzer:
+
+    def __init__(self, expected_byte, packet_size, bins=POSITION_BINS):
+        self.expected_byte = expected_byte
+        self.payload_size = packet_size - HEADER_SIZE
+        self.bins = bins
+        self.pending = []
+        self.mangled = 0
+        self.truncated = 0
+        self.analyzed = 0
+        self.header_errors = 0
+        self.corrupt_bytes = 0
+        self.bit_errors = 0
+        self.bit_errors_max = 0
+        self.positions = [0] * bins
+
+    # Queues a packet that failed CRC verification. Receive buffers are reused, so the payload is copied
+    def add(self, packet):
+        self.mangled = self.mangled + 1
+        # A datagram of the wrong length cannot be lined up against the fill
+        if len(packet) != HEADER_SIZE + self.payload_size:
+            self.truncated = self.truncated + 1
+            return
+        if self.analyzed + len(self.pending) >= MAX_ANALYZED:
+            return
+        self.pending.append(bytes(packet[HEADER_SIZE:]))
+        if len(self.pending) >= BATCH:
+            self.analyze()
+
+    # Analyzes every queued payload
+    def analyze(self):
+        if not self.pending:
+            return
+        count = len(self.pending)
+        payloads = numpy.frombuffer(b''.join(self.pending), dtype=numpy.uint8).reshape(count, self.payload_size)
+        self.pending = []
+
+        # Every set bit of the XOR against the fill is a flipped bit
+        diff = numpy.bitwise_xor(payloads, numpy.uint8(self.expected_byte))
+        bits = POPCOUNT[diff].sum(axis=1, dtype=numpy.int64)
+        self.analyzed = self.analyzed + count
+        self.bit_errors = self.bit_errors + int(bits.sum())
+        self.bit_errors_max = max(self.bit_errors_max, int(bits.max()))
+        self.corrupt_bytes = self.corrupt_bytes + int(numpy.count_nonzero(diff))
+        # A packet that failed its CRC with an intact payload was corrupted in the header
+        self.header_errors = self.header_errors + int(numpy.count_nonzero(bits == 0))
+
+        if self.payload_size > 0:
+            columns = numpy.nonzero(diff)[1]
+            regions = numpy.bincount(columns * self.bins // self.payload_size, minlength=self.bins)
+            self.positions = [total + int(region) for total, region in zip(self.positions, regions)]
+
+    # Returns the counts merge() accepts, for handing this analyzer's totals to another process
+    def counters(self):
+        self.analyze()
+        return self.mangled, self.truncated, self.analyzed, self.header_errors, self.corrupt_bytes, self.bit_errors, self.bit_errors_max, self.positions
+
+    # Adds the counts of another analyzer for the same round
+    def merge(self, mangled, truncated, analyzed, header_errors, corrupt_bytes, bit_errors, bit_errors_max, positions):
+        self.mangled = self.mangled + mangled
+        self.truncated = self.truncated + truncated
+        self.analyzed = self.analyzed + analyzed
+        self.header_errors = self.header_errors + header_errors
+        self.corrupt_bytes = self.corrupt_bytes + corrupt_bytes
+        self.bit_errors = self.bit_errors + bit_errors
+        self.bit_errors_max = max(self.bit_errors_max, bit_errors_max)
+        self.positions = [total + region for total, region in zip(self.positions, positions)]
+
+    # Returns the round's integrity statistics. The bit error rate is over every payload bit received, scaled
+    # up from the analyzed packets when more packets were mangled than MAX_ANALYZED
+    def summary(self, packets_received):
+        self.analyze()
+        scale = (self.mangled - self.truncated) / self.analyzed if self.analyzed > 0 else 0
+        bits = packets_received * self.payload_size * 8
+        return {
+            'bit_errors': round(self.bit_errors * scale),
+            'ber': self.bit_errors * scale / bits if bits > 0 else 0,
+            'corrupt_bytes_mean': self.corrupt_bytes / self.analyzed if self.analyzed > 0 else 0,
+            'bit_errors_max': self.bit_errors_max,
+            'header_errors': self.header_errors,
+            'truncated': self.truncated,
+            'positions': self.positions
+        }
+
+# Returns the column headers of a position histogram table: round, packet size, then the share of the payload each region covers
+def position_Headers(bins=POSITION_BINS):
+    return ["Round", "Size (B)"] + [f"{region * 100 // bins}-{(region + 1) * 100 // bins}%" for region in range(bins)]
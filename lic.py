@@ -6,9 +6,24 @@ import random
 import socket
 import sys
 import time
-import traceback
 import threading
 from tabulate import tabulate
+from pacer import Pacer, Schedule_Pacer
+from udp_io import MAX_DATAGRAM, Batch_Sender, Recv_Ring, Stop_Signal, path_MTU, set_Dont_Fragment, size_Receive_Buffer, size_Send_Buffer
+from packet import HEADER, HEADER_SIZE, PROBE_ROUND, Packet_Writer, Sequence_Tracker, expected_Fill, verify_Checksum
+from histogram import Jitter_Estimator, Log_Histogram
+from protocol import PROTOCOL_VERSION, Message_Stream, check_Version
+from streams import Sender_Pool
+from netstat import Drop_Meter
+from integrity import Corruption_Analyzer, position_Headers
+from impairment import check_Impairment, impairment_Plan
+from telemetry import Telemetry_Ring
+from soak import Soak_Summary
+from profiles import check_Profile, compile_Schedule, load_Profile
+from hotpath import Hot_Path_Profile, profile_Row, write_Collapsed
+from tcpbulk import Payload_File, send_Bulk
+from discovery import CACHE_PATH, CACHE_TTL, Server_Cache, discover_Servers, rank_Servers, server_Load
+import integrity
 
 def main():
 
@@ -23,9 +38,32 @@ def main():
     parser.add_argument('-a', dest='address', type=str, nargs='?', help='The IP address of the desired server')
     parser.add_argument('-p', dest='port', type=int, nargs='?', help='The port number of the desired server')
     parser.add_argument('-l', dest='loss', type=float, nargs='?', help='An artificial amount of loss to be added.')
+    parser.add_argument('-ge', dest='gilbert', type=str, nargs='?', help='Artificial burst loss following the Gilbert-Elliott model, as p,r,loss_bad[,loss_good]: the chance of entering and leaving the bad state after each packet, and the loss in each state')
+    parser.add_argument('-cor', dest='corrupt', type=float, nargs='?', help='An artificial fraction of packets to be corrupted by a single bit flip.')
+    parser.add_argument('-ro', dest='reorder', type=str, nargs='?', help='An artificial fraction of packets to be reordered, as fraction[,depth]: each is held back until depth later packets arrive. Default depth is 3')
+    parser.add_argument('-seed', dest='seed', type=int, nargs='?', help='The seed for the artificial impairments. A seed reproduces the same impairment pattern run to run. Default is random')
     parser.add_argument('-rt', action='store_true', help='A flag to enable round trip mode.')    
+    parser.add_argument('-fd', dest='duplex', type=float, nargs='?', help='Full duplex mode: the server sends its own paced traffic to the client while receiving, at up to this rate in mbps. The downstream rate of each round scales with its upstream rate')
+    parser.add_argument('-fdc', dest='duplex_constant', action='store_true', help='A flag to hold the full duplex downstream at the -fd rate in every round instead of scaling it with the upstream rate')
+    parser.add_argument('-tcp', action='store_true', help='A flag to stream each round over TCP instead of UDP, measuring goodput, retransmits and throughput over time. Packet sizes set how much is sent per pacer slot')
     parser.add_argument('-br', action='store_false', help='A flag to disable UDP broadcast to find the server.')    
     parser.add_argument('-brp', dest='broad_port', type=int, nargs='?', help=brp_help)
+    parser.add_argument('-rd', dest='rediscover', action='store_true', help='A flag to broadcast for servers even if the server cache holds some.')
+    parser.add_argument('-cache', dest='cache', type=str, nargs='?', help=f'The file discovered servers are cached in. Default is {CACHE_PATH}')
+    parser.add_argument('-ttl', dest='ttl', type=float, nargs='?', help=f'The number of seconds discovered servers are cached for. Default is {CACHE_TTL}')
+    parser.add_argument('-sz', dest='sizes', type=str, nargs='?', help='A comma separated list of packet sizes in bytes to sweep, e.g. 64,512,1472,9216. Default is 9216')
+    parser.add_argument('-st', dest='streams', type=int, nargs='?', help='The number of parallel sender processes to split each round across (max 64). Lifts the rate limit to 10 gbps')
+    parser.add_argument('-d', dest='duration', type=float, nargs='?', help='The length of each round in seconds. Default is 1')
+    parser.add_argument('-search', action='store_true', help='A flag to search for the highest passing rate up to rate instead of sweeping. rounds is the maximum number of probes.')
+    parser.add_argument('-i', dest='integrity', action='store_true', help='A flag to verify every packet by CRC and analyze corrupted packets bit by bit (requires NumPy).')
+    parser.add_argument('-tm', dest='telemetry', type=str, nargs='?', help='Stream per-interval server counters while each round runs, as JSON Lines written to this file (- for stdout)')
+    parser.add_argument('-ti', dest='telemetry_interval', type=float, nargs='?', help='The telemetry interval in milliseconds. Default is 100')
+    parser.add_argument('-soak', dest='soak', type=float, nargs='?', help='Run a soak test at rate for this many hours instead of sweeping, keeping rolling aggregates in constant memory. rounds is ignored')
+    parser.add_argument('-ck', dest='checkpoint', type=str, nargs='?', help='The file the soak test summary is checkpointed to every minute. Default is soak.json')
+    parser.add_argument('-pf', dest='profile', type=str, nargs='?', help='A JSON traffic profile file shaping how each round sends its packets, e.g. {"type": "microburst", "burst": 64}. Types are constant, onoff, poisson, microburst and ramp')
+    parser.add_argument('-prof', '--profile', dest='hot_path', type=str, nargs='?', const='lic.folded', help="Time the send and receive loops and control messages of every round, printing the counters after the results and appending them (and the server's, if it profiles too) as collapsed stacks to this file. Default is lic.folded")
+    parser.add_argument('-json', dest='json', type=str, nargs='?', help="A file the results are also written to as JSON, for other programs to read. '-' prints them as one line instead")
+    parser.add_argument('-res', dest='resolution', type=float, nargs='?', help='The resolution in mbps at which the rate search stops. Default is 5')
     args = parser.parse_args()
 
     # Check round validity
@@ -61,22 +99,154 @@ def main():
             exit(1)
         loss = args.loss
 
-    if args.rate < 1 or args.rate > 1000:
-        print("Error: Argument 'rate' must be in the range 1 <= x <= 1000")
+    # Gather the artificial impairments the server is to apply. They are drawn from a seeded generator, so record the seed
+    impairment = {'seed': args.seed if args.seed is not None else random.getrandbits(32), 'loss': loss}
+    try:
+        if args.gilbert:
+            gilbert = [float(value) for value in args.gilbert.split(',')]
+            impairment['gilbert'] = (gilbert + [0])[:4] if len(gilbert) == 3 else gilbert
+        if args.corrupt:
+            impairment['corrupt'] = args.corrupt
+        if args.reorder:
+            reorder = args.reorder.split(',')
+            impairment['reorder'] = float(reorder[0])
+            if len(reorder) > 1:
+                impairment['depth'] = int(reorder[1])
+    except ValueError:
+        print("Error: Arguments 'gilbert' and 'reorder' must be comma separated numbers")
+        exit(1)
+    error = check_Impairment(impairment)
+    if error is not None:
+        print(f"Error: {error}")
+        exit(1)
+    if impairment_Plan({'impairment': impairment, 'round': 1, 'packet_count': 0}) is not None:
+        print(f"Artificial impairment seed: {impairment['seed']} (pass -seed {impairment['seed']} to reproduce this run)")
+
+    # Check parallel stream validity
+    streams = 1
+    if args.streams is not None:
+        if args.streams < 1 or args.streams > 64:
+            print("Error: Argument 'streams' must be in the range 1 <= x <= 64")
+            exit(1)
+        if args.streams > 1 and args.rt:
+            print("Error: Round trip mode supports a single stream")
+            exit(1)
+        streams = args.streams
+
+    # Load the traffic profile
+    profile = None
+    if args.profile:
+        try:
+            profile = load_Profile(args.profile)
+        except ValueError as error:
+            print(f"Error: {error}")
+            exit(1)
+        error = check_Profile(profile)
+        if error is not None:
+            print(f"Error: {error}")
+            exit(1)
+        if streams > 1:
+            print("Error: Traffic profiles support a single stream")
+            exit(1)
+
+    # Check TCP bulk mode validity. The UDP data plane's features have no TCP counterpart
+    if args.tcp:
+        if args.rt or args.duplex is not None or streams > 1 or profile is not None:
+            print("Error: TCP bulk mode cannot be combined with round trip, full duplex, parallel stream or traffic profile modes")
+            exit(1)
+        if args.integrity or args.telemetry or args.hot_path:
+            print("Error: TCP bulk mode does not support integrity analysis, telemetry or profiling")
+            exit(1)
+        if impairment_Plan({'impairment': impairment, 'round': 1, 'packet_count': 0}) is not None:
+            print("Error: Artificial impairments apply to UDP packets only")
+            exit(1)
+
+    # A single Python sender tops out around 1 gbps. Parallel streams, and sendfile in TCP bulk mode, may go up to 10 gbps
+    rate_limit = 1000 if streams == 1 and not args.tcp else 10000
+    if args.rate < 1 or args.rate > rate_limit:
+        print(f"Error: Argument 'rate' must be in the range 1 <= x <= {rate_limit}")
         exit(1)
     else:
         max_rate = args.rate*1000000 if args.rate else 1000000
 
+    # Check round duration validity
+    duration = 1
+    if args.duration is not None:
+        if args.duration <= 0 or args.duration > 60:
+            print("Error: Argument 'duration' must be in the range 0 < x <= 60")
+            exit(1)
+        duration = args.duration
+
+    # Check search resolution validity
+    resolution = 5000000
+    if args.resolution is not None:
+        if args.resolution <= 0:
+            print("Error: Argument 'resolution' must be greater than 0")
+            exit(1)
+        resolution = args.resolution * 1000000
+
+    # Check packet size validity
+    sizes = [9216]
+    if args.sizes:
+        try:
+            sizes = [int(size) for size in args.sizes.split(',')]
+        except ValueError:
+            print("Error: Argument 'sizes' must be a comma separated list of integers")
+            exit(1)
+        for size in sizes:
+            if size < HEADER_SIZE or size > MAX_DATAGRAM:
+                print(f"Error: Packet sizes must be in the range {HEADER_SIZE} <= x <= {MAX_DATAGRAM}")
+                exit(1)
+
+    # Check soak test validity
+    if args.soak is not None:
+        if args.soak <= 0 or args.soak > 168:
+            print("Error: Argument 'soak' must be in the range 0 < x <= 168")
+            exit(1)
+        if args.search or len(sizes) > 1:
+            print("Error: A soak test runs at a single rate and packet size")
+            exit(1)
+
+    # Check telemetry interval validity
+    telemetry_interval = 0.1
+    if args.telemetry_interval is not None:
+        if args.telemetry_interval < 10 or args.telemetry_interval > 10000:
+            print("Error: Argument 'telemetry_interval' must be in the range 10 <= x <= 10000")
+            exit(1)
+        telemetry_interval = args.telemetry_interval / 1000
+
+    # Check full duplex validity. The downstream rate is a fixed ratio of each round's upstream rate, unless it is held constant
+    duplex = None
+    duplex_rate = None
+    if args.duplex_constant and args.duplex is None:
+        print("Error: Argument 'duplex_constant' requires a full duplex rate (-fd)")
+        exit(1)
+    if args.duplex is not None:
+        if args.duplex <= 0 or args.duplex > 1000:
+            print("Error: Argument 'duplex' must be in the range 0 < x <= 1000")
+            exit(1)
+        if args.rt:
+            print("Error: Full duplex mode and round trip mode both receive on the client and cannot be combined")
+            exit(1)
+        duplex = args.duplex * 1000000 / max_rate
+        if args.duplex_constant:
+            duplex_rate = args.duplex * 1000000
+
+    # Round trip and downstream integrity analysis runs on this host too, so it needs NumPy here
+    if args.integrity and (args.rt or duplex is not None) and not integrity.SUPPORTED:
+        print("Error: Integrity analysis in round trip or full duplex mode requires NumPy")
+        exit(1)
+
     # Determine round and datarate information
     increment = max_rate / rounds
 
-    if increment < 9216*8:
+    if increment * duration < max(sizes)*8 and not args.search and not args.soak:
         print("Error: Decrease the number of rounds or increase the max data rate.")
         exit(1)
 
-    # Check the max rate is not over 1 gbps
-    if max_rate > 1000000000:
-        print("Error: Data transfer rate is over 1 gbps.")
+    # Check the max rate is not over the limit
+    if max_rate > rate_limit * 1000000:
+        print(f"Error: Data transfer rate is over {rate_limit} mbps.")
         exit(1)
 
     # Calculate the increment between each round
@@ -86,104 +256,432 @@ def main():
     address = args.address if args.address else 'localhost'
     port = args.port if args.port else 62994
     
-    # Running in broadcast mode so we have to locate the server
+    # Check server cache validity
+    ttl = CACHE_TTL
+    if args.ttl is not None:
+        if args.ttl < 0:
+            print("Error: Argument 'ttl' must be at least 0")
+            exit(1)
+        ttl = args.ttl
+
+    # Running in broadcast mode so we have to locate the server, unless one was found recently
+    cache = None
+    cached = False
     if args.br:
-        print('Broadcast mode enabled. Attempting to locate the server...')
-        broadcast = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-        broadcast.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        broadcast.settimeout(1)
-        reply = False
-        # Broadcast the message 10 times and wait 1 s for a reply each time
-        for i in range(10):
-            broadcast.sendto(b'Hello', ('<broadcast>', broad_port))
-            try:
-                udp_msg, udp_addr = broadcast.recvfrom(1024)
-                response = json.loads(udp_msg.decode('utf-8'))
-                address = udp_addr[0]
-                try:
-                    port = response['port']
-                except KeyError:
-                    print("Error: invalid response from server. Try a different broadcast port")
-                    continue
-                print(f'Server located at {address}:{port}')
-                reply = True
-                broadcast.close()
-                break
-            except socket.timeout:
-                continue
-        # If no reply was received from the server then terminate
-        if not reply:
-            print("Broadcast failed. No response was received from the server")
-            exit(1)        
+        cache = Server_Cache(args.cache or CACHE_PATH, ttl)
+        address, port, cached = locate_Server(cache, broad_port, args.rt, args.rediscover)
 
     # Establish a connection to the remote server
     print("Establishing a connection to the test server...")
-    try:
-        tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        tcp_socket.connect((address, port))
-    except:
+    tcp_socket = connect_Server(address, port)
+    if tcp_socket is None and cached:
+        # The cached server has gone away since it was discovered, so forget it and look again
+        print("The cached server is unreachable. Broadcasting to locate a server...")
+        cache.evict(address, port)
+        address, port, cached = locate_Server(cache, broad_port, args.rt, True)
+        tcp_socket = connect_Server(address, port)
+    if tcp_socket is None:
         print("Failed to establish a connection to the server. Aborting...")
-        traceback.print_exc()
         exit(1)
+    stream = Message_Stream(tcp_socket)
     print("Successfully established a connection to the test server.")
 
     print("Setting up testing environment...")
     try:
-        # Create synchronization request and send to remote server as JSON
-        request = {
-            'status': 'synchronize',
-        }
-        tcp_socket.send(json.dumps(request).encode('utf-8') + b'\n')
-
-        # Listen for server syn-ack response
-        data = bytearray()
-        byte = tcp_socket.recv(1)
-        while byte != '':
-            if b'\n' == byte:
-                break
-            data += byte
-            byte = tcp_socket.recv(1)
-
-        # Extract server's UDP port number from server response
-        response = json.loads(data.decode('utf-8'))
-
-        if 'status' not in response or response['status'] != 'synchronize-ack':
-            tcp_socket.close()
-            raise Exception('Server did not syn-ack')
-            return
-
-        udp_port = response['udp_port']
-
-        # Create UDP connection to server at specified port
-        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    except:
+        udp_port, session_id = synchronize_Session(stream)
+    except Session_Error as error:
+        print(f"Error: {error}")
         print("Failed to establish testing environment. Aborting...")
-        traceback.print_exc()
+        tcp_socket.close()
         exit(1)
+
+    # Create UDP connection to server at specified port
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = Batch_Sender(udp_socket, (address, udp_port))
     print("Successfully established testing environmnet.")
 
     # Establish storage for result data
     results = []
     results_client = []
+    pool = Sender_Pool(streams, (address, udp_port)) if streams > 1 else None
+    telemetry = None
+    if args.telemetry:
+        try:
+            telemetry_output = sys.stdout if args.telemetry == '-' else open(args.telemetry, 'w')
+        except OSError as error:
+            print(f"Error: Cannot open the telemetry file: {error}")
+            exit(1)
+        telemetry = Telemetry_Ring(telemetry_output)
+    hot_path = None
+    if args.hot_path:
+        try:
+            hot_path = open(args.hot_path, 'a')
+        except OSError as error:
+            print(f"Error: Cannot open the profile file: {error}")
+            exit(1)
+    options = Round_Options(impairment, args.rt, duration, args.integrity, telemetry_interval, profile, duplex, duplex_rate, args.tcp)
+    session = Client_Session(stream, sender, udp_socket, session_id, options, pool, telemetry, hot_path)
+
+    # Find the largest payload that reaches the server without IP fragmentation. TCP segments itself
+    if not args.tcp:
+        print("Probing path MTU...")
+        unfragmented = session.probe_MTU(sizes)
+        kernel_mtu = path_MTU(udp_socket)
+        if unfragmented:
+            print(f"Largest unfragmented payload: {max(unfragmented)} bytes" + (f" (kernel path MTU {kernel_mtu})" if kernel_mtu else ""))
+        else:
+            print("Path MTU probing was inconclusive")
+        for size in sizes:
+            if unfragmented and size > max(unfragmented):
+                print(f"Warning: {size} byte packets exceed the path MTU and will be IP fragmented")
 
     print("Beginning testing procedure...\n")
-    # Iterate over rounds
+    # Round numbers keep counting up across packet sizes so every round's packets are distinct
     current_round = 1
-    while current_round <= rounds:
-        print(f"Running round {current_round} of {rounds}...")
+    best_rates = []
+    soak = None
+    if args.soak:
+        # Soak at the full rate with the one packet size, keeping only rolling aggregates
+        soak = soak_Test(session, current_round, args.soak * 3600, max_rate, sizes[0], args.checkpoint or 'soak.json')
+    else:
+        for packet_size in sizes:
+            if args.search:
+                # Search for the highest passing rate, using 'rounds' as the maximum number of probes
+                trajectory, best_rate = rate_Search(session, current_round, rounds, max_rate, resolution, packet_size)
+                best_rates.append({'size': packet_size, 'rate': best_rate / 1000000, 'pps': best_rate / 8 / packet_size})
+                current_round = current_round + len(trajectory)
+                for server_result, client_result in trajectory:
+                    if client_result is not None:
+                        results_client.append(client_result)
+            else:
+                # Iterate over rounds
+                size_round = 1
+                while size_round <= rounds:
+                    print(f"Running round {size_round} of {rounds} at {packet_size} bytes...")
+                    server_result, client_result = session.run_Round(current_round, size_round * increment, packet_size)
+
+                    # If running in RT or full duplex mode then append client results
+                    if client_result is not None:
+                        results_client.append(client_result)
+
+                    # Prepare for next testing round
+                    current_round = current_round + 1
+                    size_round = size_round + 1
+
+    # Testing Complete.
+    # Notify server that test is complete
+    message = {
+        'status': 'test_complete',
+    }
+    stream.send(message)
+
+    # Retrieve results from server
+    results = read_Response(stream)
+
+    # Close connection
+    tcp_socket.close()
+    udp_socket.close()
+    if pool is not None:
+        pool.close()
+    if telemetry is not None:
+        telemetry.close()
+        if telemetry.output is not sys.stdout:
+            telemetry.output.close()
+    if hot_path is not None:
+        hot_path.close()
+
+    # Save the results for other programs, e.g. the mesh orchestrator
+    if args.json:
+        save_Results(args.json, {
+            'results': results,
+            'results_client': results_client,
+            'best_rates': best_rates,
+            'soak': soak.summary() if soak is not None else None
+        })
+
+    # A soak test only has its summary to show
+    if soak is not None:
+        print_Soak(soak)
+        if hot_path is not None:
+            print(f"Hot path profile saved to {args.hot_path}")
+        return
+
+    # Integrity mode position histograms and TCP throughput over time get tables of their own
+    positions = position_Rows(results)
+    positions_client = position_Rows(results_client)
+    intervals = interval_Rows(results)
+
+    # Print the results of the test
+    print("\n")
+    print("Upstream results from server:" if duplex is not None else "Results from server:")
+    header = {'round': "Round", 'size':"Size (B)", 'rate':"Target (mbps)", 'achieved':"Achieved (mbps)", 'pps':"Target pps", 'achieved_pps':"Achieved pps", 'packets':"Packets", 'lost':"Lost (%)",
+              'host_drops':"Host drops", 'send_drops':"Host send drops", 'in_errors':"Host in errors", 'net_lost':"Net lost (%)", 'mangled':"Mangled (%)", 'duplicates':"Dup", 'stray':"Stray", 'out_of_order':"Reordered", 'reorder_mean':"Mean reorder", 'reorder_max':"Max reorder", 'gaps':"Gaps", 'gap_max':"Max gap",
+              'bit_errors':"Bit errors", 'ber':"BER", 'corrupt_bytes_mean':"Mean corrupt bytes", 'bit_errors_max':"Max bit errors", 'header_errors':"Header errors", 'truncated':"Truncated",
+              'goodput':"Goodput (mbps)", 'retransmits':"Retransmits", 'tcp_rtt':"TCP RTT (ms)", 'interval_min':"Min interval (mbps)", 'interval_max':"Max interval (mbps)", 'rating':"Rating", 'duration':"Duration"}
+    print(tabulate(results, headers=header, tablefmt="grid"))
+
+    # Show how steadily each TCP round's throughput held up
+    if intervals:
+        print("TCP throughput by interval (mbps):")
+        print(tabulate(intervals, headers=["Round"] + [f"Interval {index + 1}" for index in range(max(len(row) for row in intervals) - 1)], tablefmt="grid"))
+
+    # Break each round down by stream when sending in parallel
+    if pool is not None:
+        print("Results by stream:")
+        print(tabulate(session.stream_results, headers={'round': "Round", 'stream': "Stream", 'achieved': "Achieved (mbps)", 'packets': "Packets", 'lost': "Lost (%)"}, tablefmt="grid"))
+
+    # Break each round down by the phases of its traffic profile
+    if profile is not None:
+        print("Results by traffic phase:")
+        print(tabulate(session.phase_results, headers={'round': "Round", 'phase': "Phase", 'packets': "Packets", 'lost': "Lost (%)"}, tablefmt="grid"))
+
+    # Summarize the search per packet size
+    if args.search and len(sizes) > 1:
+        print("Maximum sustainable rate by packet size:")
+        print(tabulate(best_rates, headers={'size': "Size (B)", 'rate': "Rate (mbps)", 'pps': "Packets/s"}, tablefmt="grid"))
+
+    # Print RT results if in RT mode
+    if args.rt:
+        header.update({'rtt_p50':"RTT p50 (ms)", 'rtt_p90':"RTT p90 (ms)", 'rtt_p99':"RTT p99 (ms)", 'rtt_p999':"RTT p99.9 (ms)", 'jitter':"Jitter (ms)"})
+        print("Results on client:")
+        print(tabulate(results_client, headers=header, tablefmt="grid"))
+
+    # Print the server-originated traffic's results in full duplex mode. Clocks are not shared, so there is no RTT
+    if duplex is not None:
+        header['jitter'] = "Jitter (ms)"
+        print("Downstream results on client:")
+        print(tabulate(results_client, headers=header, tablefmt="grid"))
+
+    # Show where each round's time went on either side
+    if hot_path is not None:
+        print("Hot path profile (client):")
+        print(tabulate(session.hot_path_results, headers="keys", tablefmt="grid"))
+        if session.server_hot_path_results:
+            print("Hot path profile (server):")
+            print(tabulate(session.server_hot_path_results, headers="keys", tablefmt="grid"))
+        print(f"Collapsed stacks saved to {args.hot_path}")
+
+    # In integrity mode, show where in the payload each round's corrupted bytes were
+    if args.integrity:
+        print("Corrupted bytes by payload position (server):")
+        print(tabulate(positions, headers=position_Headers(), tablefmt="grid"))
+        if positions_client:
+            print("Corrupted bytes by payload position (client):")
+            print(tabulate(positions_client, headers=position_Headers(), tablefmt="grid"))
+
+
+# Returns the (address, port) of the least loaded server able to run the test, and whether it came from the cache.
+# Servers found within the cache's TTL are used without broadcasting at all. Otherwise every server that answers
+# a single discovery window is collected and cached, retrying up to 10 windows until one answers
+# Param: cache: The Server_Cache
+# Param: broad_port: The port servers listen for broadcasts on
+# Param: rt: Whether round trip mode is required
+# Param: rediscover: Whether to broadcast even if the cache holds servers
+def locate_Server(cache, broad_port, rt, rediscover=False):
+    servers = [] if rediscover else rank_Servers(cache.fresh(), rt)
+    if servers:
+        server = servers[0]
+        print(f"Using cached server {server.get('name', server['address'])} at {server['address']}:{server['port']} (pass -rd to broadcast again)")
+        return server['address'], server['port'], True
+
+    print('Broadcast mode enabled. Attempting to locate the server...')
+    discovered = []
+    for i in range(10):
+        discovered = discover_Servers(broad_port)
+        if discovered:
+            break
+    # If no reply was received from any server then terminate
+    if not discovered:
+        print("Broadcast failed. No response was received from the server")
+        exit(1)
+    cache.update(discovered)
+
+    if len(discovered) > 1:
+        print("Discovered servers:")
+        rows = [{'name': server.get('name', ''), 'address': f"{server['address']}:{server['port']}", 'version': server.get('version'),
+                 'echo': server.get('capabilities', {}).get('echo'), 'load': server_Load(server) * 100} for server in discovered]
+        print(tabulate(rows, headers={'name': "Name", 'address': "Address", 'version': "Version", 'echo': "Round trip", 'load': "Load (%)"}, tablefmt="grid"))
+
+    servers = rank_Servers(discovered, rt)
+    if not servers:
+        print(f"Error: No server that replied speaks protocol version {PROTOCOL_VERSION}" + (" in round trip mode" if rt else ""))
+        exit(1)
+    server = servers[0]
+    print(f"Server located at {server['address']}:{server['port']}")
+    return server['address'], server['port'], False
+
+# Opens the control connection to a server. Returns the connected socket, or None if it cannot be reached
+def connect_Server(address, port):
+    try:
+        return socket.create_connection((address, port))
+    except OSError as error:
+        print(f"Cannot connect to {address}:{port}: {error}")
+        return None
+
+
+# Performs the synchronize handshake over a new control connection. Returns the server's UDP port and the session id
+# Raises Session_Error if the server refuses the session
+# Param: stream: The Message_Stream for the control connection
+def synchronize_Session(stream):
+    stream.send({'status': 'synchronize', 'version': PROTOCOL_VERSION})
+    response = read_Response(stream)
+    if response.get('status') == 'error':
+        raise Session_Error(response['message'])
+    if response.get('status') == 'busy':
+        raise Session_Error("The server is running its maximum number of concurrent tests. Try again later")
+    if response.get('status') != 'synchronize-ack':
+        raise Session_Error("Server did not syn-ack")
+    error = check_Version(response)
+    if error is not None:
+        raise Session_Error(error)
+    return response['udp_port'], response.get('session_id', 0)
+
+
+# Writes the outcome of the test to a JSON file, or to standard output as a single line if path is '-'
+def save_Results(path, outcome):
+    if path == '-':
+        print(json.dumps(outcome))
+        return
+    try:
+        with open(path, 'w') as output:
+            json.dump(outcome, output, indent=2)
+    except OSError as error:
+        print(f"Warning: Cannot save the results: {error}")
+
+
+# Removes the corruption position histogram from each integrity mode result and returns them as table rows
+def position_Rows(results):
+    return [[result['round'], result['size']] + result.pop('positions') for result in results if 'positions' in result]
+
+
+# Removes the per-interval throughput from each TCP bulk round result and returns them as table rows
+def interval_Rows(results):
+    return [[result['round']] + result.pop('intervals') for result in results if 'intervals' in result]
+
+
+# Raised when a test session cannot continue: the server refused it, reported an error, or went away
+class Session_Error(Exception):
+    pass
+
+
+# The settings every round of a session is run with
+# Param: impairment: The artificial impairment settings the server should apply (see impairment_Plan)
+# Param: rt: Whether round trip mode is enabled
+# Param: duration: The length of each round in seconds
+# Param: integrity: Whether packets carry a CRC and corrupted packets are analyzed bit by bit
+# Param: telemetry_interval: The number of seconds between telemetry samples
+# Param: profile: An optional traffic profile each round's send schedule is compiled from (see compile_Schedule)
+# Param: duplex: In full duplex mode, the ratio of the server's downstream rate to each round's upstream rate, else None
+# Param: duplex_rate: In full duplex mode, a downstream rate in bps held in every round instead of the duplex ratio, else None
+# Param: tcp: Whether rounds stream over TCP instead of UDP (see Client_Session.run_Bulk_Round)
+class Round_Options:
+
+    def __init__(self, impairment, rt=False, duration=1, integrity=False, telemetry_interval=0.1, profile=None, duplex=None, duplex_rate=None, tcp=False):
+        self.impairment = impairment
+        self.rt = rt
+        self.duration = duration
+        self.integrity = integrity
+        self.telemetry_interval = telemetry_interval
+        self.profile = profile
+        self.duplex = duplex
+        self.duplex_rate = duplex_rate
+        self.tcp = tcp
+        # Set during a soak test, so the server does not keep every round's result
+        self.soak = False
+
+
+# The state of an established test session, shared by every round run over it
+# Param: stream: The Message_Stream for the control connection
+# Param: sender: The Batch_Sender for the session's UDP socket
+# Param: udp_socket: The UDP socket packets are sent from (and echoes received on in RT mode)
+# Param: session_id: The session id assigned by the server
+# Param: options: The Round_Options every round is run with
+# Param: pool: An optional Sender_Pool that sends each round over parallel streams instead of udp_socket
+# Param: telemetry: An optional Telemetry_Ring that receives the server's live counters during every round
+# Param: hot_path: An optional open file. When given, every round's loops and control messages are timed (see Hot_Path_Profile)
+#                  and the counters are appended to it as collapsed stacks
+# Param: log: The function progress messages are passed to. Default is print
+class Client_Session:
+
+    def __init__(self, stream, sender, udp_socket, session_id, options, pool=None, telemetry=None, hot_path=None, log=print):
+        self.stream = stream
+        self.sender = sender
+        self.udp_socket = udp_socket
+        self.session_id = session_id
+        self.options = options
+        self.pool = pool
+        self.telemetry = telemetry
+        self.hot_path = hot_path
+        self.log = log
+        # The payload file TCP bulk rounds stream from, created by the first of them
+        self.payload = None
+        self.hot_path_results = []
+        self.server_hot_path_results = []
+        self.stream_results = []
+        self.phase_results = []
+
+    # Sends a few don't-fragment probes of each size and returns the sizes the server received
+    # Param: sizes: The packet sizes in bytes to be tested, alongside the common 1500 and 9000 byte MTUs
+    def probe_MTU(self, sizes):
+        stream = self.stream
+        stream.send({'status': 'mtu_probe'})
+        response = read_Response(stream)
+        if response['status'] != 'ready':
+            return []
+
+        # Without the don't-fragment bit every size would arrive (fragmented), so there is nothing to learn
+        if not set_Dont_Fragment(self.udp_socket, True):
+            stream.send({'status': 'mtu_probe_complete'})
+            read_Response(stream)
+            return []
+
+        candidates = sorted(set(sizes + [1500 - 28, 9000 - 28]))
+        for size in candidates:
+            if size > MAX_DATAGRAM:
+                continue
+            probe = bytearray(size)
+            HEADER.pack_into(probe, 0, self.session_id, PROBE_ROUND, size, time.monotonic_ns())
+            for x in range(3):
+                try:
+                    self.udp_socket.send(probe)
+                except OSError:
+                    # EMSGSIZE: larger than the MTU of the local interface or a route the kernel already knows
+                    break
+        set_Dont_Fragment(self.udp_socket, False)
+
+        # Give the last probes time to land before the server stops counting
+        time.sleep(0.05)
+        stream.send({'status': 'mtu_probe_complete'})
+        response = read_Response(stream)
+        return response.get('received', [])
+
+    # Runs a single round at current_rate (bps). Returns the server's result for the round and, in RT and full duplex
+    # mode, the client's
+    def run_Round(self, current_round, current_rate, packet_size=9216):
+        if self.options.tcp:
+            return self.run_Bulk_Round(current_round, current_rate, packet_size)
+        stream = self.stream
 
         # Compute random payload value
         payload_byte = random.randint(0, 255)
-        payload = bytearray([payload_byte] * 9216)
+        writer = Packet_Writer(self.session_id, current_round, payload_byte, packet_size, checksum=self.options.integrity)
     
         # Compute round rate, total bytes
-        current_rate = current_round * increment
-        packet_count = int(current_rate / 8 / 9216) 
-        sleep_time = 1 / packet_count
+        packet_count = int(current_rate * self.options.duration / 8 / packet_size) 
+        hot_profile = Hot_Path_Profile() if self.hot_path is not None else None
+        profile = None
+        if self.options.profile is not None:
+            # Compile the round's send schedule ahead of time, so the send loop only follows timestamps. The
+            # seed goes to the server, which compiles the same schedule to break the results down by phase
+            profile = dict(self.options.profile, seed=f"{self.options.impairment['seed']}:{current_round}")
+            schedule, phases = compile_Schedule(profile, packet_count, self.options.duration, profile['seed'])
+            pacer = Schedule_Pacer(schedule, self.options.duration, profile=hot_profile)
+        else:
+            pacer = Pacer(packet_count, self.options.duration, profile=hot_profile)
 
-        print(f"Current_rate is {current_rate}")
-        print(f"packet_count is {packet_count}")
-        print(f"sleep_time is {sleep_time}") 
+        self.log(f"Current_rate is {current_rate}")
+        self.log(f"packet_count is {packet_count}")
+        self.log(f"interval is {pacer.interval}")
 
         # Send server current round configuration JSON
         config = {
@@ -191,107 +689,362 @@ def main():
             'round': current_round,
             'rate': current_rate/1000000,
             'packet_count': packet_count,
+            'packet_size': packet_size,
             'expected_payload': payload_byte,
-            'loss': loss
+            'impairment': self.options.impairment,
+            'streams': len(self.pool.pipes) if self.pool is not None else 1,
+            'integrity': self.options.integrity,
+            'telemetry': self.options.telemetry_interval if self.telemetry is not None else 0,
+            'soak': self.options.soak,
+            'duration': self.options.duration,
+            'profile': profile
         }
 
-        tcp_socket.send(json.dumps(config).encode('utf-8') + b'\n')
+        # In full duplex mode the server paces its own packets to this socket at the downstream rate
+        downstream = None
+        if self.options.duplex is not None:
+            downstream_rate = self.options.duplex_rate if self.options.duplex_rate is not None else current_rate * self.options.duplex
+            downstream = {
+                'rate': downstream_rate/1000000,
+                'packet_count': int(downstream_rate * self.options.duration / 8 / packet_size),
+                'expected_payload': random.randint(0, 255),
+                'port': self.udp_socket.getsockname()[1]
+            }
+            config['downstream'] = downstream
+
+        configured = time.perf_counter_ns()
+        stream.send(config)
 
         # Wait for server response
-        data = bytearray()
-        byte = tcp_socket.recv(1)
-        while byte != '':
-            if byte == b'\n':
-                break
-            data += byte
-            byte = tcp_socket.recv(1)
+        response = read_Response(stream)
+        if hot_profile is not None:
+            hot_profile.add('control;round_config', time.perf_counter_ns() - configured)
 
         # Check response code
-        if (json.loads(data.decode('utf-8'))['status'] != 'ready'):
-            print("PANIC")
-            exit(1)
+        if (response['status'] == 'error'):
+            raise Session_Error(response['message'])
+        if (response['status'] != 'ready'):
+            raise Session_Error(f"Unexpected response to the round configuration: {response['status']}")
+
+        # Size the socket buffers for this round's rate and snapshot the host's drop counters
+        size_Send_Buffer(self.udp_socket, current_rate)
+        if self.options.rt:
+            size_Receive_Buffer(self.udp_socket, current_rate)
+        elif downstream is not None:
+            size_Receive_Buffer(self.udp_socket, downstream['rate'] * 1000000)
+        meter = Drop_Meter(self.udp_socket.getsockname()[1])
 
-        listener_thread = {}
+        # Telemetry arrives on the control channel while this thread is busy sending, so a thread reads it. It
+        # blocks on the control socket, so it is a daemon: if the round fails, closing the socket ends it
+        telemetry_thread = None
+        replies = []
+        if self.telemetry is not None:
+            telemetry_thread = threading.Thread(target=Telemetry_Listener, args=(stream, self.telemetry, replies,), daemon=True)
+            telemetry_thread.start()
+
+        listener_thread = None
+        stop_signal = None
         statistics = []
-        if args.rt:
-            stop_signal = False
-            listener_thread = threading.Thread(target=UDP_Listener, args=(udp_socket, payload, statistics, lambda: stop_signal,))
+        analyzer = None
+        if self.options.rt:
+            stop_signal = Stop_Signal()
+            tracker = Sequence_Tracker(self.session_id, current_round, packet_count)
+            if self.options.integrity:
+                analyzer = Corruption_Analyzer(payload_byte, packet_size)
+            listener_thread = threading.Thread(target=UDP_Listener, args=(self.udp_socket, payload_byte, packet_size, tracker, statistics, stop_signal, analyzer, hot_profile,))
+            listener_thread.start()
+        elif downstream is not None:
+            # The server's packets are tracked by the same session and round, in their own sequence space
+            stop_signal = Stop_Signal()
+            tracker = Sequence_Tracker(self.session_id, current_round, downstream['packet_count'])
+            if self.options.integrity:
+                analyzer = Corruption_Analyzer(downstream['expected_payload'], packet_size)
+            listener_thread = threading.Thread(target=UDP_Listener, args=(self.udp_socket, downstream['expected_payload'], packet_size, tracker, statistics, stop_signal, analyzer, hot_profile,))
             listener_thread.start()
 
-        start = time.time()
+        try:
+            start = time.time()
 
-        # Send UDP 9216 bytes at a time, with payload containing a random duplicated byte
-        for x in range(packet_count):
-            udp_socket.sendto(payload, (address, udp_port))
-            time.sleep(sleep_time)
+            # Send UDP packet_size bytes at a time: a sequence header followed by a random duplicated byte
+            # The pacer releases packets against absolute deadlines so the round spans its duration at the target rate
+            stream_reports = []
+            if self.pool is not None:
+                # Each stream paces its own share concurrently, so the achieved rates add up
+                stream_reports = self.pool.run_Round(self.session_id, current_round, payload_byte, packet_size, packet_count, self.options.duration, self.options.integrity, hot_profile is not None)
+                for report in stream_reports:
+                    if hot_profile is not None:
+                        hot_profile.merge(report['hot_path'])
+                achieved_rate = sum(report['achieved_rate'] for report in stream_reports)
+                achieved_pps = sum(report['achieved_pps'] for report in stream_reports)
+            else:
+                refused = self.sender.refused
+                pacer.begin()
+                burst = pacer.wait()
+                while burst > 0:
+                    started = time.perf_counter_ns() if hot_profile is not None else 0
+                    self.sender.send_Sequenced(writer, burst)
+                    if hot_profile is not None:
+                        hot_profile.add('sender;send', time.perf_counter_ns() - started)
+                    burst = pacer.wait()
+                pacer.end()
+                achieved_rate = pacer.achieved_Rate(packet_size) / 1000000
+                achieved_pps = pacer.achieved_PPS()
+                if self.sender.refused > refused:
+                    self.log(f"Warning: The server's UDP port refused {self.sender.refused - refused} packets. It may have stopped")
+            config['achieved_rate'] = achieved_rate
+            config['achieved_pps'] = achieved_pps
+            send_drops = meter.read()[1]
+            config['send_drops'] = send_drops
 
-        # Signal server that round is complete
-        tcp_socket.send(json.dumps({ 'status': 'round_complete'}).encode('utf-8') + b'\n')
-        print(f"Round {current_round} complete")
+            # Signal server that round is complete
+            completed = time.perf_counter_ns()
+            stream.send({ 'status': 'round_complete', 'achieved_rate': achieved_rate, 'achieved_pps': achieved_pps, 'send_drops': send_drops})
+            self.log(f"Round {current_round} complete (target {current_rate/1000000:.2f} mbps, achieved {achieved_rate:.2f} mbps)")
 
-        # Wait for server response
-        data = bytearray()
-        byte = tcp_socket.recv(1)
-        while byte != '':
-            if b'\n' == byte:
-                break
-            data += byte
-            byte = tcp_socket.recv(1)
-
-        finish = time.time()
-        diff = finish - start
-
-        # If running in RT mode then append client results
-        if args.rt:
-            stop_signal = True
-            listener_thread.join()
-            results_client.append(compute_Results(config, statistics, diff))
+            # Wait for server response, which carries the server's result for the round
+            if telemetry_thread is not None:
+                telemetry_thread.join()
+                response = replies[0]
+                if response is None:
+                    raise Session_Error("Lost connection to the server")
+            else:
+                response = read_Response(stream)
+            if hot_profile is not None:
+                hot_profile.add('control;round_complete', time.perf_counter_ns() - completed)
 
-        # Prepare for next testing round
-        current_round = current_round + 1
+            finish = time.time()
+            diff = finish - start
+        finally:
+            # Stop the receive loop however the round ends, so an error cannot leave it running
+            if listener_thread is not None:
+                stop_signal.set()
+                listener_thread.join()
+                stop_signal.close()
 
-    # Testing Complete.
-    # Notify server that test is complete
-    message = {
-        'status': 'test_complete',
-    }
-    tcp_socket.send(json.dumps(message).encode('utf-8') + b'\n')
+        # Merge each stream's achieved rate with the loss the server saw on it
+        for report, server_stream in zip(stream_reports, response.get('streams', [])):
+            self.stream_results.append({
+                'round': current_round,
+                'stream': server_stream['stream'],
+                'achieved': report['achieved_rate'],
+                'packets': server_stream['packets'],
+                'lost': server_stream['lost'] / server_stream['packets'] * 100 if server_stream['packets'] > 0 else 0
+            })
 
-    # Retrieve results from server
-    data = bytearray()
-    byte = tcp_socket.recv(1)
-    while byte != '':
-        if b'\n' == byte:
+        for phase in response.get('phases', []):
+            self.phase_results.append(dict(round=current_round, **phase))
+
+        # If running in RT mode then compute client results
+        client_result = None
+        if self.options.rt:
+            # Echoes dropped in this host's receive buffer are not network loss either
+            receive_drops, send_drops, in_errors = meter.read()
+            config['host_drops'] = receive_drops
+            config['in_errors'] = in_errors
+            client_result = compute_Results(config, statistics, diff, analyzer, log=self.log)
+        elif downstream is not None:
+            # The server reports how fast it sent and what its own send buffer dropped
+            report = response.get('downstream', {})
+            receive_drops, send_drops, in_errors = meter.read()
+            downstream_config = {
+                'round': current_round,
+                'rate': downstream['rate'],
+                'packet_count': downstream['packet_count'],
+                'packet_size': packet_size,
+                'achieved_rate': report.get('achieved_rate', 0),
+                'achieved_pps': report.get('achieved_pps', 0),
+                'send_drops': report.get('send_drops', 0),
+                'host_drops': receive_drops,
+                'in_errors': in_errors
+            }
+            client_result = compute_Results(downstream_config, statistics, diff, analyzer, round_trip=False, log=self.log)
+
+        # The receive loop has finished, so the round's counters are complete
+        if hot_profile is not None:
+            counters = hot_profile.counters()
+            self.hot_path_results.append(profile_Row(current_round, counters))
+            write_Collapsed(self.hot_path, f"lic;round_{current_round}", counters)
+            if 'hot_path' in response:
+                self.server_hot_path_results.append(profile_Row(current_round, response['hot_path']))
+                write_Collapsed(self.hot_path, f"lis;round_{current_round}", response['hot_path'])
+
+        return response.get('result'), client_result
+
+    # Runs a single TCP bulk round at current_rate (bps): the round's bytes are streamed from a memory-mapped payload
+    # file with sendfile over a TCP connection of its own, paced in packet_size byte slots. Returns the server's
+    # result for the round, which carries the goodput and the sender's retransmits, and None for the client's
+    def run_Bulk_Round(self, current_round, current_rate, packet_size=9216):
+        stream = self.stream
+        if self.payload is None:
+            self.payload = Payload_File(random.randint(0, 255))
+        byte_count = int(current_rate * self.options.duration / 8)
+        self.log(f"Current_rate is {current_rate}")
+        self.log(f"byte_count is {byte_count}")
+
+        config = {
+            'status': 'test_in_progress',
+            'transport': 'tcp',
+            'round': current_round,
+            'rate': current_rate/1000000,
+            'packet_count': -(-byte_count // packet_size),
+            'packet_size': packet_size,
+            'byte_count': byte_count,
+            'soak': self.options.soak,
+            'duration': self.options.duration
+        }
+        stream.send(config)
+        response = read_Response(stream)
+        if (response['status'] == 'error'):
+            raise Session_Error(response['message'])
+        if (response['status'] != 'ready' or 'tcp_port' not in response):
+            raise Session_Error("The server does not support TCP bulk rounds")
+
+        # The data connection goes to the control connection's peer. The UDP socket is not used by bulk rounds,
+        # so its connect may have failed or point elsewhere
+        data_socket = socket.create_connection((self.stream.tcp_socket.getpeername()[0], response['tcp_port']))
+        try:
+            report = send_Bulk(data_socket, self.payload, byte_count, packet_size, self.options.duration)
+        finally:
+            data_socket.close()
+
+        stream.send({'status': 'round_complete', 'achieved_rate': report['achieved_rate'], 'retransmits': report['retransmits'], 'tcp_rtt': report['rtt']})
+        self.log(f"Round {current_round} complete (target {current_rate/1000000:.2f} mbps, achieved {report['achieved_rate']:.2f} mbps)")
+        response = read_Response(stream)
+        return response.get('result'), None
+
+
+# The fraction of its target rate a search probe's sender must achieve to pass. A probe rated on its loss at
+# a rate the sender never reached says nothing about the target rate
+SEARCH_ACHIEVED = 0.99
+
+# Searches for the highest rate the link sustains with a 'pass' rating by bisection. The first probe is
+# at max_rate; every later probe halves the bracket between the highest passing and lowest failing rate
+# until it is narrower than resolution or the probes run out. A probe whose sender fell short of
+# SEARCH_ACHIEVED of its rate fails. Returns the per-probe results and the best rate (bps)
+# Param: session: The Client_Session to run probes over
+# Param: first_round: The round number of the first probe
+# Param: probes: The maximum number of rounds to run
+# Param: max_rate: The upper bound of the search in bps
+# Param: resolution: The bracket width in bps at which the search stops
+# Param: packet_size: The size in bytes of every packet sent
+def rate_Search(session, first_round, probes, max_rate, resolution, packet_size=9216):
+    low = 0
+    high = max_rate
+    # The smallest rate at which a round still contains a packet
+    floor = packet_size * 8 / session.options.duration
+    rate = max_rate
+    trajectory = []
+    steps = []
+
+    probe = 1
+    while probe <= probes:
+        current_round = first_round + probe - 1
+        session.log(f"Running search round {probe} of at most {probes} at {packet_size} bytes...")
+        server_result, client_result = session.run_Round(current_round, rate, packet_size)
+        trajectory.append((server_result, client_result))
+
+        # Only a 'pass' rating at the rate actually sent counts as sustainable
+        achieved = server_result.get('achieved', 0)
+        if server_result['rating'] == 'pass' and achieved * 1000000 >= rate * SEARCH_ACHIEVED:
+            low = rate
+        else:
+            high = rate
+        steps.append({'round': current_round, 'rate': rate / 1000000, 'achieved': achieved, 'lost': server_result['lost'], 'rating': server_result['rating'],
+                      'low': low / 1000000, 'high': high / 1000000})
+
+        if high - low <= resolution or high <= floor:
             break
-        data += byte
-        byte = tcp_socket.recv(1)
-    results = json.loads(data.decode('utf-8'))
+        rate = max((low + high) / 2, floor)
+        probe = probe + 1
 
-    # Close connection
-    tcp_socket.close()
-    udp_socket.close()
+    session.log("\n")
+    session.log(f"Search trajectory at {packet_size} bytes:")
+    header = {'round': "Round", 'rate': "Rate (mbps)", 'achieved': "Achieved (mbps)", 'lost': "Lost (%)", 'rating': "Rating", 'low': "Best pass (mbps)", 'high': "Lowest fail (mbps)"}
+    session.log(tabulate(steps, headers=header, tablefmt="grid"))
+    if low > 0:
+        session.log(f"Maximum sustainable rate: {low / 1000000:.2f} mbps (resolution {(high - low) / 1000000:.2f} mbps)")
+    else:
+        session.log(f"No tested rate passed. The link fails at {high / 1000000:.2f} mbps")
 
-    # Print the results of the test
+    return trajectory, low
+
+
+# Runs rounds at a fixed rate until duration seconds have passed, folding each into a Soak_Summary instead of
+# keeping per-round results, so memory stays constant however long the test runs. Returns the summary
+# Param: session: The Client_Session to run rounds over
+# Param: first_round: The round number of the first round
+# Param: duration: The length of the soak test in seconds
+# Param: rate: The rate of every round in bps
+# Param: packet_size: The size in bytes of every packet sent
+# Param: path: The file the summary is checkpointed to
+def soak_Test(session, first_round, duration, rate, packet_size, path):
+    summary = Soak_Summary(rate, packet_size, path, session.options.rt or session.options.duplex is not None)
+    session.options.soak = True
+    deadline = time.monotonic() + duration
+    current_round = first_round
+    try:
+        while time.monotonic() < deadline:
+            print(f"Running soak round {summary.rounds + 1} ({(deadline - time.monotonic()) / 60:.1f} minutes left)...")
+            server_result, client_result = session.run_Round(current_round, rate, packet_size)
+            summary.record(server_result, client_result)
+            session.stream_results.clear()
+            session.phase_results.clear()
+            session.hot_path_results.clear()
+            session.server_hot_path_results.clear()
+            summary.checkpoint()
+            current_round = current_round + 1
+    except KeyboardInterrupt:
+        # Keep everything up to the interrupted round
+        summary.checkpoint(force=True)
+        print(f"\nSoak test interrupted after {summary.rounds} rounds. Summary saved to {path}")
+        exit(1)
+    summary.checkpoint(force=True)
+    return summary
+
+# Prints a soak test's totals and the rolling aggregates of each measurement
+def print_Soak(soak):
+    summary = soak.summary()
     print("\n")
-    print("Results from server:")
-    header = {'round': "Round", 'rate':"Rate (mbps)", 'packets':"Packets", 'lost':"Lost (%)", 'mangled':"Mangled (%)", 'rating':"Rating", 'duration':"Duration"}
-    print(tabulate(results, headers=header, tablefmt="grid"))
+    print(f"Soak test at {summary['rate']:.2f} mbps with {summary['size']} byte packets: {summary['rounds']} rounds over {summary['elapsed'] / 3600:.2f} hours")
+    print(f"Packets sent: {summary['packets']}, lost: {summary['packets_lost']}, failed rounds: {summary['failed_rounds']}")
+    if summary['worst_round'] is not None:
+        worst = summary['worst_round']
+        print(f"Worst round: {worst['round']} lost {worst['lost']:.3f}% at {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(worst['time']))}")
+    names = {'lost': "Lost (%)", 'net_lost': "Net lost (%)", 'achieved': "Achieved (mbps)", 'rtt_p99': "RTT p99 (ms)", 'jitter': "Jitter (ms)"}
+    rows = [dict(metric=names[name], **metric) for name, metric in summary['metrics'].items()]
+    header = {'metric': "Per round", 'ewma': "EWMA", 'window_min': "Recent min", 'window_max': "Recent max", 'min': "Min", 'max': "Max",
+              'p50': "p50", 'p90': "p90", 'p99': "p99", 'p999': "p99.9"}
+    print(tabulate(rows, headers=header, tablefmt="grid"))
+    print(f"Summary saved to {soak.path}")
 
-    # Print RT results if in RT mode
-    if args.rt:
-        print("Results on client:")
-        print(tabulate(results_client, headers=header, tablefmt="grid"))
+
+# Reads the next control message from the server. Raises Session_Error if the server has gone away
+def read_Response(stream):
+    response = stream.read()
+    if response is None:
+        raise Session_Error("Lost connection to the server")
+    return response
 
 
-def compute_Results(round_config, statistics, diff):
+# Computes a round's results from what this host received. One way traffic (full duplex mode) is timestamped by
+# the server's clock, so only the jitter, which depends on differences in transit time, is meaningful
+def compute_Results(round_config, statistics, diff, analyzer=None, round_trip=True, log=print):
     
-    print(round_config)
-    packets_received, packets_mangled = statistics
-    print(f'Packets mangled {packets_mangled}')
+    log(round_config)
+    packets_received, packets_mangled, tracker, histogram, jitter = statistics
+    sequence = tracker.summary()
+    log(f'Packets mangled {packets_mangled}')
+    # Drops inside this host's socket buffers are not network loss
+    host_drops = round_config.get('host_drops', 0)
+    # The send drops and input errors are counted host-wide, so they are reported as context rather than subtracted
+    send_drops = round_config.get('send_drops', 0)
+    in_errors = round_config.get('in_errors', 0)
     if (round_config['packet_count'] > 0):
         lost_percent = (round_config['packet_count'] - packets_received) / round_config['packet_count'] * 100
+        net_lost_percent = max(0, round_config['packet_count'] - packets_received - host_drops) / round_config['packet_count'] * 100
     else:
         lost_percent = 0
+        net_lost_percent = 0
 
     if(packets_received > 0):
         mangled_percent = 100 - ((packets_received - packets_mangled) / packets_received * 100)
@@ -304,46 +1057,115 @@ def compute_Results(round_config, statistics, diff):
     if lost_percent > 7:
         rating = 'fail'
 
-    return {
+    result = {
         'round': round_config['round'],
+        'size': round_config.get('packet_size', 9216),
         'rate': round_config['rate'],
+        'achieved': round_config.get('achieved_rate', 0),
+        'pps': round_config['rate'] * 1000000 / 8 / round_config.get('packet_size', 9216),
+        'achieved_pps': round_config.get('achieved_pps', 0),
         'packets': round_config['packet_count'],
         'lost': lost_percent,
+        'host_drops': host_drops,
+        'send_drops': send_drops,
+        'in_errors': in_errors,
+        'net_lost': net_lost_percent,
         'mangled': mangled_percent,
+        'duplicates': sequence['duplicates'],
+        'stray': sequence['stray'],
+        'out_of_order': sequence['out_of_order'],
+        'reorder_mean': sequence['reorder_mean'],
+        'reorder_max': sequence['reorder_max'],
+        'gaps': sequence['gaps'],
+        'gap_max': sequence['gap_max'],
+        'rtt_p50': histogram.percentile(50) / 1000000,
+        'rtt_p90': histogram.percentile(90) / 1000000,
+        'rtt_p99': histogram.percentile(99) / 1000000,
+        'rtt_p999': histogram.percentile(99.9) / 1000000,
+        'jitter': jitter.jitter / 1000000,
         'rating': rating,
         'duration': diff
     }
+    if not round_trip:
+        for name in ('rtt_p50', 'rtt_p90', 'rtt_p99', 'rtt_p999'):
+            del result[name]
+    # In integrity mode, add the bit error rate and where in the payload the corruption landed
+    if analyzer is not None:
+        result.update(analyzer.summary(packets_received))
+    return result
+
+# Reads the control channel while a round runs, passing every telemetry sample to the ring, until the
+# server's next other message arrives, which is left in replies (None if the server went away)
+# Param: stream: The session's Message_Stream
+# Param: ring: The Telemetry_Ring samples are written through
+# Param: replies: An empty list that receives the message that ended the round
+def Telemetry_Listener(stream, ring, replies):
+    while True:
+        message = stream.read()
+        if message is None or message.get('status') != 'telemetry':
+            replies.append(message)
+            return
+        ring.record(message)
 
 # Handles UDP listening on a separate thread so that the TCP connection can be monitored by main thread for status updates
 # Param: udp_socket: The udp socket to be monitored
 # Param: expected_byte: An integer representation of the expected byte value repeated in the payload
-# Param: statistics: A list object consisting of the tuple [packets_received, packets_mangled]
-# Param: loss: A float value that specifies the amount of articial loss to be inserted into the analysis
-# Param: signal: A boolean that signifies whether the thread should terminate after a period of no new packets (should be passed as a lambda to avoid pass-by-value)
-def UDP_Listener(udp_socket, expected_byte, statistics, signal):
+# Param: packet_size: The size in bytes of every datagram sent this round
+# Param: tracker: The Sequence_Tracker for the current round, used to discard duplicate and stray packets
+# Param: statistics: A list object consisting of the tuple [packets_received, packets_mangled, tracker, histogram, jitter]
+#                    where histogram and jitter hold the round trip times (ns) of the echoed packets,
+#                    or in full duplex mode the transit times of the server's own packets
+# Param: signal: A Stop_Signal that is set when the round ends. The thread drains any remaining packets and terminates as soon as the socket goes idle
+# Param: analyzer: An optional Corruption_Analyzer. When given, packets are verified by CRC and the mangled ones are analyzed
+# Param: profile: An optional Hot_Path_Profile that receives the time spent receiving, idle and comparing packets
+def UDP_Listener(udp_socket, expected_byte, packet_size, tracker, statistics, signal, analyzer=None, profile=None):
 
     packets_received = 0
     packets_mangled = 0
+    fill = expected_Fill(expected_byte, packet_size)
+    ring = Recv_Ring(udp_socket, signal, profile=profile)
+    histogram = Log_Histogram()
+    jitter = Jitter_Estimator()
 
     while True:
-        udp_socket.settimeout(1)
         try:
-            # If packet falls within artificial loss window, drop (ignore) it
-                # If payload matches expected payload, just increment packet counter
-            udp_msg = udp_socket.recv(9216)
-            if(udp_msg == expected_byte):
-                packets_received = packets_received + 1
-            # Else, payload was mangled. Increment packet counter and magled packet counter
-            else:
-                packets_received = packets_received + 1
-                packets_mangled = packets_mangled + 1
+            count = ring.recv_Batch(1)
+            started = time.perf_counter_ns() if profile is not None else 0
+            for i in range(count):
+                udp_msg = ring.packet(i)
+                # Only the first copy of each sequence number from this round is counted
+                if(tracker.record(udp_msg)):
+                    packets_received = packets_received + 1
+                    # The echoed header still carries our send timestamp. The server's own packets in full duplex
+                    # mode carry its clock instead, which leaves a transit time offset by the difference in clocks
+                    rtt = time.monotonic_ns() - tracker.sent
+                    histogram.record(rtt)
+                    jitter.record(rtt)
+                    if analyzer is None:
+                        # If the fill after the header does not match the expected payload, the packet was mangled
+                        if(udp_msg[HEADER_SIZE:] != fill):
+                            packets_mangled = packets_mangled + 1
+                    # In integrity mode the packet's CRC is checked instead, and mangled packets are kept for analysis
+                    elif not verify_Checksum(udp_msg):
+                        packets_mangled = packets_mangled + 1
+                        analyzer.add(udp_msg)
+            if profile is not None:
+                profile.add('receiver;compare', time.perf_counter_ns() - started)
 
         except socket.timeout:
             if signal():
+                ring.close()
                 statistics.append(packets_received)
                 statistics.append(packets_mangled)
+                statistics.append(tracker)
+                statistics.append(histogram)
+                statistics.append(jitter)
                 return
 
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    except Session_Error as error:
+        print(f"Error: {error}. Aborting...")
+        exit(1)
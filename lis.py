@@ -1,12 +1,26 @@
 #!/usr/bin/python3
 
 import argparse
+import asyncio
 import json
 import socket
 import sys
 import time
 import threading
 import random
+from udp_io import Batch_Sender, Recv_Ring, Stop_Signal
+from packet import HEADER, HEADER_SIZE, PROBE_ROUND, Packet_Writer, Sequence_Tracker, expected_Fill, verify_Checksum
+from udp_io import MAX_DATAGRAM, size_Receive_Buffer, size_Send_Buffer
+from netstat import Drop_Meter
+from integrity import Corruption_Analyzer
+from impairment import check_Impairment, impairment_Plan
+from profiles import check_Profile, compile_Schedule, phase_Names, phase_Summary
+import integrity
+from protocol import PROTOCOL_VERSION, check_Round, check_Version, read_Message, send_Message
+import shards
+from pacer import Pacer
+from hotpath import Hot_Path_Profile, write_Collapsed
+from tcpbulk import CLOSE_TIMEOUT, bulk_Intervals, receive_Bulk
 
 def main():
 
@@ -20,6 +34,10 @@ def main():
     parser.add_argument('-rt', action='store_true', help='A flag to enable round trip mode.')
     parser.add_argument('-br', action='store_false', help='A flag to disable UDP broadcast to find the server.')    
     parser.add_argument('-brp', dest='broad_port', type=int, nargs='?', help=brp_help)
+    parser.add_argument('-s', dest='max_sessions', type=int, nargs='?', help='The maximum number of concurrent test sessions. Default is 16')
+    parser.add_argument('-w', dest='workers', type=int, nargs='?', help='The number of receive processes per session, sharing its UDP port via SO_REUSEPORT. Default is 1')
+    parser.add_argument('-bw', dest='max_rate', type=int, nargs='?', help='The maximum aggregate rate in mbps of all concurrent test sessions')
+    parser.add_argument('-prof', '--profile', dest='hot_path', type=str, nargs='?', const='lis.folded', help='Time the receive and send loops and control handling of every round, sending the counters to the client and appending them as collapsed stacks to this file. Default is lis.folded')
     args = parser.parse_args()
 
     # Check TCP port argument validity
@@ -46,147 +64,517 @@ def main():
             print("Warning: Argument 'broad_port' is a registered port. Port collision is possible")
         broad_port = args.broad_port
 
-    # Establish server at specified port number and await a connection
-    print(f"Establishing listening server on port {tcp_port}...")
-    tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    tcp_socket.bind(('', tcp_port))
-    tcp_socket.listen(1)
+    # Check concurrency limits
+    if args.max_sessions is not None and args.max_sessions < 1:
+        print("Error: Argument 'max_sessions' must be at least 1")
+        exit(1)
+    if args.max_rate is not None and args.max_rate < 1:
+        print("Error: Argument 'max_rate' must be at least 1")
+        exit(1)
+    capacity = Server_Capacity(args.max_sessions if args.max_sessions else 16, args.max_rate)
+
+    # Check receive worker validity
+    workers = 1
+    if args.workers is not None:
+        if args.workers < 1 or args.workers > 64:
+            print("Error: Argument 'workers' must be in the range 1 <= x <= 64")
+            exit(1)
+        if args.workers > 1 and not shards.SUPPORTED:
+            print("Error: Sharded receive requires SO_REUSEPORT, which this platform does not support")
+            exit(1)
+        workers = args.workers
+
+    # Open the hot path profile's collapsed stack file
+    hot_path = None
+    if args.hot_path:
+        try:
+            hot_path = open(args.hot_path, 'a')
+        except OSError as error:
+            print(f"Error: Cannot open the profile file: {error}")
+            exit(1)
 
     # Broadcasting mode enabled. Dispatch a thread to listen for requests
     if args.br or args.broad_port:
-        broadcast_listener = threading.Thread(target=UDP_Broadcast, args=(tcp_port, broad_port,))
+        # Advertise what this server can do alongside its port, so clients can pick a suitable server
+        capabilities = {
+            'echo': args.rt,
+            'workers': workers,
+            'integrity': integrity.SUPPORTED,
+            'duplex': True,
+            'tcp': True,
+            'profiling': hot_path is not None
+        }
+        broadcast_listener = threading.Thread(target=UDP_Broadcast, args=(tcp_port, broad_port, capacity, capabilities,), daemon=True)
         broadcast_listener.start()
 
     # Serve indefinitely
-    while True:
-        tcp_conn, tcp_addr = tcp_socket.accept()
-        # Service new connection
-        print(f"Connection established by address {tcp_addr}")
-        TCP_Connection_Handler(tcp_conn, args.rt)
+    try:
+        asyncio.run(serve(tcp_port, args.rt, capacity, workers, hot_path))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if hot_path is not None:
+            hot_path.close()
 
 
-def UDP_Broadcast(tcp_port, broad_port):
-    # Response to be sent to the client if a broadcast is received
-    resBody = {
-        'port': tcp_port,
-    }
-    res = json.dumps(resBody).encode('utf-8')
+# Establishes the server at the specified port number and services every connection concurrently
+async def serve(tcp_port, echo, capacity, workers, hot_path=None):
+    print(f"Establishing listening server on port {tcp_port}...")
+    server = await asyncio.start_server(lambda reader, writer: TCP_Connection_Handler(reader, writer, echo, capacity, workers, hot_path), '', tcp_port)
+    async with server:
+        await server.serve_forever()
+
+
+# Tracks the sessions and bandwidth shared by every concurrent test
+# Param: max_sessions: The maximum number of test sessions that may be active at once
+# Param: max_rate: The maximum aggregate rate in mbps of all concurrently running rounds, or None for no limit
+class Server_Capacity:
+
+    def __init__(self, max_sessions, max_rate):
+        self.max_sessions = max_sessions
+        self.max_rate = max_rate
+        self.sessions = 0
+        self.reserved_rate = 0
+        self.condition = asyncio.Condition()
+
+    # Admits a new session. Returns False if the server is already at its session limit
+    def open_Session(self):
+        if self.sessions >= self.max_sessions:
+            return False
+        self.sessions = self.sessions + 1
+        return True
+
+    def close_Session(self):
+        self.sessions = self.sessions - 1
+
+    # Waits until rate mbps of the aggregate bandwidth budget is free and reserves it
+    async def reserve(self, rate):
+        if self.max_rate is None:
+            return
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.reserved_rate + rate <= self.max_rate)
+            self.reserved_rate = self.reserved_rate + rate
+
+    async def release(self, rate):
+        if self.max_rate is None:
+            return
+        async with self.condition:
+            self.reserved_rate = self.reserved_rate - rate
+            self.condition.notify_all()
+
+
+# Answers client broadcasts with the server's TCP port, protocol version, capabilities and current load
+# Param: tcp_port: The port the server accepts test sessions on
+# Param: broad_port: The port to listen for broadcasts on
+# Param: capacity: The server's Server_Capacity, whose counts are read (unlocked, as a snapshot) for every reply
+# Param: capabilities: A dict of the features this server supports
+def UDP_Broadcast(tcp_port, broad_port, capacity, capabilities):
+    name = socket.gethostname()
     listener = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
     listener.bind(('', broad_port))
     print(f"Listening for broadcasts on {broad_port}")
     while(True):
         udp_msg, udp_addr = listener.recvfrom(1024)
         print(f"Broadcast message received by {udp_addr}. Replying...")
-        listener.sendto(res, udp_addr)
+        # Response to be sent to the client, with the load as of this moment
+        resBody = {
+            'port': tcp_port,
+            'name': name,
+            'version': PROTOCOL_VERSION,
+            'capabilities': capabilities,
+            'load': {
+                'sessions': capacity.sessions,
+                'max_sessions': capacity.max_sessions,
+                'reserved_rate': capacity.reserved_rate,
+                'max_rate': capacity.max_rate
+            }
+        }
+        listener.sendto(json.dumps(resBody).encode('utf-8'), udp_addr)
+
+# Runs a TCP bulk round. The server listens on a fresh TCP port, which goes to the client with 'ready', and a
+# thread receives the client's paced stream on it (see tcpbulk.receive_Bulk) until the client closes it and
+# reports round_complete. Returns False if the session has ended
+# Param: round_config: The round configuration
+# Param: capacity: The server's Server_Capacity
+# Param: results: The session's round results
+# Param: client_host: The address of the session's client. The data connection is only accepted from it
+# Param: log: The function progress messages are passed to
+async def TCP_Bulk_Round(reader, writer, round_config, capacity, results, client_host, log=print):
+    rate = round_config['rate']
+    byte_count = round_config.get('byte_count')
+    if not isinstance(byte_count, int) or isinstance(byte_count, bool) or byte_count <= 0:
+        log("Error: TCP bulk round without a valid byte count")
+        await send_Message(writer, {'status': 'error', 'message': "A TCP bulk round needs a positive byte count"})
+        return False
+    if capacity.max_rate is not None and rate > capacity.max_rate:
+        log(f"Error: Round rate {rate} mbps exceeds the server limit of {capacity.max_rate} mbps")
+        await send_Message(writer, {'status': 'error', 'message': f"Round rate exceeds the server limit of {capacity.max_rate} mbps"})
+        return False
+    await capacity.reserve(rate)
+
+    # Release the reservation however the round ends, including when the data listener cannot be opened
+    data_listener = None
+    stop_signal = None
+    receiver_thread = None
+    try:
+        data_listener = socket.create_server(('', 0))
+        stop_signal = Stop_Signal()
+        report = {}
+        count, interval = bulk_Intervals(round_config.get('duration', 1))
+        receiver_thread = threading.Thread(target=receive_Bulk, args=(data_listener, count, interval, stop_signal, report, client_host,))
+        receiver_thread.start()
+        await send_Message(writer, {'status': 'ready', 'tcp_port': data_listener.getsockname()[1]})
+        start = time.time()
+        round_complete = await read_Message(reader)
+        diff = time.time() - start
+        # The client closes its stream before reporting, so the receiver finishes on its own unless the client misbehaved
+        await asyncio.to_thread(receiver_thread.join, CLOSE_TIMEOUT if round_complete is not None else 0)
+    finally:
+        if receiver_thread is not None:
+            stop_signal.set()
+            await asyncio.to_thread(receiver_thread.join)
+        if stop_signal is not None:
+            stop_signal.close()
+        if data_listener is not None:
+            data_listener.close()
+        await capacity.release(rate)
+
+    if round_complete is None:
+        log("Client disconnected before completing the round")
+        return False
+
+    result = compute_Bulk_Results(round_config, report, round_complete, diff, log)
+    if not round_config.get('soak', False):
+        results.append(result)
+    await send_Message(writer, {'status': 'ready', 'result': result})
+    return True
+
+# Handles a single test session. Each session runs as its own coroutine with its own UDP socket,
+# session id and results, so any number of clients (up to the capacity limit) can test concurrently.
+# With more than one worker, workers - 1 extra processes share the session's UDP port (see shards.Receiver_Shards).
+# Progress messages are passed to log, which prints them by default
+async def TCP_Connection_Handler(reader, writer, echo, capacity, workers, hot_path=None, log=print):
+    tcp_addr = writer.get_extra_info('peername')
+    log(f"Connection established by address {tcp_addr}")
 
-# Handles TCP connections for handling active tests.
-# Is NOT intended to be threaded
-def TCP_Connection_Handler(tcp_conn, echo):
     # Await and decode connection synchronize request in JSON
-    data = bytearray()
-    byte = tcp_conn.recv(1)
-    while byte != '':
-        if b'\n' == byte:
-            break
-        data += byte
-        byte = tcp_conn.recv(1)
-
-    message = json.loads(data.decode('utf-8'))
-
-    if 'status' not in message or message['status'] != 'synchronize':
-        print("Connection did not properly synchronize")
+    try:
+        message = await read_Message(reader)
+    except (ConnectionError, json.JSONDecodeError, UnicodeDecodeError):
+        message = None
+
+    if not isinstance(message, dict) or message.get('status') != 'synchronize':
+        log("Connection did not properly synchronize")
+        writer.close()
         return
 
-    # Bind UDP socket to an OS-specified port number
-    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    udp_socket.bind(('', 0))
+    # Refuse clients speaking a different protocol version
+    error = check_Version(message)
+    if error is not None:
+        log(f"Refusing {tcp_addr}: {error}")
+        await send_Message(writer, {'status': 'error', 'message': error, 'version': PROTOCOL_VERSION})
+        writer.close()
+        return
+
+    # Refuse the session if the server is already running as many tests as it allows
+    if not capacity.open_Session():
+        log(f"Session limit reached. Refusing {tcp_addr}")
+        await send_Message(writer, {'status': 'busy'})
+        writer.close()
+        return
 
-    # Send OS-allocated UDP port number to client as JSON
+    udp_socket = None
+    receiver_shards = None
+    try:
+        # Bind UDP socket to an OS-specified port number
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        if workers > 1:
+            udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        udp_socket.bind(('', 0))
+
+        if workers > 1:
+            listener = UDP_Reply if echo else UDP_Listener
+            receiver_shards = await asyncio.to_thread(shards.Receiver_Shards, udp_socket.getsockname()[1], workers - 1, listener, UDP_Listener)
+        await Session_Handler(reader, writer, udp_socket, echo, capacity, receiver_shards, tcp_addr[0], hot_path, log)
+    except (ConnectionError, json.JSONDecodeError):
+        log(f"Session with {tcp_addr} ended unexpectedly")
+    # Anything else is a fault in this session alone. Log it and end the session rather than let it escape the
+    # connection callback, where asyncio would only report it once the server shuts down
+    except Exception as error:
+        log(f"Session with {tcp_addr} failed: {error!r}")
+    finally:
+        capacity.close_Session()
+        if receiver_shards is not None:
+            await asyncio.to_thread(receiver_shards.close)
+        if udp_socket is not None:
+            udp_socket.close()
+        writer.close()
+
+# Param: hot_path: The open collapsed stack file of the hot path profile, or None if the server is not profiling
+# Param: log: The function progress messages are passed to
+async def Session_Handler(reader, writer, udp_socket, echo, capacity, receiver_shards, client_host, hot_path=None, log=print):
+    # Random session id stamped into every test packet so strays from other sessions can be told apart
+    session_id = random.getrandbits(32)
+
+    # Send OS-allocated UDP port number and session id to client as JSON
     response = {
         'status': 'synchronize-ack',
-        'udp_port': udp_socket.getsockname()[1]
+        'udp_port': udp_socket.getsockname()[1],
+        'session_id': session_id,
+        'version': PROTOCOL_VERSION
     }
-    tcp_conn.send(json.dumps(response).encode('utf-8') + b'\n')
+    await send_Message(writer, response)
 
-    # Global round result storage
+    # Per-session round result storage
     results = []
 
     # Handle each transmission round until client terminates test
     while True:
 
         # Await and decode round configuration JSON
-        data = bytearray()
-        byte = tcp_conn.recv(1)
-        while byte != '':
-            if b'\n' == byte:
-                break
-            data += byte
-            byte = tcp_conn.recv(1)
-
-        round_config = json.loads(data.decode('utf-8'))
+        round_config = await read_Message(reader)
+        if round_config is None:
+            log("Client disconnected before completing the test")
+            return
+        if not isinstance(round_config, dict) or 'status' not in round_config:
+            log("Error: Malformed control message")
+            await send_Message(writer, {'status': 'error', 'message': "Control messages must be objects with a status"})
+            return
 
         # If testing is complete, compute results, return to sender, and terminate connection
         if (round_config['status'] == 'test_complete'):
-            print("Testing complete. Closing Connection...")
-            tcp_conn.send(json.dumps(results).encode('utf-8') + b'\n')
-            tcp_conn.close()
-            udp_socket.close()
+            log("Testing complete. Closing Connection...")
+            await send_Message(writer, results)
             return
 
-        # Getting artificial loss value from config
-        if round_config['loss'] > 1 or round_config['loss'] < 0:
-            print("Error: Argument 'loss' must be in the range 0 <= x <= 1")
-            tcp_conn.send(json.dumps("Error: Argument 'loss' must be in the range 0 <= x <= 1").encode('utf-8') + b'\n')
-            tcp_conn.close()
-            udp_socket.close()
+        # Path MTU probe. Count which probe sizes arrive intact until the client says it is done
+        if (round_config['status'] == 'mtu_probe'):
+            received = set()
+            stop_signal = Stop_Signal()
+            probe_thread = threading.Thread(target=UDP_MTU_Probe, args=(udp_socket, session_id, received, stop_signal,))
+            probe_thread.start()
+            try:
+                await send_Message(writer, {'status': 'ready'})
+                probe_complete = await read_Message(reader)
+            finally:
+                stop_signal.set()
+                await asyncio.to_thread(probe_thread.join)
+                stop_signal.close()
+            if probe_complete is None:
+                log("Client disconnected during path MTU probing")
+                return
+            await send_Message(writer, {'status': 'mtu_probe_result', 'received': sorted(received)})
+            continue
+
+        # Check the round configuration before anything reads it
+        error = check_Round(round_config)
+        if error is not None:
+            log(f"Error: {error}")
+            await send_Message(writer, {'status': 'error', 'message': error})
             return
-        loss = round_config['loss']
-
-        # Testing has proceeded to the next round. Create arguments, spawn handler, and signal ready
-        statistics = []
-        stop_signal = False
-        listener_thread = {}
-        if echo == True:
-            listener_thread = threading.Thread(target=UDP_Reply, args=(udp_socket, round_config['expected_payload'], statistics, loss, lambda: stop_signal,))
-        else:
-            listener_thread = threading.Thread(target=UDP_Listener, args=(udp_socket, round_config['expected_payload'], statistics, loss, lambda: stop_signal,))
-        listener_thread.start()
-        tcp_conn.send(json.dumps({'status': 'ready'}).encode('utf-8') + b'\n')
 
-        start = time.time()
+        # TCP bulk rounds stream over a connection of their own rather than the session's UDP socket
+        if round_config.get('transport') == 'tcp':
+            if not await TCP_Bulk_Round(reader, writer, round_config, capacity, results, client_host, log):
+                return
+            continue
 
-        # Await round completion JSON from client
-        data = bytearray()
-        byte = tcp_conn.recv(1)
-        while byte != '':
-            if b'\n' == byte:
-                break
-            data += byte
-            byte = tcp_conn.recv(1)
+        # Time everything this round does, from here on, when profiling
+        hot_profile = Hot_Path_Profile() if hot_path is not None else None
+        configured = time.perf_counter_ns()
+
+        # Check packet size validity
+        packet_size = round_config.get('packet_size', 9216)
+        if packet_size < HEADER_SIZE or packet_size > MAX_DATAGRAM:
+            log(f"Error: Packet size {packet_size} is outside the supported range")
+            await send_Message(writer, {'status': 'error', 'message': f"Packet size must be in the range {HEADER_SIZE} <= x <= {MAX_DATAGRAM}"})
+            return
 
-        finish = time.time()
-        diff = finish - start
+        # Check the artificial impairment settings from config
+        error = check_Impairment(round_config.get('impairment') or {})
+        if error is not None:
+            log(f"Error: {error}")
+            await send_Message(writer, {'status': 'error', 'message': error})
+            return
 
-        # Signal UDP listening thread to terminate and then await it
-        stop_signal = True
-        listener_thread.join()
+        # Integrity analysis runs on this host, so it needs NumPy here
+        if round_config.get('integrity', False) and not integrity.SUPPORTED:
+            log("Error: Integrity analysis was requested but NumPy is not installed")
+            await send_Message(writer, {'status': 'error', 'message': "Integrity analysis requires NumPy on the server"})
+            return
 
-        # Compute round results
-        results.append(compute_Results(round_config, statistics, diff))
+        # Check the traffic profile, which results are broken down by
+        profile = round_config.get('profile')
+        if profile is not None:
+            error = check_Profile(profile)
+            if error is not None:
+                log(f"Error: {error}")
+                await send_Message(writer, {'status': 'error', 'message': error})
+                return
 
-        # Signal client that server is ready for the next round
-        tcp_conn.send(json.dumps({'status': 'ready'}).encode('utf-8') + b'\n')
+        # In full duplex mode this server also sends its own traffic to the client's UDP port
+        downstream = round_config.get('downstream')
+        if downstream is not None and not 0 < downstream.get('port', 0) <= 65535:
+            log("Error: Full duplex round without a valid client port")
+            await send_Message(writer, {'status': 'error', 'message': "Full duplex mode needs the client's UDP port"})
+            return
 
+        # Both directions of a full duplex round count against the bandwidth budget
+        round_rate = round_config['rate'] + (downstream['rate'] if downstream is not None else 0)
 
-def compute_Results(round_config, statistics, diff):
+        # Rounds faster than the whole bandwidth budget can never be admitted
+        if capacity.max_rate is not None and round_rate > capacity.max_rate:
+            log(f"Error: Round rate {round_rate} mbps exceeds the server limit of {capacity.max_rate} mbps")
+            await send_Message(writer, {'status': 'error', 'message': f"Round rate exceeds the server limit of {capacity.max_rate} mbps"})
+            return
+
+        # Wait for enough of the aggregate bandwidth budget to run this round alongside any other sessions
+        await capacity.reserve(round_rate)
+        # Release the reservation however the round ends, including while it is being set up, or every later
+        # round would wait for bandwidth that is never returned. Free the round's shared bitmap the same way, or
+        # an aborted round would leak its /dev/shm segment
+        released = False
+        tracker = None
+        try:
+            # Testing has proceeded to the next round. Create arguments, spawn handler, and signal ready
+            listener_thread = {}
+            # Size the socket buffers for this round's rate and snapshot the host's drop counters
+            rate = round_config['rate'] * 1000000
+            size_Receive_Buffer(udp_socket, rate)
+            if downstream is not None:
+                size_Send_Buffer(udp_socket, downstream['rate'] * 1000000)
+            elif echo == True:
+                size_Send_Buffer(udp_socket, rate)
+            meter = await asyncio.to_thread(Drop_Meter, udp_socket.getsockname()[1])
+
+            streams = round_config.get('streams', 1)
+            analyzer = Corruption_Analyzer(round_config['expected_payload'], packet_size) if round_config.get('integrity', False) else None
+            # The arrival array is sized by the round's packet count, so allocate it off the event loop
+            if receiver_shards is not None:
+                tracker = await asyncio.to_thread(receiver_shards.start_Round, session_id, round_config, streams, packet_size, hot_profile is not None)
+            else:
+                tracker = await asyncio.to_thread(Sequence_Tracker, session_id, round_config['round'], round_config['packet_count'], streams)
+            statistics = [0, 0, tracker]
+            impairment = impairment_Plan(round_config, session_id)
+            stop_signal = Stop_Signal()
+            # The client is receiving the server's own traffic in full duplex mode, so nothing is echoed
+            if echo == True and downstream is None:
+                listener_thread = threading.Thread(target=UDP_Reply, args=(udp_socket, round_config['expected_payload'], packet_size, tracker, statistics, impairment, stop_signal, analyzer, hot_profile,))
+            else:
+                listener_thread = threading.Thread(target=UDP_Listener, args=(udp_socket, round_config['expected_payload'], packet_size, tracker, statistics, impairment, stop_signal, analyzer, hot_profile,))
+            listener_thread.start()
+
+            telemetry = None
+            sender_thread = None
+            sender_report = {}
+            try:
+                await send_Message(writer, {'status': 'ready'})
+                if hot_profile is not None:
+                    hot_profile.add('control;setup', time.perf_counter_ns() - configured)
+
+                start = time.time()
+
+                # The client starts sending on 'ready', so start the downstream sender alongside it
+                if downstream is not None:
+                    sender_thread = threading.Thread(target=UDP_Sender, args=(udp_socket, (client_host, downstream['port']), session_id, round_config['round'], downstream, packet_size,
+                                                                              round_config.get('duration', 1), round_config.get('integrity', False), sender_report, hot_profile, log,))
+                    sender_thread.start()
+
+                # Push live counters to the client while the round runs if it asked for them
+                interval = round_config.get('telemetry', 0)
+                if interval > 0:
+                    telemetry = asyncio.create_task(stream_Telemetry(writer, round_config, statistics, receiver_shards, interval))
+
+                # Await round completion JSON from client
+                round_complete = await read_Message(reader)
+                completed = time.perf_counter_ns()
+
+                finish = time.time()
+                diff = finish - start
+            finally:
+                if telemetry is not None:
+                    telemetry.cancel()
+                    try:
+                        await telemetry
+                    except asyncio.CancelledError:
+                        pass
+                # Signal UDP listening thread to terminate and then await it without blocking other sessions
+                stop_signal.set()
+                await asyncio.to_thread(listener_thread.join)
+                stop_signal.close()
+                if receiver_shards is not None:
+                    await asyncio.to_thread(receiver_shards.stop_Round)
+                # The downstream sender paces itself over the round's duration, so it finishes about when the client does
+                if sender_thread is not None:
+                    await asyncio.to_thread(sender_thread.join)
+                await capacity.release(round_rate)
+                released = True
+
+            if round_complete is None:
+                log("Client disconnected before completing the round")
+                return
+
+            # Fold every receive shard's counts, and its receive loop timings when profiling, into this round's
+            # statistics and profile
+            if receiver_shards is not None:
+                receiver_shards.merge(statistics, analyzer, hot_profile)
+
+            # Record the rate the client's pacer actually achieved alongside the target rate
+            round_config['achieved_rate'] = round_complete.get('achieved_rate', 0)
+            round_config['achieved_pps'] = round_complete.get('achieved_pps', 0)
+
+            # Attribute drops in this host's socket buffers (every shard shares the port) and the client's send buffer
+            receive_drops, send_drops, in_errors = await asyncio.to_thread(meter.read)
+            round_config['host_drops'] = receive_drops
+            round_config['send_drops'] = round_complete.get('send_drops', 0)
+            round_config['in_errors'] = in_errors
+
+            # Compute round results. Summarizing the arrival array scans it, so this runs off the event loop too
+            result = await asyncio.to_thread(compute_Results, round_config, statistics, diff, analyzer, log)
+            # A soak test runs for hours, so its rounds are only summarized by the client
+            if not round_config.get('soak', False):
+                results.append(result)
+
+            # Signal client that server is ready for the next round, passing along this round's result
+            response = {'status': 'ready', 'result': result}
+            if streams > 1:
+                response['streams'] = await asyncio.to_thread(tracker.stream_Summary)
+            if downstream is not None:
+                response['downstream'] = dict(sender_report, send_drops=send_drops)
+            if profile is not None:
+                # Compile the client's schedule again from its seed to learn the phase of every sequence number
+                schedule, phases = await asyncio.to_thread(compile_Schedule, profile, round_config['packet_count'], round_config.get('duration', 1), profile.get('seed', 0))
+                response['phases'] = await asyncio.to_thread(phase_Summary, phases, tracker.seen, phase_Names(profile))
+            # The time from the client's round_complete to this reply includes joining the loops and computing results
+            if hot_profile is not None:
+                hot_profile.add('control;results', time.perf_counter_ns() - completed)
+                response['hot_path'] = hot_profile.counters()
+                write_Collapsed(hot_path, f"lis;round_{round_config['round']}", response['hot_path'])
+            await send_Message(writer, response)
+        finally:
+            if not released:
+                await capacity.release(round_rate)
+            if receiver_shards is not None and tracker is not None:
+                receiver_shards.end_Round(tracker)
+
+
+def compute_Results(round_config, statistics, diff, analyzer=None, log=print):
     
-    print(round_config)
-    packets_received, packets_mangled = statistics
-    print(f'Packets mangled {packets_mangled}')
+    log(round_config)
+    packets_received, packets_mangled, tracker = statistics
+    sequence = tracker.summary()
+    log(f'Packets mangled {packets_mangled}')
+    # Drops inside this host's socket buffers are not network loss
+    host_drops = round_config.get('host_drops', 0)
+    # The send drops and input errors are counted host-wide, so they are reported as context rather than subtracted
+    send_drops = round_config.get('send_drops', 0)
+    in_errors = round_config.get('in_errors', 0)
     if (round_config['packet_count'] > 0):
         lost_percent = (round_config['packet_count'] - packets_received) / round_config['packet_count'] * 100
+        net_lost_percent = max(0, round_config['packet_count'] - packets_received - host_drops) / round_config['packet_count'] * 100
     else:
         lost_percent = 0
+        net_lost_percent = 0
 
     if(packets_received > 0):
         mangled_percent = 100 - ((packets_received - packets_mangled) / packets_received * 100)
@@ -199,72 +587,279 @@ def compute_Results(round_config, statistics, diff):
     if lost_percent > 7:
         rating = 'fail'
 
-    return {
+    result = {
         'round': round_config['round'],
+        'size': round_config.get('packet_size', 9216),
         'rate': round_config['rate'],
+        'achieved': round_config.get('achieved_rate', 0),
+        'pps': round_config['rate'] * 1000000 / 8 / round_config.get('packet_size', 9216),
+        'achieved_pps': round_config.get('achieved_pps', 0),
         'packets': round_config['packet_count'],
         'lost': lost_percent,
+        'host_drops': host_drops,
+        'send_drops': send_drops,
+        'in_errors': in_errors,
+        'net_lost': net_lost_percent,
         'mangled': mangled_percent,
+        'duplicates': sequence['duplicates'],
+        'stray': sequence['stray'],
+        'out_of_order': sequence['out_of_order'],
+        'reorder_mean': sequence['reorder_mean'],
+        'reorder_max': sequence['reorder_max'],
+        'gaps': sequence['gaps'],
+        'gap_max': sequence['gap_max'],
+        'rating': rating,
+        'duration': diff
+    }
+    # In integrity mode, add the bit error rate and where in the payload the corruption landed
+    if analyzer is not None:
+        result.update(analyzer.summary(packets_received))
+    return result
+
+# Computes a TCP bulk round's results. TCP delivers every byte it can, so rounds are rated by how far the goodput fell
+# short of the target, on the same thresholds as loss. The goodput is taken over at least the round's duration,
+# since the sender is paced to span it
+# Param: round_config: The round configuration
+# Param: report: The receiver's counters (see receive_Bulk)
+# Param: round_complete: The client's round_complete message, carrying the sender's achieved rate and TCP_INFO counters
+# Param: diff: The number of seconds from 'ready' to round_complete
+# Param: log: The function progress messages are passed to
+def compute_Bulk_Results(round_config, report, round_complete, diff, log=print):
+    log(round_config)
+    byte_count = round_config['byte_count']
+    received = report.get('received', 0)
+    span = max(report.get('elapsed', 0), round_config.get('duration', 1))
+    goodput = received * 8 / span / 1000000
+    shortfall = max(0, 1 - goodput / round_config['rate']) * 100 if round_config['rate'] > 0 else 0
+
+    rating = 'pass'
+    if shortfall > 1:
+        rating = 'acceptable'
+    if shortfall > 7:
+        rating = 'fail'
+
+    intervals = report.get('intervals', [])
+    return {
+        'round': round_config['round'],
+        'size': round_config.get('packet_size', 9216),
+        'rate': round_config['rate'],
+        'achieved': round_complete.get('achieved_rate', 0),
+        'packets': round_config['packet_count'],
+        'lost': (byte_count - received) / byte_count * 100 if byte_count > 0 else 0,
+        'goodput': goodput,
+        'retransmits': round_complete.get('retransmits'),
+        'tcp_rtt': round_complete.get('tcp_rtt'),
+        'interval_min': min(intervals, default=0),
+        'interval_max': max(intervals, default=0),
+        'intervals': intervals,
         'rating': rating,
         'duration': diff
     }
 
+# Sends the client the round's counters for every interval while the round runs, until cancelled. Each
+# message carries the packets received and mangled during the interval, and the growth in the number of
+# sequence numbers missing below the highest one seen, which is the interval's loss as far as can be told
+# before the round ends (late reordered packets make it negative)
+# Param: writer: The session's control stream
+# Param: round_config: The round configuration
+# Param: statistics: The listener's live [packets_received, packets_mangled, tracker]
+# Param: receiver_shards: The session's Receiver_Shards, whose live counts are added in, or None
+# Param: interval: The reporting interval in seconds
+async def stream_Telemetry(writer, round_config, statistics, receiver_shards, interval):
+    tracker = statistics[2]
+    packet_size = round_config.get('packet_size', 9216)
+    start = time.perf_counter()
+    previous = (0, 0, 0)
+    tick = 1
+    while True:
+        await asyncio.sleep(max(0, start + tick * interval - time.perf_counter()))
+        received = statistics[0]
+        mangled = statistics[1]
+        missing = tracker.missing()
+        if receiver_shards is not None:
+            shard_received, shard_mangled, shard_missing = receiver_shards.live_Counts()
+            received = received + shard_received
+            mangled = mangled + shard_mangled
+            missing = missing + shard_missing
+        await send_Message(writer, {
+            'status': 'telemetry',
+            'round': round_config['round'],
+            'time': round(tick * interval, 6),
+            'received': received - previous[0],
+            'lost': missing - previous[1],
+            'mangled': mangled - previous[2],
+            'rate': (received - previous[0]) * packet_size * 8 / interval / 1000000
+        })
+        previous = (received, missing, mangled)
+        tick = tick + 1
+
 # Handles UDP listening on a separate thread so that the TCP connection can be monitored by main thread for status updates
 # Param: udp_socket: The udp socket to be monitored
 # Param: expected_byte: An integer representation of the expected byte value repeated in the payload
-# Param: statistics: A list object consisting of the tuple [packets_received, packets_mangled]
-# Param: loss: A float value that specifies the amount of articial loss to be inserted into the analysis
-# Param: signal: A boolean that signifies whether the thread should terminate after a period of no new packets (should be passed as a lambda to avoid pass-by-value)
-def UDP_Listener(udp_socket, expected_byte, statistics, loss, signal):
+# Param: packet_size: The size in bytes of every datagram sent this round
+# Param: tracker: The Sequence_Tracker for the current round, used to discard duplicate and stray packets
+# Param: statistics: A list object consisting of the tuple [packets_received, packets_mangled, tracker], kept current as packets arrive
+# Param: impairment: An optional Impairment whose precomputed plan drops, corrupts and reorders arriving packets
+# Param: signal: A Stop_Signal that is set when the round ends. The thread drains any remaining packets and terminates as soon as the socket goes idle
+# Param: analyzer: An optional Corruption_Analyzer. When given, packets are verified by CRC and the mangled ones are analyzed
+# Param: profile: An optional Hot_Path_Profile that receives the time spent receiving, idle, impairing and comparing packets
+def UDP_Listener(udp_socket, expected_byte, packet_size, tracker, statistics, impairment, signal, analyzer=None, profile=None):
 
     packets_received = 0
     packets_mangled = 0
-    payload = bytearray([expected_byte] * 9216)
+    fill = expected_Fill(expected_byte, packet_size)
+    ring = Recv_Ring(udp_socket, signal, profile=profile)
 
-    while True:
-        udp_socket.settimeout(1)
+    done = False
+    while not done:
         try:
-            udp_msg = udp_socket.recv(9216)
-            # If packet falls within artificial loss window, drop (ignore) it
-            if(random.random() > loss):
-                # If payload matches expected payload, just increment packet counter
-                if(udp_msg == payload):
-                    packets_received = packets_received + 1
-                # Else, payload was mangled. Increment packet counter and magled packet counter
-                else:
-                    packets_received = packets_received + 1
-                    packets_mangled = packets_mangled + 1
+            count = ring.recv_Batch(1)
+            packets = [ring.packet(i) for i in range(count)]
+            # Artificial impairments were decided before the round, so applying them is a lookup per packet
+            if impairment is not None:
+                started = time.perf_counter_ns() if profile is not None else 0
+                packets = impairment.apply(packets)
+                if profile is not None:
+                    profile.add('receiver;impair', time.perf_counter_ns() - started)
         except socket.timeout:
-            if signal():
-                statistics.append(packets_received)
-                statistics.append(packets_mangled)
-                return
+            if not signal():
+                continue
+            # Deliver any packets the impairment is still holding back, then finish
+            done = True
+            packets = impairment.flush() if impairment is not None else []
+
+        started = time.perf_counter_ns() if profile is not None else 0
+        for udp_msg in packets:
+            # Only the first copy of each sequence number from this round is counted
+            if(tracker.record(udp_msg)):
+                packets_received = packets_received + 1
+                if analyzer is None:
+                    # If the fill after the header does not match the expected payload, the packet was mangled
+                    if(udp_msg[HEADER_SIZE:] != fill):
+                        packets_mangled = packets_mangled + 1
+                # In integrity mode the packet's CRC is checked instead, and mangled packets are kept for analysis
+                elif not verify_Checksum(udp_msg):
+                    packets_mangled = packets_mangled + 1
+                    analyzer.add(udp_msg)
+        # Publish the running counts once per batch so they can be reported mid-round
+        statistics[0] = packets_received
+        statistics[1] = packets_mangled
+        if profile is not None:
+            profile.add('receiver;compare', time.perf_counter_ns() - started)
+
+    ring.close()
 
-def UDP_Reply(udp_socket, expected_byte, statistics, loss, signal):
+# Echoes every packet back to the client as it arrives, then accounts for it as UDP_Listener does. A session's
+# packets all come from its client's one socket, so each batch is echoed to the batch's sender. When profiling,
+# the time spent echoing and comparing is recorded as one phase
+def UDP_Reply(udp_socket, expected_byte, packet_size, tracker, statistics, impairment, signal, analyzer=None, profile=None):
 
     packets_received = 0
     packets_mangled = 0
-    payload = bytearray([expected_byte] * 9216)
+    fill = expected_Fill(expected_byte, packet_size)
+    ring = Recv_Ring(udp_socket, signal, profile=profile)
+    peer = None
 
-    while True:
-        udp_socket.settimeout(1)
+    done = False
+    while not done:
         try:
-            udp_msg, udp_addr = udp_socket.recvfrom(9216)
-            # If packet falls within artificial loss window, drop (ignore) it
-            if(random.random() > loss):
-                # If payload matches expected payload, just increment packet counter
-                udp_socket.sendto(udp_msg, udp_addr)
-                if(udp_msg == payload):
-                    packets_received = packets_received + 1
-                # Else, payload was mangled. Increment packet counter and magled packet counter
-                else:
-                    packets_received = packets_received + 1
+            count = ring.recv_Batch(1)
+            packets = [ring.packet(i) for i in range(count)]
+            if count > 0:
+                peer = ring.addresses[count - 1]
+            # Artificial impairments were decided before the round, so applying them is a lookup per packet
+            if impairment is not None:
+                started = time.perf_counter_ns() if profile is not None else 0
+                packets = impairment.apply(packets)
+                if profile is not None:
+                    profile.add('receiver;impair', time.perf_counter_ns() - started)
+        except socket.timeout:
+            if not signal():
+                continue
+            # Echo any packets the impairment is still holding back, then finish
+            done = True
+            packets = impairment.flush() if impairment is not None else []
+
+        started = time.perf_counter_ns() if profile is not None else 0
+        for udp_msg in packets:
+            # Echo the received view straight back without copying it
+            udp_socket.sendto(udp_msg, peer)
+            # Only the first copy of each sequence number from this round is counted
+            if(tracker.record(udp_msg)):
+                packets_received = packets_received + 1
+                if analyzer is None:
+                    # If the fill after the header does not match the expected payload, the packet was mangled
+                    if(udp_msg[HEADER_SIZE:] != fill):
+                        packets_mangled = packets_mangled + 1
+                # In integrity mode the packet's CRC is checked instead, and mangled packets are kept for analysis
+                elif not verify_Checksum(udp_msg):
                     packets_mangled = packets_mangled + 1
+                    analyzer.add(udp_msg)
+        # Publish the running counts once per batch so they can be reported mid-round
+        statistics[0] = packets_received
+        statistics[1] = packets_mangled
+        if profile is not None:
+            profile.add('receiver;echo', time.perf_counter_ns() - started)
+
+    ring.close()
+
+# Sends the server's own paced traffic to the client in full duplex mode, concurrently with the round's listener.
+# Packets carry the session id and round like the client's, with their own payload byte and sequence numbers
+# Param: udp_socket: The session's UDP socket. The client's socket only accepts packets from it
+# Param: address: The (host, port) of the client's UDP socket
+# Param: session_id: The session id stamped into every packet
+# Param: round_number: The round number stamped into every packet
+# Param: downstream: The round's downstream configuration: its rate, packet_count and expected_payload
+# Param: packet_size: The size in bytes of every datagram sent this round
+# Param: duration: The length of the round in seconds
+# Param: checksum: Whether packets carry a CRC for integrity analysis
+# Param: report: An empty dict that receives the achieved rate (mbps) and packet rate once the round has been sent
+# Param: profile: An optional Hot_Path_Profile that receives the time spent sending and pacing
+# Param: log: The function progress messages are passed to
+def UDP_Sender(udp_socket, address, session_id, round_number, downstream, packet_size, duration, checksum, report, profile=None, log=print):
+
+    writer = Packet_Writer(session_id, round_number, downstream['expected_payload'], packet_size, checksum=checksum)
+    # Connecting the session socket would steer the client's packets away from any receive shards
+    sender = Batch_Sender(udp_socket, address, connect=False)
+    pacer = Pacer(downstream['packet_count'], duration, profile=profile)
+
+    pacer.begin()
+    burst = pacer.wait()
+    try:
+        while burst > 0:
+            started = time.perf_counter_ns() if profile is not None else 0
+            sender.send_Sequenced(writer, burst)
+            if profile is not None:
+                profile.add('sender;send', time.perf_counter_ns() - started)
+            burst = pacer.wait()
+    except OSError as error:
+        log(f"Downstream sender stopped: {error}")
+    pacer.end()
+
+    report['achieved_rate'] = pacer.achieved_Rate(packet_size) / 1000000
+    report['achieved_pps'] = pacer.achieved_PPS()
+
+# Records the size of every path MTU probe from this session that arrives until the probe is stopped
+# Param: udp_socket: The udp socket to be monitored
+# Param: session_id: The session id probes must carry
+# Param: received: A set that the sizes of the received probes are added to
+# Param: signal: A Stop_Signal that is set when the client has sent every probe
+def UDP_MTU_Probe(udp_socket, session_id, received, signal):
+
+    ring = Recv_Ring(udp_socket, signal)
 
+    while True:
+        try:
+            count = ring.recv_Batch(1)
+            for i in range(count):
+                udp_msg = ring.packet(i)
+                if len(udp_msg) >= HEADER_SIZE:
+                    probe_session, probe_round, size, sent = HEADER.unpack_from(udp_msg)
+                    if probe_session == session_id and probe_round == PROBE_ROUND and size == len(udp_msg):
+                        received.add(size)
         except socket.timeout:
             if signal():
-                statistics.append(packets_received)
-                statistics.append(packets_mangled)
+                ring.close()
                 return
 
 
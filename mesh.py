@@ -0,0 +1,295 @@
+#!/usr/bin/python3
+
+import argparse
+import json
+import os
+import shlex
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from tabulate import tabulate
+
+# The port lis.py listens on unless a host entry says otherwise
+DEFAULT_PORT = 62994
+# Seconds allowed per probe on top of its duration (connection, path MTU probing and result exchange)...
+PROBE_OVERHEAD = 5
+# ...and per test on top of its probes
+TEST_OVERHEAD = 30
+# Seconds to wait for a local server to start accepting connections
+SERVER_START_TIMEOUT = 5
+# The directory lic.py and lis.py live in
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def main():
+
+    # Parse required arguments
+    parser = argparse.ArgumentParser(description='LAN Integrity Tester mesh orchestrator')
+    parser.add_argument('hosts', type=str, nargs='?', help='A file listing the hosts running lis.py, one [name=]address[:port] per line')
+    parser.add_argument('rate', type=int, help='The maximum rate in mbps searched up to on every pair')
+    parser.add_argument('-r', dest='probes', type=int, nargs='?', help='The maximum number of rate search probes per pair (max 25). Default is 8')
+    parser.add_argument('-rt', action='store_true', help='A flag to measure round trip times too. Every server must run in round trip mode')
+    parser.add_argument('-tcp', action='store_true', help='A flag to test TCP bulk throughput instead of UDP')
+    parser.add_argument('-sz', dest='packet_size', type=int, nargs='?', help='The packet size in bytes. Default is 9216')
+    parser.add_argument('-d', dest='duration', type=float, nargs='?', help='The length of each probe in seconds. Default is 1')
+    parser.add_argument('-c', dest='client', type=str, nargs='?', help='The command that runs lic.py on a source host, with {address} and {name} standing for the host, e.g. "ssh {address} python3 lic.py". Required unless every host is this one, which runs lic.py locally')
+    parser.add_argument('-j', dest='concurrency', type=int, nargs='?', help='The maximum number of tests run at once. Default is as many as the schedule allows')
+    parser.add_argument('-local', dest='local', type=int, nargs='?', help='Start this many servers on loopback ports and test them instead of a host file')
+    parser.add_argument('-o', dest='output', type=str, nargs='?', help='A file the matrix and every pair result are written to as JSON')
+    args = parser.parse_args()
+
+    # Check probe validity
+    probes = 8
+    if args.probes is not None:
+        if args.probes < 1 or args.probes > 25:
+            print("Error: Argument 'probes' must be in the range 1 <= x <= 25")
+            exit(1)
+        probes = args.probes
+
+    duration = args.duration if args.duration is not None else 1
+    if duration <= 0 or duration > 60:
+        print("Error: Argument 'duration' must be in the range 0 < x <= 60")
+        exit(1)
+
+    if args.concurrency is not None and args.concurrency < 1:
+        print("Error: Argument 'concurrency' must be at least 1")
+        exit(1)
+
+    # Gather the hosts, starting local servers if asked to
+    servers = []
+    if args.local is not None:
+        if args.local < 2 or args.local > 64:
+            print("Error: Argument 'local' must be in the range 2 <= x <= 64")
+            exit(1)
+        hosts, servers = start_Local_Servers(args.local, args.rt)
+    elif args.hosts:
+        try:
+            hosts = load_Hosts(args.hosts)
+        except ValueError as error:
+            print(f"Error: {error}")
+            exit(1)
+    else:
+        print("Error: Give a host file or -local")
+        exit(1)
+    if len(hosts) < 2:
+        print("Error: A mesh needs at least 2 hosts")
+        exit(1)
+
+    # Without -c every test would run from this host, so the matrix would misattribute every source but this one
+    # and every test would share this host's link, breaking the schedule's guarantee that no link carries two
+    if not args.client:
+        remote = [host['name'] for host in hosts if not is_Local(host['address'])]
+        if remote:
+            print(f"Error: Hosts {', '.join(remote)} are not this host. Give -c with a command that runs lic.py on each source host, e.g. \"ssh {{address}} python3 lic.py\"")
+            exit(1)
+    client = args.client if args.client else f"{shlex.quote(sys.executable)} {shlex.quote(os.path.join(HERE, 'lic.py'))}"
+    options = [str(probes), str(args.rate), '-search', '-br', '-d', str(duration)]
+    if args.packet_size:
+        options = options + ['-sz', str(args.packet_size)]
+    if args.rt:
+        options = options + ['-rt']
+    if args.tcp:
+        if args.rt:
+            print("Error: TCP bulk mode cannot be combined with round trip mode")
+            exit(1)
+        options = options + ['-tcp']
+    timeout = probes * (duration + PROBE_OVERHEAD) + TEST_OVERHEAD
+
+    # Every slot tests disjoint pairs of hosts, so no host (or its link) carries two tests at once
+    slots = mesh_Schedule(len(hosts))
+    pairs = []
+    try:
+        for number, slot in enumerate(slots):
+            print(f"Running slot {number + 1} of {len(slots)}: " + ", ".join(f"{hosts[source]['name']} -> {hosts[destination]['name']}" for source, destination in slot))
+            batch_size = args.concurrency if args.concurrency else len(slot)
+            for first in range(0, len(slot), batch_size):
+                pairs.extend(run_Tests(hosts, slot[first:first + batch_size], client, options, timeout))
+    finally:
+        for server in servers:
+            server.terminate()
+            server.wait()
+
+    # Print a matrix per measurement, sources down the side and destinations across the top
+    names = [host['name'] for host in hosts]
+    print("\n")
+    matrices = {'max_rate': "Maximum sustainable rate (mbps)", 'lost': "Loss at that rate (%)"}
+    if args.tcp:
+        matrices = {'max_rate': "Maximum sustainable rate (mbps)", 'retransmits': "Retransmits at that rate"}
+    if args.rt:
+        matrices.update({'rtt_p50': "RTT p50 at that rate (ms)", 'rtt_p99': "RTT p99 at that rate (ms)"})
+    for metric, title in matrices.items():
+        print(f"{title}:")
+        print(tabulate(mesh_Matrix(pairs, names, metric), headers=["From \\ To"] + names, tablefmt="grid"))
+    failures = [pair for pair in pairs if pair['error'] is not None]
+    for pair in failures:
+        print(f"{pair['source']} -> {pair['destination']} failed: {pair['error']}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'hosts': hosts, 'rate': args.rate, 'probes': probes, 'duration': duration, 'pairs': pairs}, output, indent=2)
+        print(f"Results saved to {args.output}")
+    if failures:
+        exit(1)
+
+
+# Reads a host file: one [name=]address[:port] per line. Blank lines and # comments are ignored.
+# Raises ValueError if it cannot be read
+def load_Hosts(path):
+    try:
+        with open(path) as host_file:
+            lines = host_file.readlines()
+    except OSError as error:
+        raise ValueError(f"Cannot read the host file: {error}")
+    hosts = []
+    for line in lines:
+        entry = line.split('#', 1)[0].strip()
+        if not entry:
+            continue
+        name, separator, target = entry.rpartition('=')
+        address, separator, port = target.partition(':')
+        try:
+            port = int(port) if port else DEFAULT_PORT
+        except ValueError:
+            raise ValueError(f"Bad port in host entry '{entry}'")
+        hosts.append({'name': name or target, 'address': address, 'port': port})
+    names = [host['name'] for host in hosts]
+    if len(set(names)) != len(names):
+        raise ValueError("Host names must be unique")
+    return hosts
+
+# Returns whether address is one of this host's own addresses. Only a local address can be bound to
+def is_Local(address):
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.bind((address, 0))
+        return True
+    except OSError:
+        return False
+
+# Starts count servers on free loopback ports and waits until they accept connections. Returns the hosts and the processes
+def start_Local_Servers(count, rt):
+    hosts = []
+    servers = []
+    for index in range(count):
+        probe = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+        probe.close()
+        command = [sys.executable, os.path.join(HERE, 'lis.py'), '-p', str(port), '-br'] + (['-rt'] if rt else [])
+        servers.append(subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        hosts.append({'name': f"local{index + 1}", 'address': '127.0.0.1', 'port': port})
+
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    for host in hosts:
+        while True:
+            try:
+                socket.create_connection((host['address'], host['port'])).close()
+                break
+            except OSError:
+                if time.monotonic() > deadline:
+                    for server in servers:
+                        server.terminate()
+                    print(f"Error: Local server {host['name']} did not start")
+                    exit(1)
+                time.sleep(0.05)
+    print(f"Started {count} local servers on ports {', '.join(str(host['port']) for host in hosts)}")
+    return hosts, servers
+
+# Schedules every ordered pair of count hosts into slots in which no host appears twice, by the circle method
+# of round-robin tournaments: each of the count - 1 rounds (count, if odd) pairs every host with another, and
+# runs as two slots, one per direction. Returns a list of slots, each a list of (source, destination) indices
+def mesh_Schedule(count):
+    players = list(range(count)) + ([None] if count % 2 else [])
+    size = len(players)
+    slots = []
+    for round_number in range(size - 1):
+        pairs = [(players[i], players[size - 1 - i]) for i in range(size // 2) if players[i] is not None and players[size - 1 - i] is not None]
+        slots.append(pairs)
+        slots.append([(destination, source) for source, destination in pairs])
+        # Keep the first player fixed and rotate the rest
+        players = [players[0], players[-1]] + players[1:-1]
+    return slots
+
+# Runs the given tests at once, each as a lic.py rate search from its source host to its destination's server,
+# and returns their pair results
+# Param: hosts: Every host
+# Param: tests: The (source, destination) indices to test
+# Param: client: The command template that runs lic.py on a source host
+# Param: options: The lic.py arguments every test shares
+# Param: timeout: The number of seconds after which a test is abandoned
+def run_Tests(hosts, tests, client, options, timeout):
+    running = []
+    for source, destination in tests:
+        command = shlex.split(client.format(address=hosts[source]['address'], name=hosts[source]['name']))
+        command = command + options + ['-a', hosts[destination]['address'], '-p', str(hosts[destination]['port']), '-json', '-']
+        # Output goes to a file rather than a pipe, so a test with a lot to say cannot stall while another is read
+        output = tempfile.TemporaryFile()
+        running.append((source, destination, subprocess.Popen(command, stdout=output, stderr=subprocess.STDOUT), output))
+
+    pairs = []
+    deadline = time.monotonic() + timeout
+    for source, destination, process, output in running:
+        error = None
+        try:
+            process.wait(max(0, deadline - time.monotonic()))
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+            error = "timed out"
+        output.seek(0)
+        lines = output.read().decode('utf-8', 'replace').splitlines()
+        output.close()
+        pair = pair_Result(lines)
+        if pair is None and error is None:
+            error = lines[-1] if lines else f"exit status {process.returncode}"
+        pairs.append(dict(pair or {}, source=hosts[source]['name'], destination=hosts[destination]['name'], error=error))
+    return pairs
+
+# Extracts a pair's measurements from lic.py's output: the highest passing rate of its search, and the loss and
+# round trip times of the round that passed at that rate. Returns None if the output holds no results
+def pair_Result(lines):
+    outcome = None
+    for line in reversed(lines):
+        if line.startswith('{'):
+            try:
+                outcome = json.loads(line)
+            except ValueError:
+                continue
+            if 'results' in outcome:
+                break
+            outcome = None
+    if outcome is None:
+        return None
+
+    results = outcome['results']
+    # The search's best rate is the probe that passed at the rate it actually sent, so report that probe's loss
+    max_rate = outcome['best_rates'][0]['rate'] if outcome['best_rates'] else 0
+    passed = [result for result in results if max_rate > 0 and result['rate'] == max_rate]
+    best = passed[0] if passed else min(results, key=lambda result: result['lost'], default=None)
+    pair = {
+        'max_rate': max_rate,
+        'lost': best['lost'] if best is not None else None,
+        'retransmits': best.get('retransmits') if best is not None else None
+    }
+    for client_result in outcome.get('results_client', []):
+        if best is not None and client_result['round'] == best['round']:
+            pair['rtt_p50'] = client_result.get('rtt_p50')
+            pair['rtt_p99'] = client_result.get('rtt_p99')
+    return pair
+
+# Returns the rows of a matrix of one measurement, with '-' on the diagonal and for failed or missing pairs
+def mesh_Matrix(pairs, names, metric):
+    values = {(pair['source'], pair['destination']): pair.get(metric) for pair in pairs}
+    rows = []
+    for source in names:
+        row = [source]
+        for destination in names:
+            value = values.get((source, destination))
+            row.append('-' if value is None else value)
+        rows.append(row)
+    return rows
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/python3
+
+# Host-side UDP drop accounting from the Linux /proc interface. On other platforms every function
+# returns None and drop columns are reported as 0.
+
+# Returns the host-wide UDP counters from /proc/net/snmp (InErrors, RcvbufErrors, SndbufErrors, ...) as a dict
+def udp_Counters():
+    try:
+        with open('/proc/net/snmp') as snmp:
+            lines = [line.split() for line in snmp if line.startswith('Udp:')]
+    except OSError:
+        return None
+    if len(lines) < 2:
+        return None
+    return dict(zip(lines[0][1:], (int(value) for value in lines[1][1:])))
+
+# Returns how much counter grew between two udp_Counters() snapshots, or 0 if either is unavailable
+def counter_Delta(before, after, counter):
+    if before is None or after is None:
+        return 0
+    return after.get(counter, 0) - before.get(counter, 0)
+
+# Returns the total drop count of every UDP socket bound to the given local port (the kernel's per-socket
+# sk_drops, the same counter SO_RXQ_OVFL reports), or None if /proc/net/udp is unavailable
+def socket_Drops(port):
+    total = None
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path) as table:
+                next(table)
+                for line in table:
+                    fields = line.split()
+                    if int(fields[1].rsplit(':', 1)[1], 16) == port:
+                        total = (total or 0) + int(fields[-1])
+        except (OSError, StopIteration, ValueError, IndexError):
+            continue
+    return total
+
+# Snapshots the host counters relevant to one UDP port before a round, then reports the drops it caused
+# Param: port: The local UDP port whose sockets are measured
+class Drop_Meter:
+
+    def __init__(self, port):
+        self.port = port
+        self.counters = udp_Counters()
+        self.drops = socket_Drops(port)
+
+    # Returns (receive drops, send drops, input errors) since the meter was created. Receive drops are the port's
+    # per-socket drops where available, falling back to the host-wide RcvbufErrors counter. Send drops
+    # (SndbufErrors) and input errors (InErrors) are host-wide, so they also count other sockets' traffic
+    def read(self):
+        counters = udp_Counters()
+        drops = socket_Drops(self.port)
+        if self.drops is not None and drops is not None:
+            receive_drops = drops - self.drops
+        else:
+            receive_drops = counter_Delta(self.counters, counters, 'RcvbufErrors')
+        return receive_drops, counter_Delta(self.counters, counters, 'SndbufErrors'), counter_Delta(self.counters, counters, 'InErrors')
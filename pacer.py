@@ -0,0 +1,136 @@
+#!/usr/bin/python3
+
+import bisect
+import time
+
+# Sleeps are only trusted to wake up this many seconds before a deadline. The remainder is spun.
+SPIN_THRESHOLD = 0.0002
+# The largest number of overdue packets that may be coalesced into a single burst
+MAX_BURST = 32
+
+# Schedules packet transmissions against absolute monotonic deadlines (packet i is due at start + i * interval).
+# Because each deadline is computed from the start of the round rather than from the previous send, syscall
+# and sleep overshoot do not accumulate, and any packets that fall behind schedule are released together
+# as a burst (token-bucket style) so the achieved rate converges on the target rate.
+# Param: packet_count: The number of packets to be released over the round
+# Param: duration: The length of the round in seconds
+# Param: max_burst: The maximum number of packets released by a single call to wait()
+# Param: spin_threshold: The number of seconds before a deadline at which sleeping gives way to spinning
+# Param: profile: An optional Hot_Path_Profile that receives the time spent sleeping and spinning, the sleeps'
+#                 overshoot and the sender's lag behind its deadlines
+class Pacer:
+
+    def __init__(self, packet_count, duration=1.0, max_burst=MAX_BURST, spin_threshold=SPIN_THRESHOLD, profile=None):
+        self.packet_count = packet_count
+        self.duration = duration
+        self.interval = duration / packet_count if packet_count > 0 else 0
+        self.max_burst = max(1, max_burst)
+        self.spin_threshold = spin_threshold
+        self.profile = profile
+        self.released = 0
+        self.start = None
+        self.finish = None
+
+    # Marks the beginning of the round. Called implicitly by the first wait() if omitted
+    # Param: start: An optional perf_counter() time in the near future at which the first packet is due.
+    #        perf_counter is system-wide, so parallel sender processes can share one start time
+    def begin(self, start=None):
+        self.start = start if start is not None else time.perf_counter()
+        self.finish = None
+        self.released = 0
+
+    # Blocks until the next packet is due and returns the number of packets that may be sent now (0 once the round is exhausted)
+    def wait(self):
+        if self.start is None:
+            self.begin()
+
+        remaining = self.packet_count - self.released
+        if remaining <= 0:
+            return 0
+
+        deadline = self._deadline()
+        now = time.perf_counter()
+        if now < deadline:
+            entered = now
+            # Coarse sleep for the bulk of the gap, then spin out the tail to avoid the scheduler's wakeup latency
+            if deadline - now > self.spin_threshold:
+                time.sleep(deadline - now - self.spin_threshold)
+            now = time.perf_counter()
+            woke = now
+            while now < deadline:
+                now = time.perf_counter()
+            if self.profile is not None:
+                self._profile_Wait(entered, woke, now, deadline)
+        elif self.profile is not None:
+            # The loop reached this deadline late, i.e. sending or scheduling could not keep up
+            self.profile.delay('sender;lag', int((now - deadline) * 1000000000))
+
+        # Release every packet whose deadline has already passed in one burst
+        burst = max(1, min(self._due(now, remaining), self.max_burst, remaining))
+        self.released = self.released + burst
+        return burst
+
+    # Splits one wait into the time slept, the sleep's overshoot past its intended wake-up and the time spun
+    def _profile_Wait(self, entered, woke, now, deadline):
+        planned = deadline - self.spin_threshold
+        if planned > entered:
+            overshoot = max(0, woke - planned)
+            self.profile.add('sender;pacer;sleep', int((woke - entered - overshoot) * 1000000000))
+            self.profile.add('sender;pacer;sleep;overshoot', int(overshoot * 1000000000))
+            self.profile.add('sender;pacer;spin', int((now - woke) * 1000000000))
+        else:
+            # The gap was too short to sleep through, so it was all spun
+            self.profile.add('sender;pacer;spin', int((now - entered) * 1000000000))
+
+    # Returns the deadline of the next packet
+    def _deadline(self):
+        return self.start + self.released * self.interval
+
+    # Returns the number of packets due by now
+    def _due(self, now, remaining):
+        return int((now - self.start) / self.interval) + 1 - self.released if self.interval > 0 else remaining
+
+    # Marks the end of the round once the final packet has been handed to the socket
+    def end(self):
+        self.finish = time.perf_counter()
+
+    # Returns the number of seconds the round actually spanned, including the final packet's slot
+    def elapsed(self):
+        if self.start is None:
+            return 0
+        finish = self.finish if self.finish is not None else time.perf_counter()
+        return finish - self.start + self.interval
+
+    # Returns the achieved packet rate in packets per second
+    def achieved_PPS(self):
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0
+        return self.released / elapsed
+
+    # Returns the achieved data rate in bits per second for packets of packet_size bytes
+    def achieved_Rate(self, packet_size):
+        elapsed = self.elapsed()
+        if elapsed <= 0:
+            return 0
+        return self.released * packet_size * 8 / elapsed
+
+# Releases packets against a precomputed send schedule instead of a constant interval, so the hot loop just
+# follows timestamps. Packets that share a send time (a microburst) are released together, up to max_burst
+# per call to wait(), and later calls release the rest of the burst without waiting.
+# Param: schedule: The send time of every packet in seconds from the start of the round, in ascending order
+# Param: duration: The length of the round in seconds
+# Param: max_burst: The maximum number of packets released by a single call to wait()
+# Param: spin_threshold: The number of seconds before a deadline at which sleeping gives way to spinning
+# Param: profile: An optional Hot_Path_Profile (see Pacer)
+class Schedule_Pacer(Pacer):
+
+    def __init__(self, schedule, duration=1.0, max_burst=MAX_BURST, spin_threshold=SPIN_THRESHOLD, profile=None):
+        super().__init__(len(schedule), duration, max_burst, spin_threshold, profile)
+        self.schedule = schedule
+
+    def _deadline(self):
+        return self.start + self.schedule[self.released]
+
+    def _due(self, now, remaining):
+        return bisect.bisect_right(self.schedule, now - self.start, self.released) - self.released
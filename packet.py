@@ -0,0 +1,170 @@
+#!/usr/bin/python3
+
+import math
+import struct
+import time
+import zlib
+
+# Every test datagram begins with this header: session id, round, sequence number, send timestamp (monotonic ns)
+HEADER = struct.Struct('!IIIQ')
+# ...followed by a CRC-32 of the datagram (see packet_Checksum), or 0 if the sender is not checksumming
+CHECKSUM = struct.Struct('!I')
+CHECKSUM_OFFSET = HEADER.size
+HEADER_SIZE = HEADER.size + CHECKSUM.size
+# Path MTU probes are sent as round 0, which no test round uses
+PROBE_ROUND = 0
+
+# Builds the datagrams for a single round in one reusable buffer. The fill pattern is written once and
+# only the header is restamped per packet, so generating a packet costs a single pack_into.
+# Param: session_id: The session id assigned by the server at synchronization
+# Param: round_number: The current round
+# Param: payload_byte: The byte value repeated through the remainder of the datagram
+# Param: size: The total datagram size in bytes
+# Param: first_sequence: The sequence number of the first packet (non-zero for all but the first parallel stream)
+# Param: checksum: Whether to stamp every packet's CRC. The payload never changes, so its CRC is computed
+#                  once and each packet only costs a CRC over the header fields
+class Packet_Writer:
+
+    def __init__(self, session_id, round_number, payload_byte, size=9216, first_sequence=0, checksum=False):
+        self.session_id = session_id
+        self.round_number = round_number
+        self.buffer = bytearray([payload_byte] * size)
+        CHECKSUM.pack_into(self.buffer, CHECKSUM_OFFSET, 0)
+        self.sequence = first_sequence
+        self.fields = memoryview(self.buffer)[:CHECKSUM_OFFSET]
+        self.payload_crc = zlib.crc32(self.buffer[HEADER_SIZE:]) if checksum else None
+
+    # Stamps the next sequence number and send time into the buffer and returns it
+    def next(self):
+        HEADER.pack_into(self.buffer, 0, self.session_id, self.round_number, self.sequence, time.monotonic_ns())
+        if self.payload_crc is not None:
+            CHECKSUM.pack_into(self.buffer, CHECKSUM_OFFSET, zlib.crc32(self.fields, self.payload_crc))
+        self.sequence = self.sequence + 1
+        return self.buffer
+
+# Returns the CRC-32 of a datagram: over the payload after the header, continued over the header fields
+# before the checksum. Covering the payload first lets a sender reuse the CRC of an unchanging payload
+def packet_Checksum(packet):
+    return zlib.crc32(packet[:CHECKSUM_OFFSET], zlib.crc32(packet[HEADER_SIZE:]))
+
+# Returns True if a datagram carries the CRC of its contents
+def verify_Checksum(packet):
+    if len(packet) < HEADER_SIZE:
+        return False
+    return CHECKSUM.unpack_from(packet, CHECKSUM_OFFSET)[0] == packet_Checksum(packet)
+
+# Parallel streams split a round's sequence space into contiguous blocks of this many numbers, stream k starting at k * stride
+def stream_Stride(packet_count, streams):
+    return max(1, math.ceil(packet_count / streams))
+
+# Returns the fill expected after the header of every datagram of the given size
+def expected_Fill(payload_byte, size=9216):
+    return bytearray([payload_byte] * (size - HEADER_SIZE))
+
+# Receiver-side sequence accounting for a single round. Arrivals are marked in a fixed-size array indexed by
+# sequence number, so each packet costs O(1) work and memory is bounded by the round's packet count.
+# Param: session_id: The session id packets must carry to be counted
+# Param: round_number: The round packets must carry to be counted (late packets from earlier rounds are stray)
+# Param: packet_count: The number of packets the sender will emit this round
+# Param: streams: The number of parallel streams the round's sequence space is split across (see stream_Stride).
+#                 Reordering is measured within each stream, since streams interleave freely on the wire
+# Param: seen: An optional writable buffer of packet_count zero bytes to mark arrivals in, so several
+#              trackers (one per receive shard) can share one arrival array
+class Sequence_Tracker:
+
+    def __init__(self, session_id, round_number, packet_count, streams=1, seen=None):
+        self.session_id = session_id
+        self.round_number = round_number
+        self.seen = seen if seen is not None else bytearray(packet_count)
+        self.unique = 0
+        self.duplicates = 0
+        self.stray = 0
+        self.out_of_order = 0
+        self.reorder_total = 0
+        self.reorder_max = 0
+        self.streams = streams
+        self.stride = stream_Stride(packet_count, streams)
+        # The highest sequence number seen in each stream starts just below the stream's block
+        self.highest = [stream * self.stride - 1 for stream in range(streams)]
+        # The running count of sequence numbers up to the highest seen in each stream, for missing()
+        self.reached = 0
+        self.sent = 0
+
+    # Records an arriving datagram. Returns True for the first copy of an in-round sequence number
+    def record(self, packet):
+        if len(packet) < HEADER_SIZE:
+            self.stray = self.stray + 1
+            return False
+        session_id, round_number, sequence, sent = HEADER.unpack_from(packet)
+        self.sent = sent
+        if session_id != self.session_id or round_number != self.round_number or sequence >= len(self.seen):
+            self.stray = self.stray + 1
+            return False
+        if self.seen[sequence]:
+            self.duplicates = self.duplicates + 1
+            return False
+        self.seen[sequence] = 1
+        self.unique = self.unique + 1
+        # Reorder distance is how far behind the highest sequence number seen so far in its stream this packet arrived
+        stream = sequence // self.stride if self.streams > 1 else 0
+        highest = self.highest[stream]
+        if sequence < highest:
+            distance = highest - sequence
+            self.out_of_order = self.out_of_order + 1
+            self.reorder_total = self.reorder_total + distance
+            if distance > self.reorder_max:
+                self.reorder_max = distance
+        else:
+            self.reached = self.reached + sequence - highest
+            self.highest[stream] = sequence
+        return True
+
+    # Returns the counts merge() accepts, for handing this tracker's totals to another process
+    def counters(self):
+        return self.unique, self.duplicates, self.stray, self.out_of_order, self.reorder_total, self.reorder_max
+
+    # Adds the counts of another tracker sharing this tracker's arrival array
+    def merge(self, unique, duplicates, stray, out_of_order, reorder_total, reorder_max):
+        self.unique = self.unique + unique
+        self.duplicates = self.duplicates + duplicates
+        self.stray = self.stray + stray
+        self.out_of_order = self.out_of_order + out_of_order
+        self.reorder_total = self.reorder_total + reorder_total
+        self.reorder_max = max(self.reorder_max, reorder_max)
+
+    # Returns how many sequence numbers are missing below the highest one seen in each stream so far. It is kept
+    # from running counters rather than a scan of the arrival array, so it is cheap to call mid-round. It counts
+    # this tracker's own arrivals only; trackers sharing the arrival array each report their own streams
+    def missing(self):
+        return max(0, self.reached - self.unique)
+
+    # Releases a shared arrival array so its owner can free it
+    def release(self):
+        if isinstance(self.seen, memoryview):
+            self.seen.release()
+
+    # Returns the round's sequence statistics. Gaps (runs of consecutive missing packets) are found with a single bytes split
+    def summary(self):
+        gaps = [len(run) for run in bytes(self.seen).split(b'\x01') if run]
+        return {
+            'lost': len(self.seen) - self.unique,
+            'duplicates': self.duplicates,
+            'stray': self.stray,
+            'out_of_order': self.out_of_order,
+            'reorder_mean': self.reorder_total / self.out_of_order if self.out_of_order > 0 else 0,
+            'reorder_max': self.reorder_max,
+            'gaps': len(gaps),
+            'gap_max': max(gaps) if gaps else 0
+        }
+
+    # Returns the number of packets and the number lost for each parallel stream
+    def stream_Summary(self):
+        streams = []
+        for stream in range(self.streams):
+            block = bytes(self.seen[stream * self.stride:(stream + 1) * self.stride])
+            streams.append({
+                'stream': stream + 1,
+                'packets': len(block),
+                'lost': len(block) - block.count(1)
+            })
+        return streams
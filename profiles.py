@@ -0,0 +1,137 @@
+#!/usr/bin/python3
+
+import json
+import math
+import random
+from array import array
+
+# Every profile splits its packets into this many phases, which results are broken down by
+PHASES = 4
+# The supported profiles and their parameters
+PROFILES = {
+    'constant': [],
+    'onoff': ['on', 'off'],
+    'poisson': [],
+    'microburst': ['burst'],
+    'ramp': ['start', 'end']
+}
+# Poisson gaps are classed by the quartiles of the exponential distribution, as multiples of the mean gap
+GAP_QUARTILES = (math.log(4 / 3), math.log(2), math.log(4))
+
+# Reads a traffic profile from a JSON file, e.g. {"type": "microburst", "burst": 64}. Raises ValueError if it cannot be parsed
+def load_Profile(path):
+    try:
+        with open(path) as profile_file:
+            profile = json.load(profile_file)
+    except OSError as error:
+        raise ValueError(f"Cannot read the profile: {error}")
+    except json.JSONDecodeError as error:
+        raise ValueError(f"The profile is not valid JSON: {error}")
+    if not isinstance(profile, dict):
+        raise ValueError("The profile must be a JSON object")
+    return profile
+
+# Returns an error string if a traffic profile is malformed, else None
+def check_Profile(profile):
+    kind = profile.get('type')
+    if kind not in PROFILES:
+        return f"Profile type must be one of {', '.join(PROFILES)}"
+    for name in PROFILES[kind]:
+        if not isinstance(profile.get(name), (int, float)):
+            return f"A {kind} profile needs a numeric '{name}'"
+    if kind == 'onoff' and (profile['on'] <= 0 or profile['off'] < 0):
+        return "On/off periods must be on > 0 and off >= 0 seconds"
+    if kind == 'microburst' and profile['burst'] < 1:
+        return "Microbursts must be at least 1 packet"
+    if kind == 'ramp' and (profile['start'] < 0 or profile['end'] < 0 or profile['start'] + profile['end'] <= 0):
+        return "Ramp start and end must be non-negative relative rates, not both 0"
+    return None
+
+# Returns the names of a profile's phases
+def phase_Names(profile):
+    kind = profile['type']
+    quarters = ["1st quarter", "2nd quarter", "3rd quarter", "4th quarter"]
+    if kind == 'microburst':
+        return [f"Burst {quarter}" for quarter in quarters]
+    if kind == 'onoff':
+        return [f"On period {quarter}" for quarter in quarters]
+    if kind == 'poisson':
+        return ["Gap < 0.29x mean", "Gap < 0.69x mean", "Gap < 1.39x mean", "Gap >= 1.39x mean"]
+    return [f"Round {quarter}" for quarter in quarters]
+
+# Compiles a profile into the round's send schedule: the send time of every packet in seconds from the start
+# of the round, and its phase. Each profile sends packet_count packets over duration seconds, so its average
+# rate is the round's rate; only the shape changes. Poisson arrivals are drawn from a generator seeded with
+# seed, so the server can compile the identical schedule to break results down by phase.
+# Returns (array('d') of send times, bytearray of phases)
+# Param: profile: The traffic profile
+# Param: packet_count: The number of packets in the round
+# Param: duration: The length of the round in seconds
+# Param: seed: The seed of any random arrivals (any string or number)
+def compile_Schedule(profile, packet_count, duration, seed=0):
+    kind = profile['type']
+    interval = duration / packet_count if packet_count > 0 else 0
+    indices = range(packet_count)
+
+    if kind == 'microburst':
+        # Bursts of back-to-back packets, spaced so the bursts average the round's rate
+        burst = int(profile['burst'])
+        period = burst * interval
+        times = [(i // burst) * period for i in indices]
+        phases = [(i % burst) * PHASES // burst for i in indices]
+    elif kind == 'onoff':
+        # Packets are paced at a higher rate during the on periods so the round still averages its rate
+        on = profile['on']
+        cycle = on + profile['off']
+        spacing = interval * on / cycle
+        per_period = max(1, int(on / spacing)) if spacing > 0 else packet_count
+        times = [(i // per_period) * cycle + (i % per_period) * spacing for i in indices]
+        phases = [(i % per_period) * PHASES // per_period for i in indices]
+    elif kind == 'poisson':
+        # Exponential gaps, scaled so the round still spans its duration. Each packet is sent one gap after the
+        # packet before it (the first, one gap after the round starts), and its phase classes that gap
+        rng = random.Random(f"{seed}:poisson")
+        gaps = [rng.expovariate(1.0) for i in indices]
+        scale = duration / sum(gaps) if packet_count > 0 else 0
+        times = []
+        phases = []
+        elapsed = 0.0
+        for gap in gaps:
+            elapsed = elapsed + gap * scale
+            times.append(elapsed)
+            phases.append(sum(1 for quartile in GAP_QUARTILES if gap >= quartile))
+    elif kind == 'ramp':
+        # The rate changes linearly from start to end (relative to each other). Send times invert the
+        # cumulative packet count a*t + b*t^2/2
+        rate = packet_count / duration * 2 / (profile['start'] + profile['end'])
+        a = rate * profile['start']
+        b = rate * (profile['end'] - profile['start']) / duration
+        if b == 0:
+            times = [i / a for i in indices]
+        else:
+            times = [(math.sqrt(a * a + 2 * b * i) - a) / b for i in indices]
+        phases = [min(PHASES - 1, int(time * PHASES / duration)) for time in times]
+    else:
+        times = [i * interval for i in indices]
+        phases = [i * PHASES // packet_count for i in indices]
+
+    return array('d', times), bytearray(phases)
+
+# Breaks a round's loss down by phase. Phases and arrivals are packed into one byte per packet (phase * 2 +
+# arrived) with a single big integer shift, so counting each combination is a C-level bytes.count
+# Param: phases: The phase of every sequence number
+# Param: seen: The round's arrival array (one 0/1 byte per sequence number)
+# Param: names: The phase names
+def phase_Summary(phases, seen, names):
+    count = len(phases)
+    combined = ((int.from_bytes(phases, 'little') << 1) | int.from_bytes(bytes(seen), 'little')).to_bytes(count + 1, 'little')[:count]
+    summary = []
+    for phase, name in enumerate(names):
+        lost = combined.count(phase * 2)
+        packets = lost + combined.count(phase * 2 + 1)
+        summary.append({
+            'phase': name,
+            'packets': packets,
+            'lost': lost / packets * 100 if packets > 0 else 0
+        })
+    return summary
@@ -0,0 +1,125 @@
+#!/usr/bin/python3
+
+import json
+import socket
+from packet import HEADER_SIZE
+
+# Bumped whenever the control messages or the test packet header change incompatibly
+PROTOCOL_VERSION = 2
+# The number of bytes requested from the control socket per recv
+READ_SIZE = 65536
+
+# Control messages are JSON objects, one per line
+def encode_Message(message):
+    return json.dumps(message).encode('utf-8') + b'\n'
+
+def decode_Message(line):
+    return json.loads(line.decode('utf-8'))
+
+# Returns an error string if a synchronize or synchronize-ack message speaks a different protocol version, else None
+def check_Version(message):
+    version = message.get('version')
+    if version != PROTOCOL_VERSION:
+        return f"Protocol version mismatch (local {PROTOCOL_VERSION}, remote {version})"
+    return None
+
+# The fields every test round's configuration must carry
+ROUND_FIELDS = ('round', 'rate', 'packet_count')
+# Packet counts may exceed what the rate and duration allow by this many, for the client's rounding
+PACKET_SLACK = 1
+
+def _is_Number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+def _is_Integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+# Returns the most packets a round at rate (mbps) can send in duration seconds. The server allocates arrival
+# state per packet, so a count beyond this could only exhaust its memory
+def _max_Packets(rate, duration):
+    return int(rate * 1000000 * duration / 8 / HEADER_SIZE) + PACKET_SLACK
+
+# Returns an error string if a test round's configuration is missing a field, or holds one of the wrong type
+# or outside its range, else None. The settings checked elsewhere (packet size, impairment, profile) only have
+# their types checked here
+def check_Round(round_config):
+    for name in ROUND_FIELDS:
+        if name not in round_config:
+            return f"Round configuration is missing '{name}'"
+    if not _is_Integer(round_config['round']) or round_config['round'] < 1:
+        return "Round must be a positive integer"
+    if not _is_Number(round_config['rate']) or round_config['rate'] < 0:
+        return "Rate must be a non-negative number"
+    if not _is_Integer(round_config['packet_count']) or round_config['packet_count'] < 0:
+        return "Packet count must be a non-negative integer"
+    # TCP bulk rounds stream a payload file of their own rather than a fill byte
+    if round_config.get('transport') != 'tcp':
+        expected = round_config.get('expected_payload')
+        if not _is_Integer(expected) or not 0 <= expected <= 255:
+            return "Expected payload must be a byte value"
+    if not _is_Integer(round_config.get('packet_size', 0)):
+        return "Packet size must be an integer"
+    if not _is_Number(round_config.get('duration', 1)) or round_config.get('duration', 1) <= 0:
+        return "Duration must be a positive number"
+    if round_config['packet_count'] > _max_Packets(round_config['rate'], round_config.get('duration', 1)):
+        return "Packet count exceeds what the round's rate and duration can send"
+    if not _is_Integer(round_config.get('streams', 1)) or round_config.get('streams', 1) < 1:
+        return "Streams must be a positive integer"
+    if not _is_Number(round_config.get('telemetry', 0)) or round_config.get('telemetry', 0) < 0:
+        return "Telemetry interval must be a non-negative number"
+    for name in ('impairment', 'profile', 'downstream'):
+        if not isinstance(round_config.get(name) or {}, dict):
+            return f"Round setting '{name}' must be an object"
+    downstream = round_config.get('downstream')
+    if downstream is not None and (not _is_Number(downstream.get('rate')) or downstream['rate'] < 0 or not _is_Integer(downstream.get('port', 0))):
+        return "Full duplex settings need a non-negative rate and an integer port"
+    if downstream is not None and (not _is_Integer(downstream.get('packet_count')) or not 0 <= downstream['packet_count'] <= _max_Packets(downstream['rate'], round_config.get('duration', 1))):
+        return "Full duplex packet count must be a non-negative integer the downstream rate and duration can send"
+    if downstream is not None and (not _is_Integer(downstream.get('expected_payload')) or not 0 <= downstream['expected_payload'] <= 255):
+        return "Full duplex expected payload must be a byte value"
+    return None
+
+# A buffered, newline-framed message reader/writer over a blocking TCP socket. Incoming bytes are read in
+# large chunks and split into messages, so a control message costs one recv instead of one per byte.
+# Param: tcp_socket: The connected control socket
+class Message_Stream:
+
+    def __init__(self, tcp_socket):
+        self.tcp_socket = tcp_socket
+        self.buffer = bytearray()
+        # Control messages are small and latency bound, so never let Nagle hold them back
+        try:
+            tcp_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        except OSError:
+            pass
+
+    def send(self, message):
+        self.tcp_socket.sendall(encode_Message(message))
+
+    # Returns the next message, or None if the peer closed the connection
+    def read(self):
+        while True:
+            end = self.buffer.find(b'\n')
+            if end >= 0:
+                line = bytes(self.buffer[:end])
+                del self.buffer[:end + 1]
+                return decode_Message(line)
+            chunk = self.tcp_socket.recv(READ_SIZE)
+            if not chunk:
+                return None
+            self.buffer += chunk
+
+    def close(self):
+        self.tcp_socket.close()
+
+# Sends a message over an asyncio control stream
+async def send_Message(writer, message):
+    writer.write(encode_Message(message))
+    await writer.drain()
+
+# Awaits the next message from an asyncio control stream. Returns None if the peer disconnected
+async def read_Message(reader):
+    line = await reader.readline()
+    if not line.endswith(b'\n'):
+        return None
+    return decode_Message(line)
@@ -0,0 +1,193 @@
+#!/usr/bin/python3
+
+import multiprocessing
+import socket
+from multiprocessing import resource_tracker, shared_memory
+from packet import Sequence_Tracker
+from udp_io import size_Receive_Buffer, size_Send_Buffer
+from integrity import Corruption_Analyzer
+from impairment import impairment_Plan
+from hotpath import Hot_Path_Profile
+
+# Per-worker counters written to the shared counter block at the end of every round:
+# packets_received, packets_mangled, Sequence_Tracker.missing(), followed by Sequence_Tracker.counters()
+FIELDS = 9
+
+# Whether this platform can bind several sockets to one UDP port
+SUPPORTED = hasattr(socket, 'SO_REUSEPORT')
+
+# Makes a multiprocessing connection usable as a receive loop stop signal: it is set once the parent has
+# sent the stop message, and its file descriptor can be watched by Recv_Ring's selector
+class Pipe_Signal:
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __call__(self):
+        return self.conn.poll()
+
+    def fileno(self):
+        return self.conn.fileno()
+
+# The statistics list a shard's receive loop keeps current. Its live counts, and its tracker's missing count
+# alongside the received count, are mirrored into the shard's row of the counter block, so the control handler
+# can read them mid-round
+class Shared_Statistics(list):
+
+    def __init__(self, counters, offset, tracker):
+        super().__init__([0, 0, tracker])
+        self.counters = counters
+        self.offset = offset
+
+    def __setitem__(self, index, value):
+        super().__setitem__(index, value)
+        self.counters[self.offset + index] = value
+        if index == 0:
+            self.counters[self.offset + 2] = self[2].missing()
+
+# Attaches to a shared memory block created by the parent without registering it with this process's
+# resource tracker, which would otherwise unlink or warn about a block the parent owns
+def attach_Shared(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+# Runs in each receive worker process. Binds its own socket to the session's UDP port and, for every round,
+# runs the server's receive loop against a tracker whose arrival array is the round's shared bitmap
+# Param: index: The worker's row in the counter block
+# Param: port: The session's UDP port
+# Param: conn: The worker's end of the pipe to the Receiver_Shards
+# Param: counters: The shared counter block
+# Param: listener: The receive loop to run (UDP_Listener or UDP_Reply)
+# Param: duplex_listener: The receive loop to run in full duplex rounds, where nothing may be echoed
+def receive_Worker(index, port, conn, counters, listener, duplex_listener):
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    udp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    udp_socket.bind(('', port))
+    conn.send('bound')
+
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        session_id, round_config, streams, packet_size, name, profiling = command
+        round_number = round_config['round']
+        packet_count = round_config['packet_count']
+        expected_byte = round_config['expected_payload']
+        rate = round_config['rate'] * 1000000
+
+        # Any shard may receive (and in round trip mode echo) the whole round, so size for its full rate
+        size_Receive_Buffer(udp_socket, rate)
+        size_Send_Buffer(udp_socket, rate)
+
+        shm = attach_Shared(name)
+        tracker = Sequence_Tracker(session_id, round_number, packet_count, streams, shm.buf[:packet_count])
+        statistics = Shared_Statistics(counters, index * FIELDS, tracker)
+        analyzer = Corruption_Analyzer(expected_byte, packet_size) if round_config.get('integrity', False) else None
+        # Every shard rebuilds the same plan from the round's seed, so impairments follow the sequence number wherever it lands
+        impairment = impairment_Plan(round_config, session_id)
+        # The client is receiving the server's own traffic in full duplex rounds, so echoes would corrupt it
+        receive = duplex_listener if round_config.get('downstream') is not None else listener
+        # Each shard times its own receive loop when the server is profiling
+        profile = Hot_Path_Profile() if profiling else None
+        receive(udp_socket, expected_byte, packet_size, tracker, statistics, impairment, Pipe_Signal(conn), analyzer, profile)
+
+        # Consume the stop message, publish this shard's counts and let go of the bitmap. The integrity
+        # counts and the profile are variable length, so they travel back over the pipe instead of the counter block
+        conn.recv()
+        counters[index * FIELDS:(index + 1) * FIELDS] = [statistics[0], statistics[1], tracker.missing()] + list(tracker.counters())
+        tracker.release()
+        shm.close()
+        conn.send((analyzer.counters() if analyzer is not None else None, profile.counters() if profile is not None else None))
+
+    udp_socket.close()
+    conn.close()
+
+# Extra receive worker processes for a session. Each binds its own socket to the session's UDP port with
+# SO_REUSEPORT, so the kernel spreads incoming flows across them (by address/port hash, so a single client
+# stream lands on one socket; use parallel streams to spread load). Every shard marks arrivals in one shared
+# bitmap per round and leaves its counts in a shared counter block, which the control handler merges into
+# its own tracker and counts when the round ends.
+# Param: port: The session's UDP port (already bound with SO_REUSEPORT by the session's own socket)
+# Param: workers: The number of extra worker processes
+# Param: listener: The receive loop each worker runs (UDP_Listener or UDP_Reply)
+# Param: duplex_listener: The receive loop each worker runs in full duplex rounds (UDP_Listener). Defaults to listener
+class Receiver_Shards:
+
+    def __init__(self, port, workers, listener, duplex_listener=None):
+        self.counters = multiprocessing.RawArray('q', workers * FIELDS)
+        self.pipes = []
+        self.processes = []
+        self.shm = None
+        self.reports = []
+        for index in range(workers):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=receive_Worker, args=(index, port, child, self.counters, listener, duplex_listener or listener,), daemon=True)
+            process.start()
+            self.pipes.append(parent)
+            self.processes.append(process)
+        # Every shard must be bound before the client is told the port, or early packets would miss it
+        for conn in self.pipes:
+            conn.recv()
+
+    # Creates the round's shared arrival bitmap, starts every shard on it and returns a tracker for the caller's own socket
+    # Param: profiling: Whether every shard times its receive loop for the round's hot path profile
+    def start_Round(self, session_id, round_config, streams, packet_size, profiling=False):
+        packet_count = round_config['packet_count']
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, packet_count))
+        self.shm.buf[:packet_count] = bytes(packet_count)
+        # Clear the last round's counts so live reads start from zero
+        self.counters[:] = [0] * len(self.counters)
+        for conn in self.pipes:
+            conn.send((session_id, round_config, streams, packet_size, self.shm.name, profiling))
+        return Sequence_Tracker(session_id, round_config['round'], packet_count, streams, self.shm.buf[:packet_count])
+
+    # Returns the packets received, mangled and missing so far this round by every shard together
+    def live_Counts(self):
+        received = 0
+        mangled = 0
+        missing = 0
+        for index in range(len(self.pipes)):
+            received = received + self.counters[index * FIELDS]
+            mangled = mangled + self.counters[index * FIELDS + 1]
+            missing = missing + self.counters[index * FIELDS + 2]
+        return received, mangled, missing
+
+    # Stops every shard and waits for their counts. Blocks, so the control handler runs it in a thread
+    def stop_Round(self):
+        for conn in self.pipes:
+            conn.send('stop')
+        self.reports = [conn.recv() for conn in self.pipes]
+
+    # Adds every shard's counts into statistics ([packets_received, packets_mangled, tracker]) and the caller's tracker,
+    # in integrity mode every shard's corruption analysis into the caller's analyzer, and when profiling every
+    # shard's receive loop timings into the caller's Hot_Path_Profile
+    def merge(self, statistics, analyzer=None, profile=None):
+        for analysis, counters in self.reports:
+            if analyzer is not None:
+                analyzer.merge(*analysis)
+            if profile is not None:
+                profile.merge(counters)
+        tracker = statistics[2]
+        for index in range(len(self.pipes)):
+            row = self.counters[index * FIELDS:(index + 1) * FIELDS]
+            statistics[0] = statistics[0] + row[0]
+            statistics[1] = statistics[1] + row[1]
+            tracker.merge(*row[3:])
+
+    # Frees the round's shared bitmap once the caller's tracker is done with it
+    def end_Round(self, tracker):
+        tracker.release()
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def close(self):
+        for conn in self.pipes:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
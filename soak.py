@@ -0,0 +1,148 @@
+#!/usr/bin/python3
+
+import collections
+import json
+import os
+import time
+from histogram import Log_Histogram
+
+# The weight of the newest round in each exponentially weighted moving average
+EWMA_ALPHA = 0.1
+# The number of most recent rounds covered by the windowed minimum and maximum
+WINDOW = 60
+# Seconds between checkpoints of the summary to disk
+CHECKPOINT_INTERVAL = 60
+# Significant bits kept by the quantile histograms (about 0.2% relative error)
+PRECISION_BITS = 10
+
+# The minimum and maximum of the last window samples, kept in monotonic deques so each sample costs
+# amortized O(1) and memory is bounded by the window rather than the run
+# Param: window: The number of most recent samples covered
+class Windowed_Extremes:
+
+    def __init__(self, window=WINDOW):
+        self.window = window
+        self.count = 0
+        self.minima = collections.deque()
+        self.maxima = collections.deque()
+
+    def record(self, value):
+        index = self.count
+        self.count = self.count + 1
+        # A sample can never be the extreme again once a newer sample at least as extreme arrives
+        while self.minima and self.minima[-1][1] >= value:
+            self.minima.pop()
+        self.minima.append((index, value))
+        while self.maxima and self.maxima[-1][1] <= value:
+            self.maxima.pop()
+        self.maxima.append((index, value))
+        if self.minima[0][0] <= index - self.window:
+            self.minima.popleft()
+        if self.maxima[0][0] <= index - self.window:
+            self.maxima.popleft()
+
+    def minimum(self):
+        return self.minima[0][1] if self.minima else 0
+
+    def maximum(self):
+        return self.maxima[0][1] if self.maxima else 0
+
+# The rolling aggregates of one per-round measurement: an EWMA, the windowed minimum and maximum, and
+# quantiles over the whole run from a log-bucketed histogram, all in constant memory
+# Param: scale: Samples are recorded into the histogram as integers of value * scale, fixing their resolution
+class Soak_Metric:
+
+    def __init__(self, scale, window=WINDOW, alpha=EWMA_ALPHA):
+        self.scale = scale
+        self.alpha = alpha
+        self.ewma = None
+        self.extremes = Windowed_Extremes(window)
+        self.histogram = Log_Histogram(PRECISION_BITS)
+
+    def record(self, value):
+        self.ewma = value if self.ewma is None else self.ewma + self.alpha * (value - self.ewma)
+        self.extremes.record(value)
+        self.histogram.record(int(value * self.scale))
+
+    def summary(self):
+        histogram = self.histogram
+        return {
+            'ewma': self.ewma if self.ewma is not None else 0,
+            'window_min': self.extremes.minimum(),
+            'window_max': self.extremes.maximum(),
+            'min': (histogram.min or 0) / self.scale,
+            'max': (histogram.max or 0) / self.scale,
+            'p50': histogram.percentile(50) / self.scale,
+            'p90': histogram.percentile(90) / self.scale,
+            'p99': histogram.percentile(99) / self.scale,
+            'p999': histogram.percentile(99.9) / self.scale
+        }
+
+# Folds the results of a long soak test into constant-size aggregates, round by round, and periodically
+# checkpoints them to disk so an interrupted run keeps everything up to its last checkpoint
+# Param: rate: The soak rate in bps
+# Param: packet_size: The size in bytes of every packet sent
+# Param: path: The file summaries are checkpointed to, or None
+# Param: rt: Whether round trip results are folded in too
+class Soak_Summary:
+
+    def __init__(self, rate, packet_size, path=None, rt=False):
+        self.rate = rate
+        self.packet_size = packet_size
+        self.path = path
+        self.metrics = {
+            'lost': Soak_Metric(1000),
+            'net_lost': Soak_Metric(1000),
+            'achieved': Soak_Metric(1000)
+        }
+        if rt:
+            self.metrics['rtt_p99'] = Soak_Metric(1000)
+            self.metrics['jitter'] = Soak_Metric(1000)
+        self.rounds = 0
+        self.failed_rounds = 0
+        self.packets = 0
+        self.packets_lost = 0
+        self.worst = None
+        self.start = time.time()
+        self.last_checkpoint = time.monotonic()
+
+    # Folds in one round's server result and, in round trip mode, the client's
+    def record(self, server_result, client_result=None):
+        self.rounds = self.rounds + 1
+        if server_result['rating'] == 'fail':
+            self.failed_rounds = self.failed_rounds + 1
+        self.packets = self.packets + server_result['packets']
+        self.packets_lost = self.packets_lost + round(server_result['packets'] * server_result['lost'] / 100)
+        if self.worst is None or server_result['lost'] > self.worst['lost']:
+            self.worst = {'round': server_result['round'], 'lost': server_result['lost'], 'time': time.time()}
+        for name, metric in self.metrics.items():
+            result = client_result if name in ('rtt_p99', 'jitter') else server_result
+            if result is not None and name in result:
+                metric.record(result[name])
+
+    def summary(self):
+        return {
+            'rate': self.rate / 1000000,
+            'size': self.packet_size,
+            'start': self.start,
+            'elapsed': time.time() - self.start,
+            'rounds': self.rounds,
+            'failed_rounds': self.failed_rounds,
+            'packets': self.packets,
+            'packets_lost': self.packets_lost,
+            'worst_round': self.worst,
+            'metrics': {name: metric.summary() for name, metric in self.metrics.items()}
+        }
+
+    # Writes the summary to disk if a checkpoint is due (or force is set). The file is replaced atomically,
+    # so an interruption mid-write leaves the previous checkpoint intact
+    def checkpoint(self, force=False):
+        if self.path is None or (not force and time.monotonic() - self.last_checkpoint < CHECKPOINT_INTERVAL):
+            return
+        temporary = self.path + '.tmp'
+        with open(temporary, 'w') as checkpoint:
+            json.dump(self.summary(), checkpoint, indent=2)
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+        os.replace(temporary, self.path)
+        self.last_checkpoint = time.monotonic()
@@ -0,0 +1,87 @@
+#!/usr/bin/python3
+
+import multiprocessing
+import socket
+import time
+from pacer import Pacer
+from packet import Packet_Writer, stream_Stride
+from udp_io import Batch_Sender, size_Send_Buffer
+from hotpath import Hot_Path_Profile
+
+# Seconds between dispatching a round to the workers and its first packet, so every stream starts together
+START_DELAY = 0.05
+
+# Runs in each sender process. Waits for round commands on conn, paces its share of the round from its own
+# socket and reports what it achieved. A None command shuts the worker down
+# Param: conn: The worker's end of the pipe to the Sender_Pool
+# Param: address: The (host, port) of the server's UDP socket
+def sender_Worker(conn, address):
+    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sender = Batch_Sender(udp_socket, address)
+
+    while True:
+        command = conn.recv()
+        if command is None:
+            break
+        session_id, current_round, payload_byte, packet_size, first_sequence, packet_count, duration, start, checksum, profiled = command
+
+        if duration > 0:
+            size_Send_Buffer(udp_socket, packet_count * packet_size * 8 / duration)
+        writer = Packet_Writer(session_id, current_round, payload_byte, packet_size, first_sequence, checksum)
+        profile = Hot_Path_Profile() if profiled else None
+        pacer = Pacer(packet_count, duration, profile=profile)
+        pacer.begin(start)
+        burst = pacer.wait()
+        while burst > 0:
+            started = time.perf_counter_ns() if profile is not None else 0
+            sender.send_Sequenced(writer, burst)
+            if profile is not None:
+                profile.add('sender;send', time.perf_counter_ns() - started)
+            burst = pacer.wait()
+        pacer.end()
+
+        report = {
+            'achieved_rate': pacer.achieved_Rate(packet_size) / 1000000,
+            'achieved_pps': pacer.achieved_PPS(),
+            'packets': packet_count
+        }
+        if profile is not None:
+            report['hot_path'] = profile.counters()
+        conn.send(report)
+
+    udp_socket.close()
+    conn.close()
+
+# A pool of sender processes, each with its own socket, that split every round between them. The processes
+# live for the whole session so a round only costs a pipe message per stream rather than a process start.
+# Param: streams: The number of sender processes
+# Param: address: The (host, port) of the server's UDP socket
+class Sender_Pool:
+
+    def __init__(self, streams, address):
+        self.pipes = []
+        self.processes = []
+        for stream in range(streams):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=sender_Worker, args=(child, address,), daemon=True)
+            process.start()
+            self.pipes.append(parent)
+            self.processes.append(process)
+
+    # Sends packet_count packets over duration seconds, split evenly across the streams, and returns each stream's report.
+    # checksum stamps every packet's CRC for integrity mode, and profiled adds each stream's hot path counters to its report
+    def run_Round(self, session_id, current_round, payload_byte, packet_size, packet_count, duration, checksum=False, profiled=False):
+        streams = len(self.pipes)
+        stride = stream_Stride(packet_count, streams)
+        start = time.perf_counter() + START_DELAY
+        for stream, conn in enumerate(self.pipes):
+            first_sequence = stream * stride
+            count = max(0, min(stride, packet_count - first_sequence))
+            conn.send((session_id, current_round, payload_byte, packet_size, first_sequence, count, duration, start, checksum, profiled))
+        return [conn.recv() for conn in self.pipes]
+
+    def close(self):
+        for conn in self.pipes:
+            conn.send(None)
+        for process in self.processes:
+            process.join()
@@ -0,0 +1,169 @@
+#!/usr/bin/python3
+
+import mmap
+import selectors
+import socket
+import struct
+import tempfile
+import time
+from pacer import Pacer
+
+# The size of the payload file bulk rounds stream from. Longer rounds wrap around it
+PAYLOAD_SIZE = 4 * 1024 * 1024
+# The size of the receiver's reusable buffer, and so the most a single recv_into can return
+RECV_SIZE = 1024 * 1024
+# Each round's throughput is sampled over this many intervals...
+INTERVALS = 10
+# ...of no less than this many seconds
+MIN_INTERVAL = 0.1
+# The number of seconds either end waits for the other to finish the stream once the round is over
+CLOSE_TIMEOUT = 10
+# The start of Linux's struct tcp_info: 8 single byte fields, then 32 bit fields up to tcpi_total_retrans
+TCP_INFO = struct.Struct('8B24I')
+TCP_INFO_SUPPORTED = hasattr(socket, 'TCP_INFO')
+
+# A payload file of a single repeated byte, filled through a memory map. Bulk rounds stream it with sendfile,
+# so the kernel copies it from the page cache straight to the socket and the sender never touches the bytes
+# Param: fill: The payload byte
+# Param: size: The size of the file in bytes
+class Payload_File:
+
+    def __init__(self, fill, size=PAYLOAD_SIZE):
+        self.file = tempfile.TemporaryFile()
+        self.file.truncate(size)
+        with mmap.mmap(self.file.fileno(), size) as payload:
+            payload.write(bytes([fill]) * size)
+        self.size = size
+
+    def close(self):
+        self.file.close()
+
+# Returns the number and length in seconds of the intervals a round of duration seconds is sampled over
+def bulk_Intervals(duration):
+    count = max(1, min(INTERVALS, int(duration / MIN_INTERVAL)))
+    return count, duration / count
+
+# Returns the sender side counters of a TCP connection from TCP_INFO: retransmitted segments over its lifetime
+# and the smoothed RTT in milliseconds. Returns None where TCP_INFO is not supported (it is Linux only)
+def tcp_Info(tcp_socket):
+    if not TCP_INFO_SUPPORTED:
+        return None
+    try:
+        raw = tcp_socket.getsockopt(socket.IPPROTO_TCP, socket.TCP_INFO, TCP_INFO.size)
+    except OSError:
+        return None
+    if len(raw) < TCP_INFO.size:
+        return None
+    fields = TCP_INFO.unpack_from(raw)
+    return {'retransmits': fields[8 + 23], 'rtt': fields[8 + 15] / 1000}
+
+# Streams byte_count bytes of the payload file over a connected TCP socket with sendfile, paced at the round's
+# rate: the bytes are split into chunks released by a Pacer, and each burst of due chunks is one sendfile call.
+# Once everything is sent the socket is shut down for writing, and the sender waits for the receiver to close
+# its end, so every byte has been delivered when TCP_INFO is read. Returns a report of the achieved rate in
+# mbps and the connection's retransmits and RTT (None without TCP_INFO)
+# Param: tcp_socket: The connected data socket
+# Param: payload: The Payload_File to stream from
+# Param: byte_count: The number of bytes to send
+# Param: chunk: The number of bytes released by each pacer slot
+# Param: duration: The length of the round in seconds
+def send_Bulk(tcp_socket, payload, byte_count, chunk, duration):
+    pacer = Pacer(-(-byte_count // chunk), duration)
+    sent = 0
+    offset = 0
+    pacer.begin()
+    burst = pacer.wait()
+    while burst > 0:
+        count = min(burst * chunk, byte_count - sent)
+        while count > 0:
+            # Wrap around the end of the payload file
+            length = min(count, payload.size - offset)
+            tcp_socket.sendfile(payload.file, offset, length)
+            offset = (offset + length) % payload.size
+            sent = sent + length
+            count = count - length
+        burst = pacer.wait()
+    pacer.end()
+    elapsed = pacer.elapsed()
+
+    # Wait for the receiver to see the end of the stream and close
+    tcp_socket.shutdown(socket.SHUT_WR)
+    tcp_socket.settimeout(CLOSE_TIMEOUT)
+    try:
+        while tcp_socket.recv(1):
+            pass
+    except OSError:
+        pass
+    info = tcp_Info(tcp_socket) or {}
+    return {
+        'achieved_rate': sent * 8 / elapsed / 1000000 if elapsed > 0 else 0,
+        'retransmits': info.get('retransmits'),
+        'rtt': info.get('rtt')
+    }
+
+# Accepts one connection from peer on listener and receives from it until the sender closes it or the round is
+# stopped, with recv_into a single reusable buffer. Connections from any other address are closed unread. Leaves the bytes received, the seconds from the connection to the
+# last byte, and the throughput in mbps of each interval in report. The last interval also counts anything
+# that arrived after it was due to end, so it is measured over its actual length
+# Param: listener: A listening TCP socket
+# Param: count: The number of intervals to sample throughput over (see bulk_Intervals)
+# Param: interval: The length of each interval in seconds
+# Param: signal: A Stop_Signal that abandons the round
+# Param: report: An empty dict that receives the counters
+# Param: peer: The address the sender connects from (the client's control connection address)
+def receive_Bulk(listener, count, interval, signal, report, peer):
+    buffer = bytearray(RECV_SIZE)
+    intervals = [0] * count
+    received = 0
+    start = None
+    last = None
+    connection = None
+    listener.setblocking(False)
+    selector = selectors.DefaultSelector()
+    selector.register(signal, selectors.EVENT_READ)
+    selector.register(listener, selectors.EVENT_READ)
+    try:
+        closed = False
+        while not closed and not signal():
+            selector.select()
+            if connection is None:
+                try:
+                    connection, address = listener.accept()
+                except BlockingIOError:
+                    continue
+                if address[0] != peer:
+                    connection.close()
+                    connection = None
+                    continue
+                connection.setblocking(False)
+                selector.unregister(listener)
+                selector.register(connection, selectors.EVENT_READ)
+                start = time.perf_counter()
+                continue
+
+            # Drain everything that has arrived, reading the clock once per recv rather than per byte
+            while True:
+                try:
+                    length = connection.recv_into(buffer)
+                except BlockingIOError:
+                    break
+                except OSError:
+                    closed = True
+                    break
+                if length == 0:
+                    closed = True
+                    break
+                last = time.perf_counter()
+                index = min(int((last - start) / interval), count - 1)
+                intervals[index] = intervals[index] + length
+                received = received + length
+    finally:
+        selector.close()
+        if connection is not None:
+            connection.close()
+
+    elapsed = last - start if last is not None else 0
+    spans = [interval] * (count - 1) + [max(interval, elapsed - interval * (count - 1))]
+    report['received'] = received
+    report['elapsed'] = elapsed
+    report['intervals'] = [total * 8 / span / 1000000 for total, span in zip(intervals, spans)]
@@ -0,0 +1,54 @@
+#!/usr/bin/python3
+
+import collections
+import json
+import threading
+
+# The number of telemetry samples buffered between the control channel and the output
+TELEMETRY_SLOTS = 1024
+
+# Writes telemetry samples as JSON Lines without ever stalling the thread that records them. Samples go into
+# a fixed-size ring that a background thread drains to the output, so memory stays bounded; if the output
+# falls a whole ring behind, the oldest samples are overwritten and the number lost is written in their place.
+# Param: output: A writable text stream (stdout or an open file)
+# Param: slots: The capacity of the ring in samples
+class Telemetry_Ring:
+
+    def __init__(self, output, slots=TELEMETRY_SLOTS):
+        self.output = output
+        self.samples = collections.deque(maxlen=slots)
+        self.overwritten = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._drain, daemon=True)
+        self.thread.start()
+
+    def record(self, sample):
+        with self.condition:
+            if len(self.samples) == self.samples.maxlen:
+                self.overwritten = self.overwritten + 1
+            self.samples.append(sample)
+            self.condition.notify()
+
+    # Writes out every remaining sample and stops the drain thread
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.thread.join()
+
+    def _drain(self):
+        while True:
+            with self.condition:
+                while not self.samples and not self.closed:
+                    self.condition.wait()
+                if not self.samples:
+                    return
+                batch = list(self.samples)
+                self.samples.clear()
+                overwritten = self.overwritten
+                self.overwritten = 0
+            if overwritten > 0:
+                batch.insert(0, {'status': 'telemetry_overrun', 'overwritten': overwritten})
+            self.output.write(''.join(json.dumps(sample) + '\n' for sample in batch))
+            self.output.flush()
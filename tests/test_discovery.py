@@ -0,0 +1,36 @@
+import json
+import time
+from discovery import Server_Cache
+
+
+def test_missing_or_corrupt_cache_is_empty(tmp_path):
+    assert Server_Cache(str(tmp_path / 'missing.json')).servers == []
+    corrupt = tmp_path / 'corrupt.json'
+    corrupt.write_text('{not json')
+    assert Server_Cache(str(corrupt)).servers == []
+
+def test_update_saves_and_reloads(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    servers = [{'address': '10.0.0.1', 'port': 62994, 'seen': time.time()}]
+    Server_Cache(path).update(servers)
+    assert Server_Cache(path).servers == servers
+    # Saving is atomic, so the temporary file is gone
+    assert not (tmp_path / 'cache.json.tmp').exists()
+
+def test_fresh_honours_the_ttl(tmp_path):
+    path = tmp_path / 'cache.json'
+    now = time.time()
+    path.write_text(json.dumps({'servers': [
+        {'address': '10.0.0.1', 'port': 1, 'seen': now - 10},
+        {'address': '10.0.0.2', 'port': 1, 'seen': now - 1000}
+    ]}))
+    assert [server['address'] for server in Server_Cache(str(path), ttl=300).fresh()] == ['10.0.0.1']
+    assert Server_Cache(str(path), ttl=0).fresh() == []
+
+def test_evict(tmp_path):
+    path = str(tmp_path / 'cache.json')
+    now = time.time()
+    cache = Server_Cache(path)
+    cache.update([{'address': '10.0.0.1', 'port': 1, 'seen': now}, {'address': '10.0.0.1', 'port': 2, 'seen': now}])
+    cache.evict('10.0.0.1', 1)
+    assert [server['port'] for server in Server_Cache(path).servers] == [2]
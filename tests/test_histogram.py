@@ -0,0 +1,60 @@
+import pytest
+from histogram import Jitter_Estimator, Log_Histogram
+
+
+def test_empty_histogram():
+    histogram = Log_Histogram()
+    assert histogram.percentile(50) == 0
+    assert histogram.mean() == 0
+
+def test_small_values_are_exact():
+    histogram = Log_Histogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+    assert histogram.mean() == pytest.approx(50.5)
+
+@pytest.mark.parametrize('percentile', [50, 90, 99, 99.9])
+def test_large_value_quantiles_within_relative_error(percentile):
+    histogram = Log_Histogram()
+    for value in range(1, 1000001):
+        histogram.record(value * 1000)
+    expected = percentile / 100 * 1000000 * 1000
+    assert histogram.percentile(percentile) == pytest.approx(expected, rel=0.016)
+
+def test_quantiles_stay_within_recorded_range():
+    histogram = Log_Histogram()
+    histogram.record(1000003)
+    assert histogram.percentile(50) == 1000003
+    assert histogram.percentile(100) == 1000003
+
+def test_samples_are_clamped():
+    histogram = Log_Histogram(max_bits=20)
+    histogram.record(-5)
+    histogram.record(1 << 30)
+    assert histogram.min == 0
+    assert histogram.max == (1 << 20) - 1
+
+
+def test_jitter_of_constant_transit_is_zero():
+    jitter = Jitter_Estimator()
+    for x in range(100):
+        jitter.record(5.0)
+    assert jitter.jitter == 0
+
+def test_jitter_follows_rfc3550_gain():
+    jitter = Jitter_Estimator()
+    jitter.record(10.0)
+    jitter.record(26.0)
+    # J = J + (|D| - J) / 16
+    assert jitter.jitter == pytest.approx(1.0)
+    jitter.record(10.0)
+    assert jitter.jitter == pytest.approx(1.0 + 15 / 16)
+
+def test_jitter_converges_on_alternating_transit():
+    jitter = Jitter_Estimator()
+    for x in range(1000):
+        jitter.record(2.0 if x % 2 else 0.0)
+    assert jitter.jitter == pytest.approx(2.0)
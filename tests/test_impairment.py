@@ -0,0 +1,87 @@
+import pytest
+from impairment import CORRUPT, DROP, REORDER, Impairment, check_Impairment, impairment_Plan
+from packet import HEADER_SIZE, Packet_Writer
+
+SESSION_ID = 0x1234
+ROUND = 1
+
+def plan(round_number=ROUND, packet_count=10000, **settings):
+    return impairment_Plan({'impairment': dict({'seed': 42}, **settings), 'round': round_number, 'packet_count': packet_count}, SESSION_ID)
+
+def packets(count, size=64, session_id=SESSION_ID, round_number=ROUND):
+    writer = Packet_Writer(session_id, round_number, 0x5A, size)
+    return [bytearray(writer.next()) for x in range(count)]
+
+
+def test_unimpaired_round_has_no_plan():
+    assert plan(loss=0) is None
+    assert impairment_Plan({'round': 1, 'packet_count': 10}) is None
+
+def test_seeded_plans_are_reproducible():
+    assert plan(loss=0.1, corrupt=0.05, reorder=0.05).flags == plan(loss=0.1, corrupt=0.05, reorder=0.05).flags
+
+def test_every_round_gets_its_own_pattern():
+    assert plan(1, loss=0.1).flags != plan(2, loss=0.1).flags
+
+def test_each_impairment_draws_independently():
+    # Enabling corruption must not move the drops of the same seed
+    lossy = plan(loss=0.1).flags
+    both = plan(loss=0.1, corrupt=0.1).flags
+    assert [flag & DROP for flag in lossy] == [flag & DROP for flag in both]
+
+def test_loss_fraction():
+    flags = plan(loss=0.1).flags
+    assert sum(1 for flag in flags if flag & DROP) / len(flags) == pytest.approx(0.1, abs=0.015)
+
+def test_gilbert_losses_come_in_bursts():
+    flags = plan(gilbert=[0.01, 0.2, 1, 0]).flags
+    drops = [index for index, flag in enumerate(flags) if flag & DROP]
+    assert drops
+    adjacent = sum(1 for a, b in zip(drops, drops[1:]) if b == a + 1)
+    assert adjacent / len(drops) > 0.5
+
+def test_check_impairment():
+    assert check_Impairment({'loss': 0.5, 'corrupt': 0, 'reorder': 1}) is None
+    assert check_Impairment({'loss': 1.5}) is not None
+    assert check_Impairment({'gilbert': [0.1, 0.2, 0.3]}) is not None
+    assert check_Impairment({'reorder': 0.1, 'depth': 0}) is not None
+
+
+def test_apply_drops_and_corrupts():
+    flags = bytearray(4)
+    flags[1] = DROP
+    flags[2] = CORRUPT
+    impairment = Impairment(flags, SESSION_ID, ROUND)
+    batch = packets(4)
+    original = bytes(batch[2])
+    delivered = impairment.apply(batch)
+    assert len(delivered) == 3
+    assert delivered[1][:HEADER_SIZE] == original[:HEADER_SIZE]
+    assert sum(bin(a ^ b).count('1') for a, b in zip(delivered[1], original)) == 1
+    assert (impairment.dropped, impairment.corrupted) == (1, 1)
+
+def test_apply_reorders_by_depth():
+    flags = bytearray(6)
+    flags[0] = REORDER
+    impairment = Impairment(flags, SESSION_ID, ROUND, depth=2)
+    batch = packets(6)
+    sequences = [bytes(packet) for packet in batch]
+    delivered = [bytes(packet) for packet in impairment.apply(batch)]
+    assert delivered == [sequences[1], sequences[2], sequences[0], sequences[3], sequences[4], sequences[5]]
+
+def test_flush_returns_held_packets():
+    flags = bytearray(2)
+    flags[1] = REORDER
+    impairment = Impairment(flags, SESSION_ID, ROUND)
+    batch = packets(2)
+    assert len(impairment.apply(batch)) == 1
+    assert len(impairment.flush()) == 1
+    assert impairment.flush() == []
+
+def test_other_sessions_and_rounds_pass_untouched():
+    flags = bytearray([DROP | CORRUPT, CORRUPT, REORDER])
+    impairment = Impairment(flags, SESSION_ID, ROUND)
+    batch = packets(3, session_id=SESSION_ID + 1) + packets(3, round_number=ROUND - 1)
+    originals = [bytes(packet) for packet in batch]
+    assert [bytes(packet) for packet in impairment.apply(batch)] == originals
+    assert (impairment.dropped, impairment.corrupted, impairment.reordered) == (0, 0, 0)
@@ -0,0 +1,22 @@
+import pytest
+from mesh import mesh_Schedule
+
+
+@pytest.mark.parametrize('count', range(2, 9))
+def test_every_ordered_pair_runs_once(count):
+    tests = [test for slot in mesh_Schedule(count) for test in slot]
+    assert sorted(tests) == [(a, b) for a in range(count) for b in range(count) if a != b]
+
+@pytest.mark.parametrize('count', range(2, 9))
+def test_no_host_appears_twice_in_a_slot(count):
+    for slot in mesh_Schedule(count):
+        hosts = [host for test in slot for host in test]
+        assert len(hosts) == len(set(hosts))
+
+@pytest.mark.parametrize('count', range(2, 9))
+def test_slot_count(count):
+    rounds = count - 1 if count % 2 == 0 else count
+    assert len(mesh_Schedule(count)) == 2 * rounds
+
+def test_single_host_has_nothing_to_test():
+    assert all(slot == [] for slot in mesh_Schedule(1))
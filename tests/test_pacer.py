@@ -0,0 +1,70 @@
+import time
+import pytest
+from pacer import MAX_BURST, Pacer, Schedule_Pacer
+
+
+def test_deadlines_are_absolute():
+    pacer = Pacer(10, 1.0)
+    pacer.begin(100.0)
+    deadlines = []
+    for x in range(10):
+        deadlines.append(pacer._deadline())
+        pacer.released = pacer.released + 1
+    assert deadlines == pytest.approx([100.0 + i * 0.1 for i in range(10)])
+
+def test_releases_every_packet_over_the_duration():
+    pacer = Pacer(50, 0.05)
+    pacer.begin()
+    released = 0
+    burst = pacer.wait()
+    while burst > 0:
+        released = released + burst
+        burst = pacer.wait()
+    pacer.end()
+    assert released == 50
+    # The last packet is not released before its deadline
+    assert pacer.finish - pacer.start >= 0.049 * 49 / 50
+
+def test_late_packets_are_released_in_bursts():
+    pacer = Pacer(1000, 1.0)
+    # Half the round's deadlines have already passed
+    pacer.begin(time.perf_counter() - 0.5)
+    assert pacer.wait() == MAX_BURST
+    assert pacer.wait() == MAX_BURST
+
+def test_bursts_never_exceed_the_packets_left():
+    pacer = Pacer(5, 1.0)
+    pacer.begin(time.perf_counter() - 10)
+    assert pacer.wait() == 5
+    assert pacer.wait() == 0
+
+def test_achieved_rate():
+    pacer = Pacer(10, 1.0)
+    pacer.start = 0.0
+    pacer.finish = 0.9
+    pacer.released = 10
+    assert pacer.elapsed() == pytest.approx(1.0)
+    assert pacer.achieved_Rate(1000) == pytest.approx(80000)
+
+def test_achieved_packets_per_second():
+    pacer = Pacer(10, 1.0)
+    pacer.start = 0.0
+    pacer.finish = 0.9
+    pacer.released = 10
+    assert pacer.achieved_PPS() == pytest.approx(10)
+
+
+def test_schedule_pacer_follows_the_schedule():
+    pacer = Schedule_Pacer([0.0, 0.0, 0.0, 0.02], 0.03)
+    pacer.begin()
+    # Packets sharing a send time go out together
+    assert pacer.wait() == 3
+    assert pacer.wait() == 1
+    assert time.perf_counter() - pacer.start >= 0.02
+    assert pacer.wait() == 0
+
+def test_schedule_pacer_deadlines():
+    pacer = Schedule_Pacer([0.0, 0.5, 0.75], 1.0)
+    pacer.begin(10.0)
+    pacer.released = 2
+    assert pacer._deadline() == pytest.approx(10.75)
@@ -0,0 +1,108 @@
+from packet import CHECKSUM, CHECKSUM_OFFSET, HEADER, HEADER_SIZE, Packet_Writer, Sequence_Tracker, expected_Fill, stream_Stride, verify_Checksum
+
+SESSION_ID = 0x1234
+ROUND = 3
+
+def packets(sequences, size=64, round_number=ROUND):
+    writer = Packet_Writer(SESSION_ID, round_number, 0x5A, size)
+    result = []
+    for sequence in sequences:
+        writer.sequence = sequence
+        result.append(bytes(writer.next()))
+    return result
+
+
+def test_writer_stamps_header_and_fill():
+    writer = Packet_Writer(SESSION_ID, ROUND, 0x5A, 100)
+    first = bytes(writer.next())
+    second = bytes(writer.next())
+    assert len(first) == 100
+    session_id, round_number, sequence, sent = HEADER.unpack_from(first)
+    assert (session_id, round_number, sequence) == (SESSION_ID, ROUND, 0)
+    assert HEADER.unpack_from(second)[2] == 1
+    assert HEADER.unpack_from(second)[3] >= sent
+    assert first[HEADER_SIZE:] == expected_Fill(0x5A, 100)
+
+def test_writer_starts_at_its_stream_offset():
+    writer = Packet_Writer(SESSION_ID, ROUND, 0x5A, 100, first_sequence=7)
+    assert HEADER.unpack_from(writer.next())[2] == 7
+    assert HEADER.unpack_from(writer.next())[2] == 8
+
+def test_stream_stride():
+    assert stream_Stride(100, 4) == 25
+    assert stream_Stride(101, 4) == 26
+    assert stream_Stride(0, 4) == 1
+
+def test_checksum_is_zero_unless_enabled():
+    assert CHECKSUM.unpack_from(packets([0])[0], CHECKSUM_OFFSET)[0] == 0
+
+def test_checksum_verifies_and_catches_corruption():
+    writer = Packet_Writer(SESSION_ID, ROUND, 0x5A, 200, checksum=True)
+    packet = bytearray(writer.next())
+    assert verify_Checksum(packet)
+    packet[150] ^= 0x01
+    assert not verify_Checksum(packet)
+    packet[150] ^= 0x01
+    packet[9] ^= 0x80
+    assert not verify_Checksum(packet)
+
+def test_checksum_rejects_truncated_packets():
+    assert not verify_Checksum(b'\0' * (HEADER_SIZE - 1))
+
+
+def test_tracker_counts_unique_duplicate_and_stray():
+    tracker = Sequence_Tracker(SESSION_ID, ROUND, 10)
+    for packet in packets([0, 1, 1, 2]):
+        tracker.record(packet)
+    tracker.record(packets([3], round_number=ROUND - 1)[0])
+    tracker.record(packets([10])[0])
+    tracker.record(b'short')
+    assert tracker.unique == 3
+    assert tracker.duplicates == 1
+    assert tracker.stray == 3
+
+def test_tracker_reorder_distance():
+    tracker = Sequence_Tracker(SESSION_ID, ROUND, 10)
+    for packet in packets([0, 3, 1, 2, 4]):
+        tracker.record(packet)
+    assert tracker.out_of_order == 2
+    assert tracker.reorder_total == 3
+    assert tracker.reorder_max == 2
+
+def test_tracker_summary_gaps():
+    tracker = Sequence_Tracker(SESSION_ID, ROUND, 10)
+    for packet in packets([0, 1, 4, 5, 9]):
+        tracker.record(packet)
+    summary = tracker.summary()
+    assert summary['lost'] == 5
+    assert summary['gaps'] == 2
+    assert summary['gap_max'] == 3
+
+def test_tracker_streams_measure_reordering_separately():
+    tracker = Sequence_Tracker(SESSION_ID, ROUND, 20, streams=2)
+    for packet in packets([10, 11, 0, 1]):
+        tracker.record(packet)
+    assert tracker.out_of_order == 0
+    assert tracker.stream_Summary() == [{'stream': 1, 'packets': 10, 'lost': 8}, {'stream': 2, 'packets': 10, 'lost': 8}]
+
+def test_trackers_share_an_arrival_array():
+    seen = bytearray(10)
+    first = Sequence_Tracker(SESSION_ID, ROUND, 10, seen=seen)
+    second = Sequence_Tracker(SESSION_ID, ROUND, 10, seen=seen)
+    first.record(packets([0])[0])
+    assert not second.record(packets([0])[0])
+    second.record(packets([1])[0])
+    first.merge(*second.counters())
+    assert first.unique == 2
+    assert first.duplicates == 1
+    assert first.summary()['lost'] == 8
+
+def test_tracker_missing_counts_below_highest_per_stream():
+    tracker = Sequence_Tracker(SESSION_ID, ROUND, 20, streams=2)
+    # Stream 1 covers 0-9 and stream 2 covers 10-19
+    for packet in packets([0, 2, 5, 10, 11, 13]):
+        tracker.record(packet)
+    assert tracker.missing() == 3 + 1
+    # A late arrival fills a gap
+    tracker.record(packets([1])[0])
+    assert tracker.missing() == 3
@@ -0,0 +1,60 @@
+import pytest
+from profiles import PHASES, check_Profile, compile_Schedule, phase_Names, phase_Summary
+
+
+def test_constant_schedule():
+    times, phases = compile_Schedule({'type': 'constant'}, 8, 1.0)
+    assert list(times) == pytest.approx([i / 8 for i in range(8)])
+    assert list(phases) == [0, 0, 1, 1, 2, 2, 3, 3]
+
+def test_microburst_schedule():
+    times, phases = compile_Schedule({'type': 'microburst', 'burst': 4}, 8, 1.0)
+    assert list(times) == pytest.approx([0, 0, 0, 0, 0.5, 0.5, 0.5, 0.5])
+    assert list(phases) == [0, 1, 2, 3, 0, 1, 2, 3]
+
+def test_onoff_schedule_keeps_the_average_rate():
+    times, phases = compile_Schedule({'type': 'onoff', 'on': 0.1, 'off': 0.1}, 100, 1.0)
+    assert len(times) == 100
+    # Packets are paced at twice the round's rate during each on period
+    assert times[1] - times[0] == pytest.approx(0.005)
+    assert all(time % 0.2 < 0.1 + 1e-9 for time in times)
+
+def test_poisson_schedule_is_seeded():
+    first = compile_Schedule({'type': 'poisson'}, 1000, 1.0, 'seed:1')
+    again = compile_Schedule({'type': 'poisson'}, 1000, 1.0, 'seed:1')
+    other = compile_Schedule({'type': 'poisson'}, 1000, 1.0, 'seed:2')
+    assert first == again
+    assert first[0] != other[0]
+
+def test_poisson_phase_is_the_gap_before_each_packet():
+    times, phases = compile_Schedule({'type': 'poisson'}, 1000, 1.0, 7)
+    assert times[-1] == pytest.approx(1.0)
+    assert all(b >= a for a, b in zip(times, times[1:]))
+    gaps = [times[0]] + [b - a for a, b in zip(times, times[1:])]
+    order = sorted(range(len(gaps)), key=lambda index: gaps[index])
+    assert all(phases[a] <= phases[b] for a, b in zip(order, order[1:]))
+    # The gap quartiles split the packets roughly evenly
+    assert all(abs(phases.count(phase) - 250) < 60 for phase in range(PHASES))
+
+def test_ramp_schedule():
+    times, phases = compile_Schedule({'type': 'ramp', 'start': 1, 'end': 3}, 1000, 1.0)
+    assert all(b > a for a, b in zip(times, times[1:]))
+    assert times[-1] < 1.0
+    # The rate rises, so gaps shrink
+    assert times[1] - times[0] > times[-1] - times[-2]
+
+def test_check_profile():
+    assert check_Profile({'type': 'constant'}) is None
+    assert check_Profile({'type': 'microburst', 'burst': 8}) is None
+    assert check_Profile({'type': 'sawtooth'}) is not None
+    assert check_Profile({'type': 'microburst'}) is not None
+    assert check_Profile({'type': 'microburst', 'burst': 0}) is not None
+    assert check_Profile({'type': 'onoff', 'on': 0, 'off': 1}) is not None
+    assert check_Profile({'type': 'ramp', 'start': 0, 'end': 0}) is not None
+
+def test_phase_summary():
+    phases = bytearray([0, 0, 1, 1, 2, 2, 3, 3])
+    seen = bytearray([1, 0, 1, 1, 0, 0, 1, 1])
+    summary = phase_Summary(phases, seen, phase_Names({'type': 'constant'}))
+    assert [row['packets'] for row in summary] == [2, 2, 2, 2]
+    assert [row['lost'] for row in summary] == [50, 0, 100, 0]
@@ -0,0 +1,271 @@
+#!/usr/bin/python3
+
+import selectors
+import socket
+import sys
+import time
+
+# The largest datagram either side will send or receive
+MAX_DATAGRAM = 9216
+# The number of preallocated receive buffers drained per batch
+RING_SLOTS = 64
+# Non-blocking receive flag. Platforms without it fall back to one blocking receive per packet
+DONTWAIT = getattr(socket, 'MSG_DONTWAIT', 0)
+# Once a round is stopped, receiving continues until the socket has been idle this many seconds...
+STOP_LINGER = 0.05
+# ...but never for longer than this, so a steady stream of stray packets cannot hold a round open
+STOP_DRAIN_MAX = 1.0
+
+# A round stop flag with a self-pipe, so a receiver blocked in select() wakes the moment the round ends
+# instead of waiting out its timeout. Calling the signal returns whether it has been set, matching the
+# signal() callables the receive loops already poll.
+class Stop_Signal:
+
+    def __init__(self):
+        self.reader, self.writer = socket.socketpair()
+        self.reader.setblocking(False)
+        self.stopped = False
+
+    def __call__(self):
+        return self.stopped
+
+    def set(self):
+        if not self.stopped:
+            self.stopped = True
+            self.writer.send(b'\0')
+
+    def fileno(self):
+        return self.reader.fileno()
+
+    def close(self):
+        self.reader.close()
+        self.writer.close()
+
+# A preallocated ring of receive buffers. Datagrams are received in place via recvfrom_into and exposed as
+# memoryviews, so the hot receive loop never allocates a new bytes object per packet. Where MSG_DONTWAIT is
+# supported, each call waits once for readability and then drains every queued datagram (up to the ring size)
+# without blocking, giving recvmmsg-style batches. If a Stop_Signal is given it is watched alongside the
+# socket. Once it is set, recv_Batch keeps draining stragglers but raises socket.timeout as soon as the
+# socket has been idle for STOP_LINGER seconds.
+# Param: udp_socket: The udp socket to be received from
+# Param: signal: An optional Stop_Signal that ends the round
+# Param: slots: The number of buffers in the ring (the maximum batch size)
+# Param: size: The size of each buffer in bytes
+# Param: profile: An optional Hot_Path_Profile that receives the time spent receiving and idle waiting for packets
+# A connected socket reports an ICMP port unreachable from its peer as ConnectionRefusedError on the next call.
+# The ring counts these in refused and carries on, so a peer that goes away ends the round as loss, not a crash.
+class Recv_Ring:
+
+    def __init__(self, udp_socket, signal=None, slots=RING_SLOTS, size=MAX_DATAGRAM, profile=None):
+        self.udp_socket = udp_socket
+        self.signal = signal
+        self.profile = profile
+        self.watching = False
+        self.deadline = None
+        self.buffers = [bytearray(size) for x in range(slots)]
+        self.views = [memoryview(buffer) for buffer in self.buffers]
+        self.lengths = [0] * slots
+        self.addresses = [None] * slots
+        self.refused = 0
+        self.batched = DONTWAIT != 0
+        self.selector = None
+        if self.batched:
+            # Readiness is handled by the selector, so the socket itself stays in blocking mode for any concurrent senders
+            udp_socket.settimeout(None)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(udp_socket, selectors.EVENT_READ)
+            if signal is not None:
+                self.selector.register(signal, selectors.EVENT_READ)
+                self.watching = True
+
+    # Receives the next batch of datagrams into the ring and returns how many slots were filled
+    # Raises socket.timeout if nothing arrives within timeout seconds
+    def recv_Batch(self, timeout):
+        if self.signal is not None and self.signal():
+            timeout = self._linger(timeout)
+
+        if not self.batched:
+            self.udp_socket.settimeout(timeout)
+            try:
+                self.lengths[0], self.addresses[0] = self.udp_socket.recvfrom_into(self.views[0])
+            except ConnectionRefusedError:
+                self.refused = self.refused + 1
+                return 0
+            return 1
+
+        if self.profile is not None:
+            return self._profiled_Batch(timeout)
+        count = self._drain()
+        if count == 0:
+            if not self.selector.select(timeout):
+                raise socket.timeout('timed out')
+            count = self._drain()
+        return count
+
+    # recv_Batch with the time spent draining the socket and waiting for it to become readable recorded
+    def _profiled_Batch(self, timeout):
+        start = time.perf_counter_ns()
+        count = self._drain()
+        drained = time.perf_counter_ns()
+        if count > 0:
+            self.profile.add('receiver;recv', drained - start)
+            return count
+        ready = self.selector.select(timeout)
+        woke = time.perf_counter_ns()
+        self.profile.add('receiver;idle', woke - drained)
+        if not ready:
+            self.profile.add('receiver;recv', drained - start)
+            raise socket.timeout('timed out')
+        count = self._drain()
+        self.profile.add('receiver;recv', time.perf_counter_ns() - woke + drained - start)
+        return count
+
+    # Returns a zero-copy view of the datagram held in the given slot
+    def packet(self, index):
+        return self.views[index][:self.lengths[index]]
+
+    # Switches to end-of-round draining and returns the timeout to use for the next wait
+    def _linger(self, timeout):
+        if self.watching:
+            # The self-pipe stays readable once set, so stop watching it or select() would spin
+            self.selector.unregister(self.signal)
+            self.watching = False
+        if self.deadline is None:
+            self.deadline = time.monotonic() + STOP_DRAIN_MAX
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout('timed out')
+        return min(timeout, STOP_LINGER, remaining)
+
+    def close(self):
+        if self.selector is not None:
+            self.selector.close()
+            self.selector = None
+
+    def _drain(self):
+        count = 0
+        slots = len(self.views)
+        recvfrom_into = self.udp_socket.recvfrom_into
+        while count < slots:
+            try:
+                self.lengths[count], self.addresses[count] = recvfrom_into(self.views[count], 0, DONTWAIT)
+            except (BlockingIOError, InterruptedError):
+                break
+            except ConnectionRefusedError:
+                # The error is cleared by reporting it, so the next call goes on receiving
+                self.refused = self.refused + 1
+                continue
+            count = count + 1
+        return count
+
+# Sends batches of datagrams to a single destination. The socket is connected to the destination when
+# possible so each datagram goes out through send() without per-call address resolution, falling back
+# to sendto() otherwise. CPython exposes no sendmmsg, so a batch is a tight loop over the bound method.
+# Param: udp_socket: The udp socket to send from
+# Param: address: The (host, port) destination of every datagram
+# Param: connect: Whether to connect the socket. A connected socket only receives from its destination
+# Once the destination has answered a datagram with an ICMP port unreachable, a connected socket fails the next
+# send with ConnectionRefusedError. That datagram is not sent, so it is counted in refused as lost and sending
+# carries on; the round then ends on the control connection, which sees the server go away.
+class Batch_Sender:
+
+    def __init__(self, udp_socket, address, connect=True):
+        self.udp_socket = udp_socket
+        self.address = address
+        self.connected = False
+        self.refused = 0
+        if connect:
+            try:
+                udp_socket.connect(address)
+                self.connected = True
+            except OSError:
+                pass
+
+    # Sends count copies of payload back to back
+    def send(self, payload, count):
+        if self.connected:
+            send = self.udp_socket.send
+            for x in range(count):
+                try:
+                    send(payload)
+                except ConnectionRefusedError:
+                    self.refused = self.refused + 1
+        else:
+            sendto = self.udp_socket.sendto
+            address = self.address
+            for x in range(count):
+                sendto(payload, address)
+
+
+    # Sends the next count datagrams produced by writer (see packet.Packet_Writer) back to back
+    def send_Sequenced(self, writer, count):
+        next_packet = writer.next
+        if self.connected:
+            send = self.udp_socket.send
+            for x in range(count):
+                try:
+                    send(next_packet())
+                except ConnectionRefusedError:
+                    self.refused = self.refused + 1
+        else:
+            sendto = self.udp_socket.sendto
+            address = self.address
+            for x in range(count):
+                sendto(next_packet(), address)
+
+# Linux socket options for path MTU discovery, which the socket module does not export
+IP_MTU_DISCOVER = getattr(socket, 'IP_MTU_DISCOVER', 10)
+IP_PMTUDISC_WANT = getattr(socket, 'IP_PMTUDISC_WANT', 1)
+IP_PMTUDISC_DO = getattr(socket, 'IP_PMTUDISC_DO', 2)
+IP_MTU = getattr(socket, 'IP_MTU', 14)
+
+# Sets or clears the don't-fragment bit on outgoing datagrams. Returns False where this is unsupported
+def set_Dont_Fragment(udp_socket, enabled):
+    if not sys.platform.startswith('linux'):
+        return False
+    try:
+        udp_socket.setsockopt(socket.IPPROTO_IP, IP_MTU_DISCOVER, IP_PMTUDISC_DO if enabled else IP_PMTUDISC_WANT)
+        return True
+    except OSError:
+        return False
+
+# Returns the kernel's current path MTU estimate for a connected socket, or None where unavailable
+def path_MTU(udp_socket):
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        return udp_socket.getsockopt(socket.IPPROTO_IP, IP_MTU)
+    except OSError:
+        return None
+
+# Socket buffers are sized to hold this many seconds of traffic at the round's rate...
+BUFFER_SECONDS = 0.1
+# ...within these bounds in bytes
+MIN_BUFFER = 256 * 1024
+MAX_BUFFER = 128 * 1024 * 1024
+# Linux options that let a privileged process exceed net.core.rmem_max / wmem_max
+SO_RCVBUFFORCE = getattr(socket, 'SO_RCVBUFFORCE', 33)
+SO_SNDBUFFORCE = getattr(socket, 'SO_SNDBUFFORCE', 32)
+
+def _size_Buffer(udp_socket, option, force, rate):
+    size = int(min(max(rate / 8 * BUFFER_SECONDS, MIN_BUFFER), MAX_BUFFER))
+    try:
+        if sys.platform.startswith('linux'):
+            udp_socket.setsockopt(socket.SOL_SOCKET, force, size)
+        else:
+            udp_socket.setsockopt(socket.SOL_SOCKET, option, size)
+    except OSError:
+        # Unprivileged: the kernel silently clamps this to its configured maximum
+        try:
+            udp_socket.setsockopt(socket.SOL_SOCKET, option, size)
+        except OSError:
+            pass
+    return udp_socket.getsockopt(socket.SOL_SOCKET, option)
+
+# Sizes the socket's receive buffer for a round at rate bits per second and returns the size the kernel granted
+def size_Receive_Buffer(udp_socket, rate):
+    return _size_Buffer(udp_socket, socket.SO_RCVBUF, SO_RCVBUFFORCE, rate)
+
+# Sizes the socket's send buffer for a round at rate bits per second and returns the size the kernel granted
+def size_Send_Buffer(udp_socket, rate):
+    return _size_Buffer(udp_socket, socket.SO_SNDBUF, SO_SNDBUFFORCE, rate)